@@ -18,7 +18,10 @@ from pheval_elder.prepare.config.unified_config import (
 from pheval_elder.prepare.config.config_validator import (
     validate_config, ConfigValidationError
 )
+from pheval_elder.prepare.core.query.exact_search import SearchBackend
 from pheval_elder.prepare.core.run.elder import ElderRunner
+from pheval_elder.prepare.core.store.embedding_store import EmbeddingPrecision
+from pheval_elder.prepare.core.store.index_profiles import IndexProfile
 from pheval_elder.prepare.core.utils.logging import get_logger
 
 
@@ -118,8 +121,21 @@ class BaseElderRunner(PhEvalRunner):
         self.logger.info(f"Initializing ElderRunner with strategy: {self.config.runner.runner_type.value}")
         self.elder_runner = ElderRunner(
             similarity_measure=self.config.db.similarity_measure,
+            embedding_precision=self.config.db.embedding_precision,
+            incremental_update=self.config.processing.incremental_update,
+            search_backend=self.config.processing.search_backend,
+            query_batch_size=self.config.processing.batch_size,
+            use_result_cache=self.config.processing.result_cache,
+            result_cache_dir=self.config.processing.result_cache_dir,
+            chroma_host=self.config.db.chroma_host,
+            chroma_port=self.config.db.chroma_port,
+            index_profile=self.config.db.index_profile,
+            max_in_flight_queries=self.config.processing.max_in_flight_queries,
+            tcp_memory_budget_mb=self.config.processing.tcp_memory_budget_mb,
+            tcp_similarity_matrix=self.config.processing.tcp_similarity_matrix,
             collection_name=self.config.db.collection_name,
             strategy=self.config.runner.runner_type.value,
+            strategies=self.config.runner.strategies,
             embedding_model=(
                 self.config.runner.custom_model_name or 
                 self.config.runner.model_type.value
@@ -216,6 +232,36 @@ class BaseElderRunner(PhEvalRunner):
                     config.db.chroma_db_path = value
                     # config.runner.db_path = config.db.chroma_db_path
                     logger.info(f"Overriding db_collection_path with {value}")
+                elif key == "embedding_precision" and value:
+                    config.db.embedding_precision = EmbeddingPrecision(value)
+                    logger.info(f"Overriding embedding_precision with {value}")
+                elif key == "incremental_update" and value:
+                    config.processing.incremental_update = True
+                    logger.info("Overriding incremental_update with True")
+                elif key == "search_backend" and value:
+                    config.processing.search_backend = SearchBackend(value)
+                    logger.info(f"Overriding search_backend with {value}")
+                elif key == "result_cache" and value:
+                    config.processing.result_cache = True
+                    logger.info("Overriding result_cache with True")
+                elif key == "chroma_host" and value:
+                    config.db.chroma_host = value
+                    logger.info(f"Overriding chroma_host with {value}")
+                elif key == "chroma_port" and value:
+                    config.db.chroma_port = int(value)
+                    logger.info(f"Overriding chroma_port with {value}")
+                elif key == "index_profile" and value:
+                    config.db.index_profile = IndexProfile(value)
+                    logger.info(f"Overriding index_profile with {value}")
+                elif key == "tcp_memory_budget_mb" and value:
+                    config.processing.tcp_memory_budget_mb = int(value)
+                    logger.info(f"Overriding tcp_memory_budget_mb with {value}")
+                elif key == "tcp_similarity_matrix" and value:
+                    config.processing.tcp_similarity_matrix = True
+                    logger.info("Overriding tcp_similarity_matrix with True")
+                elif key == "strategies" and value:
+                    config.runner.strategies = list(value)
+                    logger.info(f"Overriding strategies with {value}")
         
         repo_root = Path(__file__).parent.parents[1]
         output_dir = repo_root / "output"
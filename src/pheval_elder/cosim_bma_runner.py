@@ -73,7 +73,7 @@ class BestMatchRunner(BaseElderRunner):
             for file_name, result_set in zip(file_names, all_results):
                 if result_set:
                     self.current_file_name = file_name
-                    self.results = result_set
+                    self.results = self.elder_runner.pheval_results(result_set)
                     self.post_process()
         else:
             raise RuntimeError(f"Invalid strategy: {self.elder_runner.strategy}")
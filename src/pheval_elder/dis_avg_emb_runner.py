@@ -10,13 +10,11 @@ from dataclasses import dataclass, field
 from pathlib import Path
 from typing import List, Any, Optional, Union
 
-import multiprocessing as mp
 from pheval.post_processing.post_processing import PhEvalDiseaseResult, generate_pheval_result
 from pheval.utils.file_utils import all_files
 from pheval.utils.phenopacket_utils import PhenopacketUtil, phenopacket_reader
 from tqdm import tqdm
 
-import pheval_elder.prepare.core.collections.globals as g
 from pheval_elder.base_runner import BaseElderRunner
 from pheval_elder.prepare.config.config_loader import load_config_path
 from pheval_elder.prepare.config.unified_config import RunnerType
@@ -63,15 +61,12 @@ class DiseaseAvgEmbRunner(BaseElderRunner):
             file_names.append(file_path.name)
             phenotype_sets.append(observed_phenotypes_hpo_ids)
 
-        # Initialize the global collection for multiprocessing
-        g.global_avg_disease_emb_collection = self.elder_runner.disease_service.disease_new_avg_embeddings_collection
-        
         if self.elder_runner is not None and self.elder_runner.strategy == "avg":
             self.results = self.elder_runner.optimized_avg_analysis(phenotype_sets, self.config.runner.nr_of_results)
             for file_name, result_set in zip(file_names, self.results):
                 if result_set:
                     self.current_file_name = file_name
-                    self.results = result_set
+                    self.results = self.elder_runner.pheval_results(result_set)
                     self.post_process()
         else:
             raise RuntimeError(f"Invalid strategy: {self.elder_runner.strategy}")
@@ -110,7 +105,6 @@ class DiseaseAvgEmbRunner(BaseElderRunner):
 
 
 if __name__ == "__main__":
-    mp.set_start_method('fork', force=True)
     config_path = load_config_path()
     repo_root = Path(__file__).parent.parents[1]
     runner = DiseaseAvgEmbRunner.from_config(
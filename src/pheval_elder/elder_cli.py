@@ -15,15 +15,70 @@ from click_default_group import __version__
 from pheval_elder.dis_avg_emb_runner import DiseaseAvgEmbRunner
 from pheval_elder.dis_wgt_avg_emb_runner import DisWgtAvgEmbRunner
 from pheval_elder.cosim_bma_runner import BestMatchRunner
+from pheval_elder.multi_strategy_runner import MultiStrategyRunner
 from pheval_elder.prepare.config.unified_config import (
     RunnerType, ModelType, get_config, set_config, ConfigLoader
 )
+from pheval_elder.prepare.core.query.exact_search import SearchBackend
+from pheval_elder.prepare.core.store.embedding_store import EmbeddingPrecision
+from pheval_elder.prepare.core.store.index_profiles import IndexProfile
 from pheval_elder.prepare.core.utils.similarity_measures import SimilarityMeasures
 
 __all__ = [
     "main",
 ]
 
+precision_option = click.option(
+    "--precision",
+    type=click.Choice([p.value for p in EmbeddingPrecision], case_sensitive=False),
+    help="Storage precision of the HPO embedding store (default: float32)"
+)
+
+backend_option = click.option(
+    "--backend",
+    type=click.Choice([b.value for b in SearchBackend], case_sensitive=False),
+    help="Disease search backend: Chroma HNSW queries or the exact in-process search (default: chroma)"
+)
+
+incremental_option = click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="Only recompute diseases added or changed since the last build of the disease collection"
+)
+
+cache_option = click.option(
+    "--cache",
+    is_flag=True,
+    default=False,
+    help="Reuse the results of phenotype sets already analysed with the same model, strategy and k"
+)
+
+host_option = click.option(
+    "--host",
+    type=str,
+    help="Host of a Chroma server serving the collections (client/server mode instead of --db-path)"
+)
+
+port_option = click.option(
+    "--port",
+    type=int,
+    help="Port of the Chroma server (default: 8000)"
+)
+
+memory_budget_option = click.option(
+    "--memory-budget",
+    type=int,
+    help="Compute the best-match similarities in tiles within this budget (MB per worker) instead of all at once"
+)
+
+similarity_matrix_option = click.option(
+    "--similarity-matrix",
+    is_flag=True,
+    default=False,
+    help="Look the best-match similarities up in the matrix built by `elder build-similarities`"
+)
+
 
 @click.option("-v", "--verbose", count=True, help="Increase verbosity (can be used multiple times)")
 @click.option("-q", "--quiet", is_flag=True, help="Suppress all output except errors")
@@ -94,8 +149,14 @@ def elder(ctx, config: Optional[Path]):
     type=str,
     help="Path to the ChromaDB directory"
 )
+@precision_option
+@incremental_option
+@backend_option
+@cache_option
+@host_option
+@port_option
 @click.pass_context
-def average(ctx, model, phenopackets, results, collection, db_path):
+def average(ctx, model, phenopackets, results, collection, db_path, precision, incremental, backend, cache, host, port):
     """
     Run analysis using the 'average' strategy.
     
@@ -114,6 +175,12 @@ def average(ctx, model, phenopackets, results, collection, db_path):
             "nr_of_results" : results,
             "collection_name" : collection,
             "db_collection_path" : db_path,
+            "embedding_precision" : precision,
+            "incremental_update" : incremental,
+            "search_backend" : backend,
+            "result_cache" : cache,
+            "chroma_host" : host,
+            "chroma_port" : port,
         }
     )
     
@@ -152,8 +219,14 @@ def average(ctx, model, phenopackets, results, collection, db_path):
     type=str,
     help="Path to the ChromaDB directory"
 )
+@precision_option
+@incremental_option
+@backend_option
+@cache_option
+@host_option
+@port_option
 @click.pass_context
-def weighted(ctx, model, phenopackets, results, collection, db_path):
+def weighted(ctx, model, phenopackets, results, collection, db_path, precision, incremental, backend, cache, host, port):
     """
     Run analysis using the 'weighted average' strategy.
     
@@ -172,6 +245,12 @@ def weighted(ctx, model, phenopackets, results, collection, db_path):
             "nr_of_results": results,
             "collection_name": collection,
             "db_collection_path": db_path,
+            "embedding_precision": precision,
+            "incremental_update": incremental,
+            "search_backend": backend,
+            "result_cache": cache,
+            "chroma_host": host,
+            "chroma_port": port,
         }
     )
     
@@ -210,8 +289,15 @@ def weighted(ctx, model, phenopackets, results, collection, db_path):
     type=str,
     help="Path to the ChromaDB directory"
 )
+@precision_option
+@cache_option
+@host_option
+@port_option
+@memory_budget_option
+@similarity_matrix_option
 @click.pass_context
-def bestmatch(ctx, model, phenopackets, results, collection, db_path):
+def bestmatch(ctx, model, phenopackets, results, collection, db_path, precision, cache, host, port, memory_budget,
+              similarity_matrix):
     """
     Run analysis using the 'best match' strategy.
     
@@ -230,6 +316,12 @@ def bestmatch(ctx, model, phenopackets, results, collection, db_path):
             "nr_of_results" : results,
             "collection_name" : collection,
             "db_collection_path" : db_path,
+            "embedding_precision" : precision,
+            "result_cache" : cache,
+            "chroma_host" : host,
+            "chroma_port" : port,
+            "tcp_memory_budget_mb" : memory_budget,
+            "tcp_similarity_matrix" : similarity_matrix,
         }
     )
     
@@ -237,6 +329,384 @@ def bestmatch(ctx, model, phenopackets, results, collection, db_path):
     runner.run()
 
 
+@elder.command()
+@click.option(
+    "--strategies",
+    "-s",
+    type=str,
+    default="avg,wgt_avg,tpc",
+    show_default=True,
+    help="Comma-separated strategies to evaluate in one run (avg, wgt_avg, tpc, tpc_sym, tpc_max, tpc_wgt)"
+)
+@click.option(
+    "--model", 
+    "-m", 
+    type=click.Choice([m.value for m in ModelType], case_sensitive=False),
+    help="Embedding model to use"
+)
+@click.option(
+    "--phenopackets", 
+    "-p", 
+    type=str,
+    help="Number of phenopackets to process (e.g., 385 or 5084)"
+)
+@click.option(
+    "--results", 
+    "-r", 
+    type=int,
+    help="Number of results to return"
+)
+@click.option(
+    "--collection", 
+    "-n", 
+    type=str,
+    help="Name of the collection to use"
+)
+@click.option(
+    "--db-path", 
+    "-d", 
+    type=str,
+    help="Path to the ChromaDB directory"
+)
+@precision_option
+@incremental_option
+@backend_option
+@cache_option
+@host_option
+@port_option
+@memory_budget_option
+@similarity_matrix_option
+@click.pass_context
+def compare(ctx, strategies, model, phenopackets, results, collection, db_path, precision, incremental, backend,
+            cache, host, port, memory_budget, similarity_matrix):
+    """
+    Run several strategies in one pass over the phenopackets.
+
+    The inputs are loaded once, every worker computes all strategies for its
+    phenotype sets, and each strategy is written to its own results directory.
+
+    Example:
+        elder compare --strategies avg,wgt_avg,tpc --model large --phenopackets 5084
+    """
+    runner = MultiStrategyRunner.from_config(
+        config_path=ctx.obj.get("config_path"),
+        config_overrides={
+            "strategies": [strategy.strip() for strategy in strategies.split(",") if strategy.strip()],
+            "model_type": model,
+            "nr_of_phenopackets": phenopackets,
+            "nr_of_results": results,
+            "collection_name": collection,
+            "db_collection_path": db_path,
+            "embedding_precision": precision,
+            "incremental_update": incremental,
+            "search_backend": backend,
+            "result_cache": cache,
+            "chroma_host": host,
+            "chroma_port": port,
+            "tcp_memory_budget_mb": memory_budget,
+            "tcp_similarity_matrix": similarity_matrix,
+        }
+    )
+
+    runner.prepare()
+    runner.run()
+
+
+@elder.command(name="precision-report")
+@click.option(
+    "--collection",
+    "-n",
+    type=str,
+    help="Name of the HPO embedding collection (defaults to config value)"
+)
+@click.option(
+    "--db-path",
+    "-d",
+    type=str,
+    help="Path to the ChromaDB directory (defaults to config value)"
+)
+@click.option(
+    "--phenopackets-dir",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    required=True,
+    help="Directory with the phenopackets to evaluate"
+)
+@click.option(
+    "--precision",
+    "precisions",
+    multiple=True,
+    type=click.Choice([p.value for p in EmbeddingPrecision], case_sensitive=False),
+    help="Precision to evaluate (repeatable, default: all)"
+)
+@click.option("--top-k", "-k", type=int, default=10, show_default=True, help="Number of top ranks to compare")
+@click.option("--limit", type=int, help="Maximum number of phenopackets to evaluate")
+@click.option("--output", "-o", type=click.Path(dir_okay=False, path_type=Path), help="Write the report as TSV")
+@click.pass_context
+def precision_report(ctx, collection, db_path, phenopackets_dir, precisions, top_k, limit, output):
+    """
+    Compare reduced-precision embedding stores against a float64 baseline.
+
+    Ranks all diseases with the average strategy for every phenopacket and
+    reports top-k agreement, rank shifts and memory footprint per precision.
+
+    Example:
+        elder precision-report --phenopackets-dir 5084_phenopackets --top-k 10
+    """
+    from pheval_elder.post_process.precision_report import precision_accuracy_report, format_precision_report
+    from pheval_elder.prepare.core.data_processing.data_processor import DataProcessor
+    from pheval_elder.prepare.core.store.chromadb_manager import ChromaDBManager
+    from pheval_elder.prepare.core.utils.phenopackets import read_phenotype_sets
+
+    config = get_config(ctx.obj.get("config_path"))
+    db_manager = ChromaDBManager(
+        collection_name=collection or config.db.collection_name,
+        path=db_path or config.db.chroma_db_path,
+        similarity=config.db.similarity_measure,
+    )
+    data_processor = DataProcessor(db_manager=db_manager)
+    _, phenotype_sets = read_phenotype_sets(phenopackets_dir, limit=limit)
+    click.echo(f"Evaluating {len(phenotype_sets)} phenopackets")
+
+    report = precision_accuracy_report(
+        store=data_processor.hp_embedding_store,
+        disease_to_hps=data_processor.disease_to_hps,
+        phenotype_sets=phenotype_sets,
+        precisions=precisions or tuple(EmbeddingPrecision),
+        k=top_k,
+    )
+    table = format_precision_report(report, top_k)
+    click.echo(table)
+    if output:
+        output.write_text(table + "\n")
+        click.echo(f"Report written to {output}")
+
+
+@elder.command(name="index-sweep")
+@click.option(
+    "--collection",
+    "-n",
+    type=str,
+    help="Name of the HPO embedding collection (defaults to config value)"
+)
+@click.option(
+    "--db-path",
+    "-d",
+    type=str,
+    help="Path to the ChromaDB directory (defaults to config value)"
+)
+@click.option(
+    "--phenopackets-dir",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    required=True,
+    help="Directory with the phenopackets to query with"
+)
+@click.option(
+    "--strategy",
+    type=click.Choice([RunnerType.AVERAGE.value, RunnerType.WEIGHTED_AVERAGE.value], case_sensitive=False),
+    default=RunnerType.AVERAGE.value,
+    show_default=True,
+    help="Disease embedding strategy the collections are built for"
+)
+@click.option(
+    "--profile",
+    "profiles",
+    multiple=True,
+    type=click.Choice([p.value for p in IndexProfile], case_sensitive=False),
+    help="Index profile to evaluate (repeatable, default: all)"
+)
+@click.option(
+    "--params",
+    "custom_params",
+    multiple=True,
+    type=str,
+    help="Additional HNSW parameters to evaluate as M:construction_ef:search_ef (repeatable)"
+)
+@click.option("--top-k", "-k", type=int, default=10, show_default=True, help="Number of top ranks to compare")
+@click.option("--limit", type=int, help="Maximum number of phenopackets to query with")
+@click.option("--output", "-o", type=click.Path(dir_okay=False, path_type=Path), help="Write the report as TSV")
+@click.pass_context
+def index_sweep(ctx, collection, db_path, phenopackets_dir, strategy, profiles, custom_params, top_k, limit, output):
+    """
+    Compare HNSW parameter sets of the disease collections.
+
+    Builds a scratch collection per parameter set and reports build time,
+    query latency and recall@k against the exact search.
+
+    Example:
+        elder index-sweep --phenopackets-dir 5084_phenopackets --params 24:300:400
+    """
+    from pheval_elder.post_process.index_sweep import index_sweep as run_index_sweep, format_index_sweep
+    from pheval_elder.prepare.core.collections.disease_embedding_builder import DiseaseEmbeddingBuilder
+    from pheval_elder.prepare.core.data_processing.data_processor import DataProcessor
+    from pheval_elder.prepare.core.query.exact_search import average_query_embeddings
+    from pheval_elder.prepare.core.store.chromadb_manager import ChromaDBManager
+    from pheval_elder.prepare.core.store.index_profiles import HNSWParams, hnsw_params
+    from pheval_elder.prepare.core.utils.phenopackets import read_phenotype_sets
+
+    try:
+        parameter_sets = [(profile, hnsw_params(profile)) for profile in profiles or [p.value for p in IndexProfile]]
+        parameter_sets += [(text, HNSWParams.parse(text)) for text in custom_params]
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--params")
+
+    config = get_config(ctx.obj.get("config_path"))
+    db_manager = ChromaDBManager(
+        collection_name=collection or config.db.collection_name,
+        path=db_path or config.db.chroma_db_path,
+        similarity=config.db.similarity_measure,
+    )
+    data_processor = DataProcessor(db_manager=db_manager)
+    builder = DiseaseEmbeddingBuilder(store=data_processor.hp_embedding_store)
+    if strategy == RunnerType.WEIGHTED_AVERAGE.value:
+        disease_embeddings = builder.weighted_average(data_processor.disease_to_hps_with_frequencies)
+    else:
+        disease_embeddings = builder.average(data_processor.disease_to_hps)
+    _, phenotype_sets = read_phenotype_sets(phenopackets_dir, limit=limit)
+    _, queries = average_query_embeddings(data_processor.hp_embedding_store, phenotype_sets)
+    click.echo(f"Sweeping {len(parameter_sets)} parameter sets over {len(disease_embeddings)} diseases "
+               f"with {len(queries)} phenopackets")
+
+    report = run_index_sweep(
+        disease_embeddings,
+        queries,
+        parameter_sets,
+        k=top_k,
+        similarity=config.db.similarity_measure,
+        query_batch_size=config.processing.batch_size,
+    )
+    table = format_index_sweep(report, top_k)
+    click.echo(table)
+    if output:
+        output.write_text(table + "\n")
+        click.echo(f"Report written to {output}")
+
+
+@elder.command(name="build-similarities")
+@click.option(
+    "--collection",
+    "-n",
+    type=str,
+    help="Name of the HPO embedding collection (defaults to config value)"
+)
+@click.option(
+    "--db-path",
+    "-d",
+    type=str,
+    help="Path to the ChromaDB directory (defaults to config value)"
+)
+@click.option("--tile-size", type=int, default=2048, show_default=True, help="Edge length of the computed tiles")
+@click.option("--workers", type=int, help="Number of threads computing tiles (default: CPU count)")
+@click.option("--force", is_flag=True, default=False, help="Rebuild even if an up-to-date matrix exists")
+@click.pass_context
+def build_similarities(ctx, collection, db_path, tile_size, workers, force):
+    """
+    Build the persistent HPO x HPO similarity matrix of an embedding collection.
+
+    The float16 matrix is stored next to the ChromaDB directory and used by
+    best-match runs with --similarity-matrix instead of recomputing similarities.
+
+    Example:
+        elder build-similarities --collection large3_lrd_hpo_embeddings --db-path ./data/large3
+    """
+    from pheval_elder.prepare.core.data_processing.data_processor import DataProcessor
+    from pheval_elder.prepare.core.store.chromadb_manager import ChromaDBManager
+
+    config = get_config(ctx.obj.get("config_path"))
+    db_manager = ChromaDBManager(
+        collection_name=collection or config.db.collection_name,
+        path=db_path or config.db.chroma_db_path,
+        similarity=config.db.similarity_measure,
+    )
+    data_processor = DataProcessor(db_manager=db_manager)
+    if not force and data_processor.load_similarity_matrix() is not None:
+        click.echo(f"Similarity matrix in {data_processor.similarity_matrix_dir} is up to date")
+        return
+    matrix = data_processor.build_similarity_matrix(tile_size=tile_size, workers=workers)
+    click.echo(f"Built {len(matrix)} x {len(matrix)} similarity matrix "
+               f"({matrix.matrix.nbytes / 1e6:.0f} MB) at {matrix.path}")
+
+
+@elder.group()
+def snapshots():
+    """Inspect or purge the persisted HPO embedding snapshots."""
+
+
+def _snapshot_dir(ctx, db_path: Optional[str]) -> Path:
+    from pheval_elder.prepare.core.store.embedding_store import EMBEDDING_STORE_DIR
+
+    if db_path is None:
+        db_path = get_config(ctx.obj.get("config_path")).db.chroma_db_path
+    return Path(db_path) / EMBEDDING_STORE_DIR
+
+
+@snapshots.command(name="list")
+@click.option(
+    "--db-path",
+    "-d",
+    type=str,
+    help="Path to the ChromaDB directory (defaults to config value)"
+)
+@click.pass_context
+def list_snapshots(ctx, db_path):
+    """
+    List the HPO embedding snapshots next to a ChromaDB directory.
+
+    Example:
+        elder snapshots list --db-path ./data/large3
+    """
+    from pheval_elder.prepare.core.store.embedding_store import list_stores
+
+    directory = _snapshot_dir(ctx, db_path)
+    stores = list_stores(directory)
+    if not stores:
+        click.echo(f"No snapshots found in {directory}")
+        return
+    click.echo("\t".join(["collection", "precision", "count", "dimension", "size_mb", "model", "sample_hash"]))
+    for store in stores:
+        fingerprint = store["fingerprint"] or {}
+        click.echo("\t".join([
+            store["name"],
+            store["precision"],
+            str(store["count"]),
+            str(store["dimension"]),
+            f"{store['size'] / 1e6:.1f}",
+            str(fingerprint.get("model") or "-"),
+            (fingerprint.get("sample_hash") or "-")[:12],
+        ]))
+
+
+@snapshots.command(name="purge")
+@click.option(
+    "--db-path",
+    "-d",
+    type=str,
+    help="Path to the ChromaDB directory (defaults to config value)"
+)
+@click.option(
+    "--collection",
+    "-n",
+    type=str,
+    help="Only purge the snapshots of this collection"
+)
+@click.option("--yes", "-y", is_flag=True, help="Do not ask for confirmation")
+@click.pass_context
+def purge_snapshots(ctx, db_path, collection, yes):
+    """
+    Delete HPO embedding snapshots; they are rebuilt from ChromaDB on the next run.
+
+    Example:
+        elder snapshots purge --db-path ./data/large3 --collection large3_hpo
+    """
+    from pheval_elder.prepare.core.store.embedding_store import purge_stores
+
+    directory = _snapshot_dir(ctx, db_path)
+    target = f"snapshots of {collection}" if collection else "all snapshots"
+    if not yes:
+        click.confirm(f"Delete {target} in {directory}?", abort=True)
+    deleted = purge_stores(directory, name=collection)
+    click.echo(f"Deleted {len(deleted)} files from {directory}")
+
+
 @elder.command()
 @click.argument("config_file", type=click.Path(exists=True, dir_okay=False, path_type=Path))
 @click.option("--output", "-o", type=click.Path(file_okay=False, path_type=Path),
@@ -0,0 +1,124 @@
+"""
+Multi-Strategy Runner.
+
+This module provides a runner for evaluating several strategies
+(avg, wgt_avg and the best-match variants tpc, tpc_sym, tpc_max, tpc_wgt)
+in a single run.
+"""
+
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+
+from pheval.post_processing.post_processing import generate_pheval_result
+from pheval.utils.file_utils import all_files
+from pheval.utils.phenopacket_utils import PhenopacketUtil, phenopacket_reader
+from tqdm import tqdm
+
+from pheval_elder.base_runner import BaseElderRunner
+from pheval_elder.prepare.config.config_loader import load_config_path
+from pheval_elder.prepare.core.utils.obsolete_hp_mapping import update_hpo_id
+
+# distances for the embedding strategies, similarity scores for best match
+SORT_ORDERS = {
+    "avg": "ASCENDING",
+    "wgt_avg": "ASCENDING",
+    "tpc": "DESCENDING",
+    "tpc_sym": "DESCENDING",
+    "tpc_max": "DESCENDING",
+    "tpc_wgt": "DESCENDING",
+}
+
+
+@dataclass
+class MultiStrategyRunner(BaseElderRunner):
+    """
+    Runner for analyzing phenotype sets with several strategies at once.
+
+    The phenopackets are read once, all strategies are computed in the same
+    worker pass and the results of each strategy are written to the results
+    directory a single-strategy run would use.
+    """
+
+    def run(self) -> None:
+        """
+        Run all configured strategies on all phenotype sets.
+
+        This method:
+        1. Reads phenopackets from the specified directory
+        2. Extracts observed phenotypes from each phenopacket
+        3. Runs the analysis of all strategies in one pass
+        4. Processes the results of each strategy
+        """
+        total_phenopackets = int(self.elder_runner.nr_of_phenopackets)
+        path = self.get_phenopackets_dir(self.config)
+        file_list = all_files(path)
+
+        phenotype_sets = []
+        file_names = []
+
+        for i, file_path in tqdm(enumerate(file_list, start=1), total=total_phenopackets):
+            self.current_file_name = file_path.stem
+            phenopacket = phenopacket_reader(file_path)
+            phenopacket_util = PhenopacketUtil(phenopacket)
+            observed_phenotypes = phenopacket_util.observed_phenotypic_features()
+            observed_phenotypes_hpo_ids = [
+                update_hpo_id(observed_phenotype.type.id) for observed_phenotype in observed_phenotypes
+            ]
+            file_names.append(file_path.name)
+            phenotype_sets.append(observed_phenotypes_hpo_ids)
+
+        results_by_strategy = self.elder_runner.multi_strategy_analysis(
+            phenotype_sets, self.config.runner.nr_of_results
+        )
+        for strategy, strategy_results in results_by_strategy.items():
+            self.current_strategy = strategy
+            for file_name, result_set in zip(file_names, strategy_results):
+                if result_set:
+                    self.current_file_name = file_name
+                    self.results = self.elder_runner.pheval_results(result_set)
+                    self.post_process()
+
+    def post_process(self) -> None:
+        """
+        Process the results of the current strategy.
+
+        This method:
+        1. Creates the output directory structure of the strategy
+        2. Generates the PhEval result files
+        3. Moves the result files to the strategy's directory
+        """
+        if self.input_dir_config.disease_analysis and self.results:
+            output_file_name = f"{self.current_file_name}"
+            results_dir_name, results_sub_dir = self.elder_runner.result_dir_names(self.current_strategy)
+            self.tmp_dir = self.pheval_disease_results_dir / "pheval_disease_results/"
+            dest_dir = self.pheval_disease_results_dir / results_dir_name / results_sub_dir
+
+            self.tmp_dir.mkdir(parents=True, exist_ok=True)
+            dest_dir.mkdir(parents=True, exist_ok=True)
+
+            generate_pheval_result(
+                pheval_result=self.results,
+                sort_order_str=SORT_ORDERS[self.current_strategy],
+                output_dir=self.pheval_disease_results_dir,
+                tool_result_path=Path(output_file_name),
+            )
+
+            for file in self.tmp_dir.iterdir():
+                if file.is_file():
+                    shutil.move(file, dest_dir / file.name)
+
+
+if __name__ == "__main__":
+    config_path = load_config_path()
+    runner = MultiStrategyRunner.from_config(
+        config_path=config_path,
+        config_overrides={
+            "strategies": ["avg", "wgt_avg", "tpc"],
+            "nr_of_phenopackets": "10",
+            "nr_of_results": 10,
+        }
+    )
+
+    runner.prepare()
+    runner.run()
@@ -0,0 +1,128 @@
+"""
+Recall / latency sweep over HNSW index parameters.
+
+Builds a scratch Chroma collection of the disease embeddings for every
+parameter set, queries it with the averaged phenotype sets of the evaluated
+phenopackets and compares the top-k diseases against the exact search. The
+report lists build time, query latency and recall@k per parameter set, to
+choose an index profile from data.
+"""
+
+import tempfile
+import time
+from dataclasses import dataclass, asdict
+from typing import List, Optional, Sequence, Tuple
+
+import chromadb
+import numpy as np
+
+from pheval_elder.prepare.core.collections.disease_embedding_builder import DiseaseEmbeddings
+from pheval_elder.prepare.core.query.exact_search import ExactDiseaseSearch
+from pheval_elder.prepare.core.store.index_profiles import HNSWParams
+from pheval_elder.prepare.core.utils.similarity_measures import SimilarityMeasures
+
+SWEEP_COLLECTION_NAME = "elder_index_sweep"
+
+
+@dataclass
+class IndexSweepRow:
+    """Build time, query latency and recall of one HNSW parameter set."""
+    name: str
+    M: int
+    construction_ef: int
+    search_ef: int
+    build_seconds: float
+    query_ms: float
+    recall_at_k: float
+
+
+def index_sweep(
+        disease_embeddings: DiseaseEmbeddings,
+        queries: np.ndarray,
+        parameter_sets: Sequence[Tuple[str, HNSWParams]],
+        k: int = 10,
+        similarity: SimilarityMeasures = SimilarityMeasures.COSINE,
+        query_batch_size: int = 100,
+        path: Optional[str] = None,
+) -> List[IndexSweepRow]:
+    """
+    Measure recall@k against the exact search, query latency and build time per HNSW parameter set.
+
+    Args:
+        disease_embeddings: Disease embeddings the collections are built from
+        queries: (n_queries x D) query embeddings, e.g. averaged phenotype sets
+        parameter_sets: (name, parameters) pairs to evaluate
+        k: Number of top-ranked diseases to compare
+        similarity: Similarity measure of the collections
+        query_batch_size: Number of query embeddings per query call
+        path: Directory of the scratch Chroma DB (default: a temporary directory)
+
+    Returns:
+        One IndexSweepRow per parameter set
+    """
+    similarity = SimilarityMeasures(similarity)
+    search = ExactDiseaseSearch.from_disease_embeddings(disease_embeddings, similarity)
+    k = min(k, len(search))
+    exact_rows, _ = search.search(queries, k)
+    index = {disease_id: row for row, disease_id in enumerate(search.disease_ids)}
+    ids = [str(disease_id) for disease_id in disease_embeddings.disease_ids]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = chromadb.PersistentClient(path=path or tmp)
+        batch_size = client.get_max_batch_size()
+        report = []
+        for name, params in parameter_sets:
+            if SWEEP_COLLECTION_NAME in [collection.name for collection in client.list_collections()]:
+                client.delete_collection(SWEEP_COLLECTION_NAME)
+            start = time.perf_counter()
+            collection = client.create_collection(SWEEP_COLLECTION_NAME, metadata=params.metadata(similarity.value))
+            for offset in range(0, len(ids), batch_size):
+                collection.add(
+                    ids=ids[offset:offset + batch_size],
+                    embeddings=disease_embeddings.matrix[offset:offset + batch_size].tolist(),
+                )
+            build_seconds = time.perf_counter() - start
+
+            hits = 0
+            start = time.perf_counter()
+            for offset in range(0, len(queries), query_batch_size):
+                result = collection.query(
+                    query_embeddings=queries[offset:offset + query_batch_size].tolist(),
+                    n_results=k,
+                    include=[],
+                )
+                for position, disease_ids in enumerate(result["ids"], start=offset):
+                    hnsw_rows = [index[disease_id] for disease_id in disease_ids]
+                    hits += len(np.intersect1d(hnsw_rows, exact_rows[position]))
+            query_seconds = time.perf_counter() - start
+
+            n = max(len(queries), 1)
+            report.append(IndexSweepRow(
+                name=name,
+                M=params.M,
+                construction_ef=params.construction_ef,
+                search_ef=params.search_ef,
+                build_seconds=build_seconds,
+                query_ms=1000 * query_seconds / n,
+                recall_at_k=hits / (n * max(k, 1)),
+            ))
+        client.delete_collection(SWEEP_COLLECTION_NAME)
+    return report
+
+
+def format_index_sweep(report: List[IndexSweepRow], k: int) -> str:
+    """Format an index sweep report as a tab-separated table."""
+    header = ["name", "M", "construction_ef", "search_ef", "build_seconds", "query_ms", f"recall_at_{k}"]
+    lines = ["\t".join(header)]
+    for row in report:
+        values = asdict(row)
+        lines.append("\t".join([
+            values["name"],
+            str(values["M"]),
+            str(values["construction_ef"]),
+            str(values["search_ef"]),
+            f"{values['build_seconds']:.2f}",
+            f"{values['query_ms']:.3f}",
+            f"{values['recall_at_k']:.4f}",
+        ]))
+    return "\n".join(lines)
@@ -0,0 +1,170 @@
+"""
+Accuracy report for reduced-precision embedding stores.
+
+Ranks all diseases for a set of phenopackets with the average embedding
+strategy, once in float64 as baseline and once per storage precision, and
+compares the top-k disease rankings against the baseline.
+"""
+
+from dataclasses import dataclass, asdict
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from pheval_elder.prepare.core.store.embedding_store import (
+    EmbeddingPrecision,
+    HPEmbeddingStore,
+    dequantize_matrix,
+    quantize_matrix,
+)
+
+
+@dataclass
+class PrecisionReportRow:
+    """Accuracy and footprint of one storage precision compared to the float64 baseline."""
+    precision: str
+    hpo_store_mb: float
+    disease_matrix_mb: float
+    top1_agreement: float
+    recall_at_k: float
+    mean_rank_shift: float
+    max_score_error: float
+
+
+def average_disease_matrix(
+        hpo_matrix: np.ndarray,
+        store: HPEmbeddingStore,
+        disease_to_hps: Dict[str, Dict],
+) -> Tuple[List[str], np.ndarray]:
+    """
+    Average the HPO embeddings of every disease.
+
+    Args:
+        hpo_matrix: Dense HPO embedding matrix, row-aligned with ``store``
+        store: Store providing the id -> row index
+        disease_to_hps: Disease to phenotype mapping from the HPOA file
+
+    Returns:
+        Tuple of (disease ids, (n_diseases x D) matrix in the dtype of ``hpo_matrix``)
+    """
+    disease_ids = []
+    vectors = []
+    for disease_id, disease_data in disease_to_hps.items():
+        rows = store.rows(disease_data.get("phenotypes") or [])
+        if rows.size == 0:
+            continue
+        disease_ids.append(disease_id)
+        vectors.append(hpo_matrix[rows].mean(axis=0))
+    return disease_ids, np.asarray(vectors, dtype=hpo_matrix.dtype)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+
+def _query_matrix(hpo_matrix: np.ndarray, store: HPEmbeddingStore, phenotype_sets: Sequence[List[str]]) -> np.ndarray:
+    queries = np.zeros((len(phenotype_sets), hpo_matrix.shape[1]), dtype=hpo_matrix.dtype)
+    for i, phenotype_set in enumerate(phenotype_sets):
+        rows = store.rows(phenotype_set)
+        if rows.size:
+            queries[i] = hpo_matrix[rows].mean(axis=0)
+    return queries
+
+
+def _ranks(scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Return (descending order, rank of every column) per row of a score matrix."""
+    order = np.argsort(-scores, axis=1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(scores.shape[1])[None, :], axis=1)
+    return order, ranks
+
+
+def precision_accuracy_report(
+        store: HPEmbeddingStore,
+        disease_to_hps: Dict[str, Dict],
+        phenotype_sets: Sequence[List[str]],
+        precisions: Iterable[EmbeddingPrecision] = tuple(EmbeddingPrecision),
+        k: int = 10,
+        chunk_size: int = 256,
+) -> List[PrecisionReportRow]:
+    """
+    Compare top-k disease rankings of each storage precision against a float64 baseline.
+
+    Both the HPO store and the averaged disease matrix are kept in the evaluated
+    precision; scores are cosine similarities computed in float32.
+
+    Args:
+        store: HPO embedding store (any precision, used as source of the float64 baseline)
+        disease_to_hps: Disease to phenotype mapping from the HPOA file
+        phenotype_sets: Phenotype sets of the evaluated phenopackets
+        precisions: Storage precisions to evaluate
+        k: Number of top-ranked diseases to compare
+        chunk_size: Number of phenotype sets scored per matrix product
+
+    Returns:
+        One PrecisionReportRow per precision
+    """
+    phenotype_sets = [s for s in phenotype_sets if store.rows(s).size]
+    baseline_hpo = np.asarray(store.dense(slice(None)), dtype=np.float64)
+    disease_ids, baseline_diseases = average_disease_matrix(baseline_hpo, store, disease_to_hps)
+    baseline_diseases = _normalize_rows(baseline_diseases)
+    k = min(k, len(disease_ids))
+
+    report = []
+    for precision in precisions:
+        precision = EmbeddingPrecision(precision)
+        hpo_data, hpo_scales = quantize_matrix(baseline_hpo, precision)
+        hpo_matrix = dequantize_matrix(hpo_data, hpo_scales)
+        _, diseases = average_disease_matrix(hpo_matrix, store, disease_to_hps)
+        disease_data, disease_scales = quantize_matrix(_normalize_rows(diseases), precision)
+        diseases = dequantize_matrix(disease_data, disease_scales)
+
+        top1_hits = 0
+        overlap = 0
+        rank_shift = 0.0
+        max_error = 0.0
+        for start in range(0, len(phenotype_sets), chunk_size):
+            chunk = phenotype_sets[start:start + chunk_size]
+            baseline_scores = _normalize_rows(_query_matrix(baseline_hpo, store, chunk)) @ baseline_diseases.T
+            scores = _normalize_rows(_query_matrix(hpo_matrix, store, chunk)) @ diseases.T
+            base_order, _ = _ranks(baseline_scores)
+            order, ranks = _ranks(scores)
+
+            top1_hits += int(np.sum(base_order[:, 0] == order[:, 0]))
+            for i in range(len(chunk)):
+                overlap += len(np.intersect1d(base_order[i, :k], order[i, :k]))
+            base_top_k = base_order[:, :k]
+            rank_shift += float(np.abs(np.take_along_axis(ranks, base_top_k, axis=1) - np.arange(k)[None, :]).sum())
+            max_error = max(max_error, float(np.max(np.abs(scores - baseline_scores))))
+
+        n = max(len(phenotype_sets), 1)
+        report.append(PrecisionReportRow(
+            precision=precision.value,
+            hpo_store_mb=(hpo_data.nbytes + (hpo_scales.nbytes if hpo_scales is not None else 0)) / 1e6,
+            disease_matrix_mb=(disease_data.nbytes + (disease_scales.nbytes if disease_scales is not None else 0)) / 1e6,
+            top1_agreement=top1_hits / n,
+            recall_at_k=overlap / (n * max(k, 1)),
+            mean_rank_shift=rank_shift / (n * max(k, 1)),
+            max_score_error=max_error,
+        ))
+    return report
+
+
+def format_precision_report(report: List[PrecisionReportRow], k: int) -> str:
+    """Format a precision report as a tab-separated table."""
+    header = ["precision", "hpo_store_mb", "disease_matrix_mb", "top1_agreement",
+              f"recall_at_{k}", "mean_rank_shift", "max_score_error"]
+    lines = ["\t".join(header)]
+    for row in report:
+        values = asdict(row)
+        lines.append("\t".join([
+            values["precision"],
+            f"{values['hpo_store_mb']:.2f}",
+            f"{values['disease_matrix_mb']:.2f}",
+            f"{values['top1_agreement']:.4f}",
+            f"{values['recall_at_k']:.4f}",
+            f"{values['mean_rank_shift']:.4f}",
+            f"{values['max_score_error']:.6f}",
+        ]))
+    return "\n".join(lines)
@@ -14,6 +14,9 @@ from typing import Dict, List, Optional, Union, Any
 
 import yaml
 
+from pheval_elder.prepare.core.query.exact_search import SearchBackend
+from pheval_elder.prepare.core.store.embedding_store import EmbeddingPrecision
+from pheval_elder.prepare.core.store.index_profiles import IndexProfile
 from pheval_elder.prepare.core.utils.similarity_measures import SimilarityMeasures
 
 
@@ -42,6 +45,10 @@ class DatabaseConfig:
     chroma_db_path: str
     collection_name: str = "lrd_hpo_embeddings"
     similarity_measure: SimilarityMeasures = SimilarityMeasures.COSINE
+    embedding_precision: EmbeddingPrecision = EmbeddingPrecision.FLOAT32
+    chroma_host: Optional[str] = None
+    chroma_port: int = 8000
+    index_profile: IndexProfile = IndexProfile.BALANCED
 
 
 @dataclass
@@ -53,6 +60,7 @@ class RunnerConfig:
     nr_of_results: int = 10
     custom_model_name: Optional[str] = None
     model_path: Optional[str] = None
+    strategies: Optional[List[str]] = None
 
 
 @dataclass
@@ -61,6 +69,13 @@ class ProcessingConfig:
     use_multiprocessing: bool = True
     num_workers: Optional[int] = None
     batch_size: int = 100
+    incremental_update: bool = False
+    search_backend: SearchBackend = SearchBackend.CHROMA
+    result_cache: bool = False
+    result_cache_dir: Optional[str] = None
+    max_in_flight_queries: int = 8
+    tcp_memory_budget_mb: Optional[int] = None
+    tcp_similarity_matrix: bool = False
 
 
 @dataclass
@@ -119,7 +134,11 @@ class ConfigLoader:
         return DatabaseConfig(
             chroma_db_path=db_config.get('chroma_db_path', "emb_data/models/large3"),
             collection_name=db_config.get('collection_name', "lrd_hpo_embeddings"),
-            similarity_measure=SimilarityMeasures[db_config.get('similarity_measure', "COSINE")]
+            similarity_measure=SimilarityMeasures[db_config.get('similarity_measure', "COSINE")],
+            embedding_precision=EmbeddingPrecision(db_config.get('embedding_precision', "float32")),
+            chroma_host=db_config.get('chroma_host') or None,
+            chroma_port=int(db_config.get('chroma_port', 8000)),
+            index_profile=IndexProfile(db_config.get('index_profile', "balanced"))
         )
 
     @classmethod
@@ -132,7 +151,8 @@ class ConfigLoader:
             nr_of_phenopackets=str(runner_config.get('nr_of_phenopackets', "385")),
             nr_of_results=int(runner_config.get('nr_of_results', 10)),
             custom_model_name=runner_config.get('custom_model_name'),
-            model_path=runner_config.get('model_path')
+            model_path=runner_config.get('model_path'),
+            strategies=runner_config.get('strategies') or None
         )
 
     @classmethod
@@ -142,7 +162,14 @@ class ConfigLoader:
         return ProcessingConfig(
             use_multiprocessing=processing_config.get('use_multiprocessing', True),
             num_workers=processing_config.get('num_workers'),
-            batch_size=processing_config.get('batch_size', 100)
+            batch_size=processing_config.get('batch_size', 100),
+            incremental_update=processing_config.get('incremental_update', False),
+            search_backend=SearchBackend(processing_config.get('search_backend', "chroma")),
+            result_cache=processing_config.get('result_cache', False),
+            result_cache_dir=processing_config.get('result_cache_dir') or None,
+            max_in_flight_queries=int(processing_config.get('max_in_flight_queries', 8)),
+            tcp_memory_budget_mb=processing_config.get('tcp_memory_budget_mb') or None,
+            tcp_similarity_matrix=processing_config.get('tcp_similarity_matrix', False)
         )
 
     @classmethod
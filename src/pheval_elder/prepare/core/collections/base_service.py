@@ -1,15 +1,33 @@
+import logging
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Optional, Dict
+from typing import Callable, ClassVar, Optional, Dict
 
 from chromadb.types import Collection
+from tqdm import tqdm
 
+from pheval_elder.prepare.core.collections.disease_embedding_builder import DiseaseEmbeddings
+from pheval_elder.prepare.core.collections.incremental import (
+    BUILD_HASH_KEY,
+    HPOA_VERSION_KEY,
+    DiseaseCollectionManifest,
+    diff_digests,
+    disease_collection_hash,
+    mapping_digests,
+)
 from pheval_elder.prepare.core.data_processing.data_processor import DataProcessor
+from pheval_elder.prepare.core.store.chromadb_manager import ChromaDBManager
+from pheval_elder.prepare.core.store.embedding_store import EmbeddingPrecision
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
 class BaseService(ABC):
 
+    # disease embedding strategy of the service, part of the collection build hash
+    strategy: ClassVar[str] = None
+
     data_processor: Optional[DataProcessor]
     disease_to_hps: Dict = None
     disease_to_hps_with_frequencies_dp: Dict = None
@@ -20,14 +38,130 @@ class BaseService(ABC):
         self.hp_embeddings = self.data_processor.hp_embeddings
         self.disease_to_hps = self.data_processor.disease_to_hps
         self.disease_to_hps_with_frequencies_dp = self.data_processor.disease_to_hps_with_frequencies
-        self.disease_new_avg_embeddings_collection = self.data_processor.db_manager.disease_avg_embeddings_collection
-        self.disease_weighted_avg_embeddings_collection = self.data_processor.db_manager.disease_weighted_avg_embeddings_collection
+        # the collection is named after the strategy of the service, so services of
+        # several strategies can share one db manager
+        collection = self.data_processor.db_manager.disease_embeddings_collection(self.strategy)
+        self.disease_new_avg_embeddings_collection = collection
+        self.disease_weighted_avg_embeddings_collection = collection
 
 
     @abstractmethod
-    def process_data(self) -> Collection:
+    def process_data(self, incremental: bool = False) -> Collection:
         pass
 
     @abstractmethod
     def upsert_batch(self, *args, **kwargs):
         pass
+
+    def build_hash(self) -> str:
+        """
+        Content hash of the disease collection build of this service.
+
+        Covers the HPO collection fingerprint, the HPOA file digest, the strategy,
+        the embedding dimension and the embedding store precision; computing it
+        does not load any embeddings.
+        """
+        return disease_collection_hash(
+            hp_fingerprint=self.data_processor.hp_collection_fingerprint,
+            hpoa_hash=self.data_processor.hpoa_hash,
+            strategy=self.strategy,
+            dimension=self.data_processor.hp_dimension,
+            precision=EmbeddingPrecision(self.data_processor.embedding_precision).value,
+        )
+
+    @staticmethod
+    def is_built(collection: Collection, build_hash: str) -> bool:
+        """Whether ``collection`` was already built from the inputs ``build_hash`` stands for."""
+        current = (collection.metadata or {}).get(BUILD_HASH_KEY)
+        if current == build_hash and collection.count() > 0:
+            logger.info(f"{collection.name} is up to date (build hash {build_hash[:12]}), skipping the build")
+            return True
+        if current is None:
+            logger.info(f"{collection.name} has no build hash, building it")
+        else:
+            logger.info(f"Build hash of {collection.name} changed ({current[:12]} -> {build_hash[:12]}), rebuilding it")
+        return False
+
+    def update_collection(
+            self,
+            collection: Collection,
+            mapping: Dict[str, Dict],
+            build: Callable[[Dict[str, Dict]], DiseaseEmbeddings],
+            batch_size: int,
+            incremental: bool = False,
+            desc: str = "Upserting disease embeddings",
+            build_hash: Optional[str] = None,
+    ) -> Collection:
+        """
+        Compute and upsert the disease embeddings of ``mapping`` into ``collection``.
+
+        In incremental mode the mapping is diffed against the manifest of the last
+        build: only added or changed diseases are recomputed and upserted, and
+        removed diseases are deleted. Without a usable manifest (first build, or
+        the HPO embeddings changed since) all diseases are rebuilt and diseases
+        no longer in the mapping are deleted. The applied HPOA release is recorded
+        in the collection metadata under ``elder_hpoa_version``.
+
+        Args:
+            collection: Disease embedding collection to update
+            mapping: Disease to phenotype mapping from the HPOA file
+            build: Builds DiseaseEmbeddings for a (sub-)mapping
+            batch_size: Number of diseases per upsert
+            incremental: Only apply the difference to the last build
+            desc: Progress bar description
+            build_hash: Build hash recorded in the collection metadata under ``elder_build_hash``
+
+        Returns:
+            The updated collection
+        """
+        store = self.data_processor.hp_embedding_store
+        manifest_dir = self.data_processor.disease_manifest_dir
+        digests = mapping_digests(mapping)
+
+        diff = None
+        if incremental:
+            manifest = DiseaseCollectionManifest.load(manifest_dir, collection.name)
+            if manifest is None:
+                logger.info(f"No manifest for {collection.name}, rebuilding all disease embeddings")
+            elif manifest.hp_fingerprint != store.fingerprint or manifest.precision != store.precision.value:
+                logger.info(f"HPO embeddings changed since {collection.name} was built, rebuilding all disease embeddings")
+            elif collection.count() == 0:
+                logger.info(f"{collection.name} is empty, rebuilding all disease embeddings")
+            else:
+                diff = diff_digests(manifest.digests, digests)
+                logger.info(f"HPOA {manifest.hpoa_version} -> {self.data_processor.hpoa_version}: {diff.summary()}")
+
+        to_build = mapping if diff is None else {disease_id: mapping[disease_id] for disease_id in diff.upserts}
+        disease_embeddings = build(to_build)
+        for disease_ids, disease_names, embeddings in tqdm(
+                disease_embeddings.batches(batch_size),
+                total=(len(disease_embeddings) + batch_size - 1) // batch_size,
+                desc=desc
+        ):
+            self.upsert_batch(list(zip(disease_ids, disease_names)), embeddings)
+
+        built = set(disease_embeddings.disease_ids)
+        if diff is not None:
+            # changed diseases left without any embedded phenotype are dropped as well
+            stale = diff.removed + [disease_id for disease_id in diff.changed if disease_id not in built]
+        elif incremental:
+            stale = [disease_id for disease_id in collection.get(include=[])["ids"] if disease_id not in built]
+        else:
+            stale = []
+        for start in range(0, len(stale), batch_size):
+            collection.delete(ids=stale[start:start + batch_size])
+        if stale:
+            logger.info(f"Deleted {len(stale)} diseases from {collection.name}")
+
+        DiseaseCollectionManifest(
+            collection=collection.name,
+            hpoa_version=self.data_processor.hpoa_version,
+            hp_fingerprint=store.fingerprint,
+            digests=digests,
+            precision=store.precision.value,
+        ).save(manifest_dir)
+        metadata = {HPOA_VERSION_KEY: self.data_processor.hpoa_version}
+        if build_hash is not None:
+            metadata[BUILD_HASH_KEY] = build_hash
+        ChromaDBManager.merge_collection_metadata(collection, **metadata)
+        return collection
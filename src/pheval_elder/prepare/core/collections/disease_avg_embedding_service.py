@@ -1,15 +1,13 @@
 import logging
 import time
-from typing import Optional
+from typing import ClassVar, Optional
 
-import numpy as np
 from dataclasses import dataclass
 from chromadb.types import Collection
 
-from tqdm import tqdm
-
 from pheval_elder.prepare.config.unified_config import get_config
 from pheval_elder.prepare.core.collections.base_service import BaseService
+from pheval_elder.prepare.core.collections.disease_embedding_builder import DiseaseEmbeddingBuilder
 from pheval_elder.prepare.core.data_processing.data_processor import DataProcessor
 from pheval_elder.prepare.core.utils.utils import populate_venomx
 
@@ -18,9 +16,11 @@ logger = logging.getLogger(__name__)
 
 @dataclass
 class DiseaseAvgEmbeddingService(BaseService):
+    strategy: ClassVar[str] = "avg"
+
     data_processor: Optional[DataProcessor]
 
-    def process_data(self) -> Collection:
+    def process_data(self, incremental: bool = False) -> Collection:
         if not self.disease_to_hps:
             raise ValueError("disease to hps data is not initialized")
         if not self.disease_new_avg_embeddings_collection:
@@ -29,43 +29,23 @@ class DiseaseAvgEmbeddingService(BaseService):
         #     logger.info(f"Return Exisiting DiseaseAvgEmbeddingsCollection {self.disease_new_avg_embeddings_collection}")
         #     return self.disease_new_avg_embeddings_collection
 
-        batch_size = 500
-        num_diseases = len(self.disease_to_hps)
-        # TODO -> embedding model dict from read in config parser
-        # model_dimension = get_config() # just drop dimension in config and carry here
-        batch_embeddings = np.zeros((batch_size, 3072)) #3072 for large model
-        # Use dtype=object for flexibility with string lengths and special characters, avoiding truncation issues.
-        batch_diseases = np.empty(batch_size, dtype=object)
-        current_index = 0
-        embedding_calc_time = 0
-        upsert_time = 0
-
-        for disease_id, disease_data in tqdm(self.disease_to_hps.items(), total=num_diseases):
-            phenotypes = disease_data.get("phenotypes")
-            disease_name = disease_data.get("disease_name")
-            if phenotypes is None:
-                logger.warning(f"No phenotypes found for {disease_id}")
-                continue
-
-            start = time.time()
-            average_embedding = self.data_processor.calculate_average_embedding(phenotypes, self.hp_embeddings)
-            embedding_calc_time += time.time() - start
+        build_hash = self.build_hash()
+        if self.is_built(self.disease_new_avg_embeddings_collection, build_hash):
+            return self.disease_new_avg_embeddings_collection
 
-            batch_diseases[current_index] = (disease_id, disease_name)
-            batch_embeddings[current_index] = average_embedding
-            current_index += 1
-
-            if current_index % batch_size == 0:
-                self.upsert_batch(batch_diseases, batch_embeddings)
-                current_index = 0
-
-        if current_index > 0:
-            start = time.time()
-            self.upsert_batch(batch_diseases[:current_index], batch_embeddings[:current_index])
-            upsert_time += time.time() - start
-
-        print(f"Total time for embedding calculations (avg): {embedding_calc_time}s")
-        print(f"Total time for upsert operations (avg): {upsert_time}s")
+        batch_size = 500
+        start = time.time()
+        builder = DiseaseEmbeddingBuilder(store=self.data_processor.hp_embedding_store)
+        self.update_collection(
+            self.disease_new_avg_embeddings_collection,
+            self.disease_to_hps,
+            builder.average,
+            batch_size,
+            incremental=incremental,
+            build_hash=build_hash,
+            desc="Upserting average disease embeddings",
+        )
+        print(f"Total time for embedding calculations and upserts (avg): {time.time() - start}s")
 
         return self.disease_new_avg_embeddings_collection
 
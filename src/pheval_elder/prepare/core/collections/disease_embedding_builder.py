@@ -0,0 +1,160 @@
+"""
+Vectorised builder for disease embeddings.
+
+Instead of averaging the HPO embeddings of every disease in a Python loop,
+the HPOA disease-to-phenotype mappings are assembled into one sparse
+(diseases x HPO terms) incidence matrix whose rows hold the averaging weights:
+``1 / n`` for the average strategy and the normalised phenotype frequencies for
+the weighted average strategy. All disease embeddings are then produced by a
+single sparse-dense matrix product with the HPO embedding store.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from pheval_elder.prepare.core.store.embedding_store import EmbeddingPrecision, HPEmbeddingStore
+
+logger = logging.getLogger(__name__)
+
+# HPO rows dequantised at once when the store is kept in reduced precision
+DEQUANTIZE_BLOCK_ROWS = 4096
+
+
+@dataclass
+class DiseaseEmbeddings:
+    """
+    Disease embeddings as one matrix with aligned id and name arrays.
+
+    Attributes:
+        disease_ids: Disease ids, one per matrix row
+        disease_names: Disease names, one per matrix row
+        matrix: (n_diseases x D) float32 embedding matrix
+    """
+    disease_ids: np.ndarray
+    disease_names: np.ndarray
+    matrix: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.disease_ids)
+
+    def batches(self, batch_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Yield (ids, names, embeddings) slices of at most ``batch_size`` diseases, e.g. for upserts."""
+        for start in range(0, len(self), batch_size):
+            end = start + batch_size
+            yield self.disease_ids[start:end], self.disease_names[start:end], self.matrix[start:end]
+
+
+@dataclass
+class DiseaseEmbeddingBuilder:
+    """
+    Builds average and weighted average disease embeddings from an HPO embedding store.
+
+    Diseases without any phenotype in the store (or with a total weight of zero)
+    are left out, as no embedding can be computed for them.
+    """
+    store: HPEmbeddingStore
+
+    def average(self, disease_to_hps: Dict[str, Dict]) -> DiseaseEmbeddings:
+        """
+        Average the HPO embeddings of every disease.
+
+        Args:
+            disease_to_hps: ``{disease_id: {"disease_name", "phenotypes": [hp_id, ...]}}``
+
+        Returns:
+            DiseaseEmbeddings with one row per disease
+        """
+        entries = (
+            (disease_id, data.get("disease_name"), self._counts(data.get("phenotypes") or []))
+            for disease_id, data in disease_to_hps.items()
+        )
+        return self._build(entries)
+
+    def weighted_average(self, disease_to_hps_with_frequencies: Dict[str, Dict]) -> DiseaseEmbeddings:
+        """
+        Average the HPO embeddings of every disease, weighted by phenotype frequency.
+
+        Args:
+            disease_to_hps_with_frequencies: ``{disease_id: {"disease_name", "phenotypes_and_frequencies": {hp_id: f}}}``
+
+        Returns:
+            DiseaseEmbeddings with one row per disease
+        """
+        entries = (
+            (disease_id, data.get("disease_name"), data.get("phenotypes_and_frequencies") or {})
+            for disease_id, data in disease_to_hps_with_frequencies.items()
+        )
+        return self._build(entries)
+
+    @staticmethod
+    def _counts(phenotypes: List[str]) -> Dict[str, float]:
+        """Weight every phenotype by its number of occurrences (1 unless listed twice)."""
+        counts: Dict[str, float] = {}
+        for hp_id in phenotypes:
+            counts[hp_id] = counts.get(hp_id, 0.0) + 1.0
+        return counts
+
+    def incidence(self, entries) -> Tuple[List[str], List[str], sparse.csr_matrix]:
+        """
+        Assemble the row-normalised (diseases x HPO terms) weight matrix.
+
+        Args:
+            entries: Iterable of (disease_id, disease_name, {hp_id: weight})
+
+        Returns:
+            Tuple of (disease ids, disease names, CSR matrix whose rows sum to 1)
+        """
+        disease_ids, disease_names = [], []
+        indptr, indices, weights = [0], [], []
+        skipped = 0
+        for disease_id, disease_name, hp_weights in entries:
+            rows = [(self.store.index[hp_id], weight) for hp_id, weight in hp_weights.items()
+                    if hp_id in self.store.index and weight > 0]
+            total = sum(weight for _, weight in rows)
+            if total <= 0:
+                skipped += 1
+                continue
+            disease_ids.append(disease_id)
+            disease_names.append(disease_name)
+            indices.extend(row for row, _ in rows)
+            weights.extend(weight / total for _, weight in rows)
+            indptr.append(len(indices))
+        if skipped:
+            logger.warning(f"Skipped {skipped} diseases without embedded phenotypes")
+        matrix = sparse.csr_matrix(
+            (np.asarray(weights, dtype=np.float64), np.asarray(indices, dtype=np.int64), np.asarray(indptr)),
+            shape=(len(disease_ids), len(self.store)),
+        )
+        return disease_ids, disease_names, matrix
+
+    def _build(self, entries) -> DiseaseEmbeddings:
+        disease_ids, disease_names, weights = self.incidence(entries)
+        return DiseaseEmbeddings(
+            disease_ids=np.asarray(disease_ids, dtype=object),
+            disease_names=np.asarray(disease_names, dtype=object),
+            matrix=self.embed(weights),
+        )
+
+    def embed(self, weights: sparse.csr_matrix) -> np.ndarray:
+        """
+        Multiply a (diseases x HPO terms) weight matrix with the raw HPO embeddings.
+
+        For pre-normalised stores the row norms are folded into the weights, so the
+        unit matrix is used as is and no raw copy of it is materialised.
+        """
+        if self.store.normalized:
+            weights = weights.multiply(np.asarray(self.store.norms, dtype=np.float64)[None, :]).tocsr()
+        weights = weights.astype(np.float32)
+        stored_rows = self.store.unit if self.store.normalized else self.store.dense
+        if self.store.precision == EmbeddingPrecision.FLOAT32:
+            result = weights @ stored_rows(slice(None))
+        else:
+            result = np.zeros((weights.shape[0], self.store.dimension), dtype=np.float32)
+            for start in range(0, len(self.store), DEQUANTIZE_BLOCK_ROWS):
+                block = slice(start, start + DEQUANTIZE_BLOCK_ROWS)
+                result += weights[:, block] @ stored_rows(block)
+        return np.ascontiguousarray(result, dtype=np.float32)
@@ -1,11 +1,10 @@
-import time
 from dataclasses import dataclass
+from typing import ClassVar
 
-import numpy as np
 from chromadb.types import Collection
-from tqdm import tqdm
 
 from pheval_elder.prepare.core.collections.base_service import BaseService
+from pheval_elder.prepare.core.collections.disease_embedding_builder import DiseaseEmbeddingBuilder
 from pheval_elder.prepare.core.data_processing.data_processor import DataProcessor
 
 
@@ -16,9 +15,11 @@ class DiseaseWeightedAvgEmbeddingService(BaseService):
     relevant disease from disease_to_hps (cached dict from hpoa) into the disease_avg_embeddings_collection that
     contains disease and the average embeddings of the correlating hp terms
     """
+    strategy: ClassVar[str] = "wgt_avg"
+
     data_processor: DataProcessor
 
-    def process_data(self) -> Collection:
+    def process_data(self, incremental: bool = False) -> Collection:
         if not self.disease_to_hps_with_frequencies_dp:
             raise ValueError("disease to hps data is not initialized")
         if not self.disease_weighted_avg_embeddings_collection:
@@ -27,39 +28,27 @@ class DiseaseWeightedAvgEmbeddingService(BaseService):
         #     print("Clustered Embeddings collection early return, cause already initialized!")
         #     return self.disease_weighted_avg_embeddings_collection
 
-        batch_size = 100
-        num_diseases = len(self.disease_to_hps_with_frequencies_dp)
-
-        all_embeddings = np.zeros((batch_size, 3072))
-        all_diseases = np.empty(batch_size, dtype=object)
-
-        current_index = 0
-
-        for disease, disease_and_phenotype_data in tqdm(self.disease_to_hps_with_frequencies_dp.items(), total=num_diseases):
-            start = time.time()
-            disease_name = disease_and_phenotype_data.get("disease_name")
-            average_weighted_embedding = self.data_processor.calculate_weighted_llm_embeddings(
-                disease=disease)
+        build_hash = self.build_hash()
+        if self.is_built(self.disease_weighted_avg_embeddings_collection, build_hash):
+            return self.disease_weighted_avg_embeddings_collection
 
-            all_diseases[current_index] = (disease,disease_name)
-            all_embeddings[current_index] = average_weighted_embedding
-            current_index += 1
-
-            if current_index % batch_size == 0:
-                start = time.time()
-                self.upsert_batch(all_diseases, all_embeddings)
-                current_index = 0
-
-        if current_index > 0:
-            self.upsert_batch(all_diseases[:current_index], all_embeddings[:current_index])
-
-        return self.disease_weighted_avg_embeddings_collection
+        batch_size = 100
+        builder = DiseaseEmbeddingBuilder(store=self.data_processor.hp_embedding_store)
+        return self.update_collection(
+            self.disease_weighted_avg_embeddings_collection,
+            self.disease_to_hps_with_frequencies_dp,
+            builder.weighted_average,
+            batch_size,
+            incremental=incremental,
+            build_hash=build_hash,
+            desc="Upserting weighted average disease embeddings",
+        )
 
     def upsert_batch(self, disease_data, embeddings):
         valid_indices = [i for i, disease in enumerate(disease_data) if disease is not None]
         filtered_entries = [disease_data[i] for i in valid_indices]
         filtered_embeddings = embeddings[valid_indices]
         ids = [x[0] for x in filtered_entries]
-        disease_name = [{"disease_name": y[0]} for y in filtered_entries]
+        disease_name = [{"disease_name": y[1]} for y in filtered_entries]
         self.disease_weighted_avg_embeddings_collection.upsert(ids=ids, embeddings=filtered_embeddings,
                                                                metadatas=disease_name)
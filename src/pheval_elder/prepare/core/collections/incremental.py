@@ -0,0 +1,174 @@
+"""
+Incremental updates of the disease embedding collections.
+
+A disease embedding only depends on the disease name, its phenotypes (and
+their frequencies) and the HPO embeddings. After a collection has been built,
+a manifest with one digest per disease of the applied HPOA mapping is kept
+next to the Chroma DB. When a new ``phenotype.hpoa`` release is applied, the
+new mapping is diffed against the manifest, so only added or changed diseases
+have to be recomputed and upserted, and removed diseases are deleted.
+
+Every built collection also carries a build hash in its metadata covering all
+inputs of the build, so an unchanged collection is not rebuilt at all.
+"""
+
+import hashlib
+import json
+import logging
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Directory next to the Chroma DB holding one manifest per disease collection
+DISEASE_MANIFEST_DIR = "elder_disease_manifests"
+# Collection metadata key recording the HPOA release a collection was built from
+HPOA_VERSION_KEY = "elder_hpoa_version"
+# Collection metadata key holding the hash of all inputs of the last build
+BUILD_HASH_KEY = "elder_build_hash"
+
+
+def disease_collection_hash(
+        hp_fingerprint: Dict[str, Any],
+        hpoa_hash: str,
+        strategy: str,
+        dimension: int,
+        precision: str,
+) -> str:
+    """
+    Content hash of a disease collection build.
+
+    Args:
+        hp_fingerprint: Fingerprint of the source HPO collection
+        hpoa_hash: Digest of the ``phenotype.hpoa`` file
+        strategy: Disease embedding strategy, e.g. "avg" or "wgt_avg"
+        dimension: Embedding dimension
+        precision: Precision of the HPO embedding store, e.g. "float32"
+
+    Returns:
+        Hex digest that changes whenever any of the inputs changes
+    """
+    payload = json.dumps({
+        "hp_fingerprint": hp_fingerprint,
+        "hpoa_hash": hpoa_hash,
+        "strategy": strategy,
+        "dimension": dimension,
+        "precision": precision,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def disease_digest(disease_data: Dict[str, Any]) -> str:
+    """
+    Digest of everything a disease embedding is computed from.
+
+    Args:
+        disease_data: ``{"disease_name", "phenotypes": [...]}`` or ``{"disease_name", "phenotypes_and_frequencies": {...}}``
+
+    Returns:
+        Hex digest, independent of phenotype order
+    """
+    phenotypes = disease_data.get("phenotypes")
+    if phenotypes is not None:
+        phenotypes = sorted(phenotypes)
+    frequencies = disease_data.get("phenotypes_and_frequencies")
+    if frequencies is not None:
+        frequencies = sorted(frequencies.items())
+    payload = json.dumps([disease_data.get("disease_name"), phenotypes, frequencies])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def mapping_digests(mapping: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """Return ``{disease_id: digest}`` for a disease to phenotype mapping."""
+    return {disease_id: disease_digest(disease_data) for disease_id, disease_data in mapping.items()}
+
+
+@dataclass
+class MappingDiff:
+    """
+    Difference between two disease to phenotype mappings.
+
+    Attributes:
+        added: Diseases only in the new mapping
+        changed: Diseases whose name, phenotypes or frequencies changed
+        removed: Diseases only in the previous mapping
+    """
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+    @property
+    def upserts(self) -> List[str]:
+        """Diseases whose embeddings have to be recomputed."""
+        return self.added + self.changed
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+    def summary(self) -> str:
+        return f"{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed diseases"
+
+
+def diff_digests(previous: Dict[str, str], current: Dict[str, str]) -> MappingDiff:
+    """
+    Diff two ``{disease_id: digest}`` mappings.
+
+    Args:
+        previous: Digests of the mapping the collection was built from
+        current: Digests of the new mapping
+
+    Returns:
+        MappingDiff with sorted disease id lists
+    """
+    return MappingDiff(
+        added=sorted(disease_id for disease_id in current if disease_id not in previous),
+        changed=sorted(disease_id for disease_id, digest in current.items()
+                       if disease_id in previous and previous[disease_id] != digest),
+        removed=sorted(disease_id for disease_id in previous if disease_id not in current),
+    )
+
+
+@dataclass
+class DiseaseCollectionManifest:
+    """
+    Record of the HPOA mapping a disease collection was built from.
+
+    Attributes:
+        collection: Name of the disease collection
+        hpoa_version: Release of the applied ``phenotype.hpoa``
+        hp_fingerprint: Fingerprint of the HPO embedding store the embeddings were computed from
+        digests: ``{disease_id: digest}`` of the applied mapping
+        precision: Precision of the HPO embedding store (None in manifests written before it was recorded)
+    """
+    collection: str
+    hpoa_version: Optional[str]
+    hp_fingerprint: Optional[Dict[str, Any]]
+    digests: Dict[str, str]
+    precision: Optional[str] = None
+
+    @staticmethod
+    def path_for(directory: Union[str, Path], collection_name: str) -> Path:
+        return Path(directory) / f"{collection_name}.json"
+
+    @classmethod
+    def load(cls, directory: Union[str, Path], collection_name: str) -> Optional["DiseaseCollectionManifest"]:
+        """Load the manifest of a collection, or None if there is none (or it cannot be read)."""
+        path = cls.path_for(directory, collection_name)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r") as f:
+                return cls(**json.load(f))
+        except (json.JSONDecodeError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable disease collection manifest {path}: {e}")
+            return None
+
+    def save(self, directory: Union[str, Path]) -> Path:
+        path = self.path_for(directory, self.collection)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(asdict(self), f)
+        tmp_path.replace(path)
+        return path
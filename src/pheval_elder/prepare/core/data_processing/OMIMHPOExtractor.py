@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 from collections import defaultdict
@@ -114,6 +115,40 @@ class OMIMHPOExtractor:
             data = file.read()
         return data
 
+    @staticmethod
+    def read_hpoa_version(file_path: Union[str, Path]) -> str:
+        """
+        Reads the release of an HPOA file from its header.
+
+        Uses the ``#version:`` (or older ``#date:``) header line; files without one
+        are identified by a hash of their content.
+
+        :param file_path: Path to the HPOA file.
+        :return: Release string such as "2024-04-26", or "sha1:<digest>".
+        """
+        with open(file_path, 'r') as file:
+            for line in file:
+                if not line.startswith("#"):
+                    break
+                key, _, value = line[1:].partition(":")
+                if key.strip() in ("version", "date") and value.strip():
+                    return value.strip()
+        return f"sha1:{OMIMHPOExtractor.file_digest(file_path)}"
+
+    @staticmethod
+    def file_digest(file_path: Union[str, Path]) -> str:
+        """
+        Computes the SHA-1 digest of a file's content.
+
+        :param file_path: Path to the file.
+        :return: Hex digest of the file.
+        """
+        digest = hashlib.sha1()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
     @staticmethod
     def save_results_as_pretty_json_string(data: Dict, outfile: str, output_dir: Optional[str] = None) -> None:
         """
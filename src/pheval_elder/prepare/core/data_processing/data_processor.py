@@ -1,88 +1,368 @@
 import logging
-from collections import defaultdict
+import os
+import time
+from collections import defaultdict, deque
 from concurrent.futures import ProcessPoolExecutor, as_completed
 import json
 from dataclasses import dataclass
 from functools import cached_property, cache
-from typing import Dict, Iterator, Any
+from typing import Dict, Iterator, Any, List, Mapping, Optional, Tuple
 from pathlib import Path
 import numpy as np
 from chromadb.types import Collection
+from tqdm import tqdm
 
+from pheval_elder.prepare.core.collections.incremental import DISEASE_MANIFEST_DIR
 from pheval_elder.prepare.core.data_processing.OMIMHPOExtractor import OMIMHPOExtractor
+from pheval_elder.prepare.core.query.ranked_results import DiseaseTable
+from pheval_elder.prepare.core.query.result_cache import RESULT_CACHE_DIR
 from pheval_elder.prepare.core.store.chromadb_manager import ChromaDBManager
+from pheval_elder.prepare.core.store.embedding_store import (
+    EMBEDDING_STORE_DIR,
+    EmbeddingPrecision,
+    HPEmbeddingStore,
+    l2_normalize,
+)
+from pheval_elder.prepare.core.store.similarity_matrix import (
+    DEFAULT_TILE_SIZE,
+    SIMILARITY_MATRIX_DIR,
+    HPSimilarityMatrix,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+HPO_LOAD_PAGE_SIZE = 2000
+
+
+def decode_hpo_metadata(metadatas: List[Dict[str, Any]]) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    Extract ``(original_id, label)`` pairs from curateGPT ``_json`` metadata.
+
+    Module-level so it can be shipped to worker processes. Entries without an id
+    are returned as ``(None, None)`` to keep positions aligned with the page.
+    """
+    decoded = []
+    for metadata in metadatas:
+        hpo_id = None
+        label = None
+        if isinstance(metadata, dict) and "_json" in metadata:
+            try:
+                metadata_json = json.loads(metadata["_json"])
+                hpo_id = metadata_json.get("original_id")
+                label = metadata_json.get("label")
+                if hpo_id is None and isinstance(metadata_json.get("metadata"), dict):
+                    hpo_id = metadata_json["metadata"].get("original_id")
+                    label = metadata_json["metadata"].get("label")
+            except (json.decoder.JSONDecodeError, KeyError) as e:
+                logger.warning(f"Failed to parse _json metadata: {e}")
+        if hpo_id:
+            if label is None:
+                logger.warning(f"Warning: Label missing for {hpo_id}, setting default")
+                label = "Unknown"
+            decoded.append((hpo_id, label))
+        else:
+            logger.warning(f"Warning: Missing 'original_id' in metadata: {metadata}")
+            decoded.append((None, None))
+    return decoded
+
+
 @dataclass
 class DataProcessor:
 
     db_manager: ChromaDBManager
+    embedding_precision: EmbeddingPrecision = EmbeddingPrecision.FLOAT32
+    lazy_embeddings: bool = False
 
     def __post_init__(self):
+        self.embedding_precision = EmbeddingPrecision(self.embedding_precision)
         self._hp_embeddings = None
+        self._hp_embedding_store = None
+        self._lazy_hp_embeddings = None
         self._disease_to_hps = None
         self._disease_to_hps_with_frequencies = None
 
+    @cached_property
+    def hp_embedding_store(self) -> HPEmbeddingStore:
+        """
+        Contiguous (N x D) matrix of all HPO embeddings plus an id -> row index.
+
+        The matrix is kept in the configured embedding precision (float32 by default).
+        The store is persisted next to the Chroma DB and memory-mapped on later runs,
+        so it is only rebuilt from the collection when the collection fingerprint
+        (name, count, venomx embedding model, sample hash) no longer matches the
+        one recorded in the snapshot.
+        """
+        if self._hp_embedding_store is None:
+            self._hp_embedding_store = self.load_or_create_hpo_embedding_store()
+        return self._hp_embedding_store
+
     @cached_property
     def hp_embeddings(self) -> Dict[str, Dict[str, Any]]:
+        """
+        HPO embeddings as ``{hp_id: {"label", "embeddings"}}`` mapping.
+
+        With ``lazy_embeddings`` the mapping fetches only the requested ids from the
+        collection, resolved through the persisted HPO id -> Chroma id index, and
+        falls back to the full store for batch workloads.
+        """
+        if self._hp_embeddings is None and self.lazy_embeddings and self._hp_embedding_store is None:
+            self._hp_embeddings = self.lazy_hp_embeddings()
+            return self._hp_embeddings
         if self._hp_embeddings is None:
-            self._hp_embeddings = self.create_hpo_id_to_embedding(self.db_manager.ont_hp)
+            self._hp_embeddings = self.hp_embedding_store.as_dict()
         if len(self._hp_embeddings) > 0:
             return self._hp_embeddings
         else:
             logger.warning(f"No HPO embeddings found for {self.db_manager.ont_hp}")
             return {}
 
+    def lazy_hp_embeddings(self) -> Mapping[str, Dict[str, Any]]:
+        """
+        HPO embeddings fetched by id on demand, independent of the ``lazy_embeddings`` flag.
+
+        Ids are resolved through the HPO id -> Chroma id index (see ``LazyHPEmbeddings``).
+        Once the full store is loaded, its view is returned instead.
+        """
+        if self._hp_embedding_store is not None:
+            return self._hp_embedding_store.as_dict()
+        if self._lazy_hp_embeddings is None:
+            from pheval_elder.prepare.core.data_processing.lazy_embeddings import (
+                LazyHPEmbeddings,
+                load_or_create_chroma_id_index,
+            )
+
+            collection = self.db_manager.ont_hp
+            self._lazy_hp_embeddings = LazyHPEmbeddings(
+                collection,
+                lambda: self.hp_embedding_store,
+                id_index_loader=lambda: load_or_create_chroma_id_index(
+                    self.embedding_store_dir, collection, self.hp_collection_fingerprint
+                ),
+            )
+        return self._lazy_hp_embeddings
+
+    @property
+    def hpoa_path(self) -> Path:
+        """Path of the ``phenotype.hpoa`` file the disease mappings are read from."""
+        return Path(__file__).resolve().parents[5] / "phenotype.hpoa"
+
+    @cached_property
+    def hpoa_version(self) -> str:
+        """Release of the ``phenotype.hpoa`` file, recorded in the disease collections."""
+        return OMIMHPOExtractor.read_hpoa_version(self.hpoa_path)
+
+    @cached_property
+    def hpoa_hash(self) -> str:
+        """Digest of the ``phenotype.hpoa`` file content."""
+        return OMIMHPOExtractor.file_digest(self.hpoa_path)
+
+    @cached_property
+    def disease_table(self) -> DiseaseTable:
+        """Id / name table of all annotated diseases; the rows of RankedResults point into it."""
+        return DiseaseTable.from_disease_to_hps(self.disease_to_hps)
+
+    @cached_property
+    def hp_collection_fingerprint(self) -> Dict[str, Any]:
+        """Fingerprint of the HPO collection, see ``ChromaDBManager.collection_fingerprint``."""
+        return ChromaDBManager.collection_fingerprint(self.db_manager.ont_hp)
+
+    @cached_property
+    def hp_dimension(self) -> int:
+        """Dimension of the HPO embeddings, read from a single row unless the store is loaded."""
+        if self._hp_embedding_store is not None:
+            return self._hp_embedding_store.dimension
+        page = self.db_manager.ont_hp.get(limit=1, include=["embeddings"])
+        embeddings = page.get("embeddings")
+        return len(embeddings[0]) if embeddings is not None and len(embeddings) > 0 else 0
+
     @cached_property
     def disease_to_hps_with_frequencies(self) -> Dict:
         if self._disease_to_hps_with_frequencies is None:
-            file = Path(__file__).resolve().parents[5]
-            file_path = file / "phenotype.hpoa"
-            data = OMIMHPOExtractor.read_data_from_file(file_path)
+            data = OMIMHPOExtractor.read_data_from_file(self.hpoa_path)
             self._disease_to_hps_with_frequencies = OMIMHPOExtractor.extract_omim_hpo_mappings_with_frequencies_1(data)
         return self._disease_to_hps_with_frequencies
 
     @cached_property
     def disease_to_hps(self) -> Dict:
         if self._disease_to_hps is None:
-            file = Path(__file__).resolve().parents[5]
-            file_path = file / "phenotype.hpoa"
-            data = OMIMHPOExtractor.read_data_from_file(file_path)
+            data = OMIMHPOExtractor.read_data_from_file(self.hpoa_path)
             self._disease_to_hps = OMIMHPOExtractor.extract_omim_hpo_mappings_default(data)
         return self._disease_to_hps
 
+    @property
+    def embedding_store_dir(self) -> Path:
+        """Directory next to the Chroma DB holding the persisted embedding stores."""
+        return Path(self.db_manager.path) / EMBEDDING_STORE_DIR
+
+    @property
+    def disease_manifest_dir(self) -> Path:
+        """Directory next to the Chroma DB holding the manifests of the disease collections."""
+        return Path(self.db_manager.path) / DISEASE_MANIFEST_DIR
+
+    @property
+    def result_cache_dir(self) -> Path:
+        """Directory next to the Chroma DB holding the on-disk result cache."""
+        return Path(self.db_manager.path) / RESULT_CACHE_DIR
+
+    @property
+    def similarity_matrix_dir(self) -> Path:
+        """Directory next to the Chroma DB holding the persisted HPO similarity matrices."""
+        return Path(self.db_manager.path) / SIMILARITY_MATRIX_DIR
+
+    def load_similarity_matrix(self) -> Optional[HPSimilarityMatrix]:
+        """Memory-map the similarity matrix of the HPO collection, or None if it is missing or stale."""
+        name = self.db_manager.ont_hp.name
+        matrix = HPSimilarityMatrix.load(self.similarity_matrix_dir, name)
+        if matrix is None:
+            return None
+        if not matrix.matches(self.hp_embedding_store):
+            logger.warning(f"HPO similarity matrix for {name} is stale, rebuild it with `elder build-similarities`")
+            return None
+        return matrix
+
+    def build_similarity_matrix(
+            self,
+            tile_size: int = DEFAULT_TILE_SIZE,
+            workers: Optional[int] = None
+    ) -> HPSimilarityMatrix:
+        """Compute and persist the all-pairs similarity matrix of the HPO collection."""
+        return HPSimilarityMatrix.build(
+            self.hp_embedding_store, self.similarity_matrix_dir, self.db_manager.ont_hp.name,
+            tile_size=tile_size, workers=workers,
+        )
+
+    def load_or_create_hpo_embedding_store(self) -> HPEmbeddingStore:
+        """
+        Memory-map the persisted HPO embedding store, or build it from the collection and persist it.
+
+        A persisted store (snapshot) is only used if its fingerprint matches the current
+        fingerprint of the collection (name, count, embedding model, sample hash), so the
+        full collection read is skipped whenever the collection is unchanged.
+        Snapshots persisted before rows were pre-normalised are normalised and saved again.
+        """
+        collection = self.db_manager.ont_hp
+        fingerprint = self.hp_collection_fingerprint
+        store = HPEmbeddingStore.load(self.embedding_store_dir, collection.name, self.embedding_precision)
+        if store is not None and store.fingerprint == fingerprint and store.normalized:
+            logger.info(f"Loaded {store.precision.value} HPO embedding snapshot for {collection.name} from {store.path}")
+            return store
+
+        # reduced-precision stores are derived from the float32 store
+        if self.embedding_precision != EmbeddingPrecision.FLOAT32:
+            store = HPEmbeddingStore.load(self.embedding_store_dir, collection.name)
+        if store is None or store.fingerprint != fingerprint:
+            if store is not None:
+                logger.info(f"HPO embedding snapshot for {collection.name} is stale, rebuilding it")
+            store = self.create_hpo_embedding_store(collection)
+            store.fingerprint = fingerprint
+            if len(store) > 0:
+                store.save(self.embedding_store_dir, collection.name)
+        elif not store.normalized:
+            store = store.normalize()
+            store.save(self.embedding_store_dir, collection.name)
+        if self.embedding_precision != EmbeddingPrecision.FLOAT32 and len(store) > 0:
+            store = store.with_precision(self.embedding_precision)
+            store.save(self.embedding_store_dir, collection.name)
+        return store
+
     @staticmethod
     def create_hpo_id_to_embedding(collection: Collection) -> Dict[str, Dict[str, Any]]:
         """
         Create a dictionary mapping HPO IDs to embeddings.
         """
-        hpo_id_to_data = defaultdict(dict)
-        results = collection.get(include=["metadatas", "embeddings"])
-        for metadata, embedding in zip(results.get("metadatas", []), results.get("embeddings", []), strict=False):
-            hpo_id = None
-            if isinstance(metadata, dict) and "_json" in metadata:
-                try:
-                    metadata_json = json.loads(metadata["_json"])
-                    hpo_id = metadata_json.get("original_id")
-                    label = metadata_json.get("label")
-                    if hpo_id is None and isinstance(metadata_json.get("metadata"), dict):
-                        hpo_id = metadata_json["metadata"].get("original_id")
-                        label = metadata_json["metadata"].get("label")
-                except (json.decoder.JSONDecodeError, KeyError) as e:
-                    logger.warning(f"Failed to parse _json metadata: {e}")
+        return DataProcessor.create_hpo_embedding_store(collection).as_dict()
+
+    @staticmethod
+    def create_hpo_embedding_store(
+            collection: Collection,
+            page_size: int = HPO_LOAD_PAGE_SIZE,
+            num_workers: Optional[int] = None,
+            max_pages_in_flight: int = 4,
+    ) -> HPEmbeddingStore:
+        """
+        Read all HPO embeddings of a collection into a contiguous, L2-normalised float32 store.
+
+        The collection is read in ``limit``/``offset`` pages. Embeddings of each page are
+        written straight into a preallocated matrix, while the ``_json`` metadata of the
+        page is decoded in a process pool. At most ``max_pages_in_flight`` pages of
+        metadata are pending at any time, which bounds the transient memory to a few pages.
+
+        :param collection: Chroma collection holding the curateGPT HPO embeddings.
+        :param page_size: Number of rows fetched per ``collection.get`` call.
+        :param num_workers: Metadata decoding processes (0 decodes inline, None picks a default).
+        :param max_pages_in_flight: Maximum number of pages waiting to be decoded.
+        :return: HPEmbeddingStore with one row per HPO id, recording the Chroma id of every row.
+        """
+        total = collection.count()
+        if total == 0:
+            return HPEmbeddingStore(ids=[], labels=[], matrix=np.empty((0, 0), dtype=np.float32))
+        if num_workers is None:
+            num_workers = min(4, os.cpu_count() or 1) if total > page_size else 0
+
+        start = time.time()
+        matrix = None
+        decoded: List[Tuple[Optional[str], Optional[str]]] = []
+        chroma_ids: List[str] = []
+        pending = deque()
+        executor = ProcessPoolExecutor(max_workers=num_workers) if num_workers > 0 else None
+        try:
+            with tqdm(total=total, unit="rows", desc=f"Loading {collection.name}") as progress:
+                for offset in range(0, total, page_size):
+                    page = collection.get(
+                        include=["metadatas", "embeddings"],
+                        limit=min(page_size, total - offset),
+                        offset=offset,
+                    )
+                    embeddings = page.get("embeddings")
+                    metadatas = page.get("metadatas") or []
+                    if embeddings is None or len(embeddings) == 0:
+                        break
+                    if matrix is None:
+                        matrix = np.empty((total, len(embeddings[0])), dtype=np.float32)
+                    matrix[offset:offset + len(embeddings)] = embeddings
+                    chroma_ids.extend(page["ids"])
+                    del page, embeddings
+
+                    if executor is None:
+                        decoded.extend(decode_hpo_metadata(metadatas))
+                    else:
+                        pending.append(executor.submit(decode_hpo_metadata, metadatas))
+                        while len(pending) > max_pages_in_flight:
+                            decoded.extend(pending.popleft().result())
+                    progress.update(len(metadatas))
+                while pending:
+                    decoded.extend(pending.popleft().result())
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        selected = {}
+        for position, (hpo_id, label) in enumerate(decoded):
             if hpo_id:
-                if label is None:
-                    logger.warning(f"Warning: Label missing for {hpo_id}, setting default")
-                    label = "Unknown"
-                hpo_id_to_data[hpo_id] = {
-                    "label": label,
-                    "embeddings": np.array(embedding)
-                }
-            else:
-                logger.warning(f"Warning: Missing 'original_id' in metadata: {metadata}")
-        return hpo_id_to_data
+                # later duplicates win, as with the former dict-based mapping
+                selected[hpo_id] = (label, position)
+
+        elapsed = time.time() - start
+        logger.info(
+            f"Loaded {len(decoded)} rows from {collection.name} in {elapsed:.2f}s "
+            f"({len(decoded) / max(elapsed, 1e-9):.0f} rows/s), {len(selected)} HPO ids"
+        )
+        if not selected:
+            return HPEmbeddingStore(ids=[], labels=[], matrix=np.empty((0, 0), dtype=np.float32))
+
+        positions = [position for _, position in selected.values()]
+        if positions != list(range(matrix.shape[0])):
+            # drop rows without id, duplicates and rows beyond a shrunk collection
+            matrix = matrix[positions]
+        matrix, norms = l2_normalize(matrix, copy=False)
+        return HPEmbeddingStore(
+            ids=list(selected.keys()),
+            labels=[label for label, _ in selected.values()],
+            matrix=matrix,
+            norms=norms,
+            chroma_ids=[chroma_ids[position] for position in positions],
+        )
 
     @staticmethod
     def create_disease_to_hps_dict(collection: Collection) -> Dict:
@@ -104,6 +384,8 @@ class DataProcessor:
 
     @staticmethod
     def calculate_average_embedding(hps: list, embeddings_dict: Dict) -> np.ndarray:
+        if hasattr(embeddings_dict, "prefetch"):
+            embeddings_dict.prefetch(hps)
         embeddings = [embeddings_dict[hp_id]["embeddings"] for hp_id in hps if hp_id in embeddings_dict]
         return np.mean(embeddings, axis=0) if embeddings else []
 
@@ -0,0 +1,228 @@
+"""
+Lazy HPO embedding accessor for small interactive queries.
+
+Answering a single phenotype set only needs a handful of HPO embeddings, but
+building the full HPEmbeddingStore reads the whole ontology from Chroma.
+LazyHPEmbeddings fetches the requested ids on demand, memoises them in an LRU
+cache and switches to the bulk store once the access pattern looks like a
+batch workload (many distinct ids, or iteration over all terms).
+
+curateGPT keeps the HPO id only inside the ``_json`` metadata string, which
+Chroma cannot filter on, so HPO ids are translated to Chroma ids through an
+id index. The index comes from the Chroma ids recorded in the persisted
+embedding store; without an up-to-date store it is read once from the
+metadata of the collection and persisted next to the embedding stores, keyed
+by the collection fingerprint.
+"""
+
+import json
+import logging
+import os
+from collections import OrderedDict
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+from chromadb.types import Collection
+
+from pheval_elder.prepare.core.data_processing.data_processor import HPO_LOAD_PAGE_SIZE, decode_hpo_metadata
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore, HPEmbeddingsView
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_BULK_THRESHOLD = 1000
+# subdirectory of the embedding store directory, keeps the index out of list_stores
+ID_INDEX_DIR = "id_index"
+
+
+def build_chroma_id_index(collection: Collection, page_size: int = HPO_LOAD_PAGE_SIZE) -> Dict[str, str]:
+    """
+    Map the HPO ids of a curateGPT collection to their Chroma ids.
+
+    Only ids and metadata are read, in ``limit``/``offset`` pages; later
+    duplicates of an HPO id win, as in ``create_hpo_embedding_store``.
+    """
+    index = {}
+    total = collection.count()
+    for offset in range(0, total, page_size):
+        page = collection.get(include=["metadatas"], limit=min(page_size, total - offset), offset=offset)
+        chroma_ids = page.get("ids") or []
+        if not chroma_ids:
+            break
+        for chroma_id, (hpo_id, _) in zip(chroma_ids, decode_hpo_metadata(page.get("metadatas") or [])):
+            if hpo_id:
+                index[hpo_id] = chroma_id
+    return index
+
+
+def load_or_create_chroma_id_index(
+        directory: Union[str, Path],
+        collection: Collection,
+        fingerprint: Dict[str, Any],
+) -> Dict[str, str]:
+    """
+    Load the persisted HPO id -> Chroma id index of a collection, or build and persist it.
+
+    The Chroma ids recorded in the float32 embedding store of the collection are
+    used when the store matches ``fingerprint``. Otherwise the index is read from
+    its own file, and only built with a metadata scan of the whole collection
+    (``build_chroma_id_index``) if that is missing or stale as well.
+
+    Args:
+        directory: Embedding store directory
+        collection: Chroma collection holding the curateGPT HPO embeddings
+        fingerprint: Current fingerprint of the collection; a stored index with another
+            fingerprint is rebuilt
+
+    Returns:
+        Dictionary from HPO id to Chroma id
+    """
+    meta = HPEmbeddingStore.read_meta(directory, collection.name)
+    if meta is not None and meta.get("fingerprint") == fingerprint and meta.get("chroma_ids") is not None:
+        return dict(zip(meta["ids"], meta["chroma_ids"]))
+
+    path = Path(directory) / ID_INDEX_DIR / f"{collection.name}.json"
+    if path.exists():
+        try:
+            with open(path, "r") as f:
+                stored = json.load(f)
+            if stored.get("fingerprint") == fingerprint:
+                return stored["ids"]
+            logger.info(f"HPO id index for {collection.name} is stale, rebuilding it")
+        except (OSError, json.JSONDecodeError, KeyError) as e:
+            logger.warning(f"Failed to read HPO id index {path}: {e}")
+
+    index = build_chroma_id_index(collection)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"fingerprint": fingerprint, "ids": index}, f)
+    os.replace(tmp_path, path)
+    logger.info(f"Saved HPO id index of {collection.name} ({len(index)} ids) to {path}")
+    return index
+
+
+class LazyHPEmbeddings(Mapping):
+    """
+    Read-only ``{hp_id: {"label", "embeddings"}}`` mapping that fetches embeddings by id.
+
+    HPO ids are translated to Chroma ids with the index returned by
+    ``id_index_loader`` (called on the first fetch); without a loader the HPO
+    ids are used as Chroma ids. With ``load_or_create_chroma_id_index`` the
+    first fetch reads the ids of the persisted embedding store; only when no
+    up-to-date store or index file exists does it scan and decode the metadata
+    of the whole collection once, so that first query is not cheap. Unknown ids are remembered, so repeated
+    membership tests do not hit the collection again. After ``bulk_threshold``
+    distinct ids have been fetched, or when the mapping is iterated or sized,
+    the full store is loaded with ``bulk_loader`` and used from then on.
+    """
+
+    def __init__(
+            self,
+            collection: Collection,
+            bulk_loader: Callable[[], HPEmbeddingStore],
+            id_index_loader: Optional[Callable[[], Dict[str, str]]] = None,
+            cache_size: int = DEFAULT_CACHE_SIZE,
+            bulk_threshold: int = DEFAULT_BULK_THRESHOLD,
+    ):
+        self.collection = collection
+        self.bulk_loader = bulk_loader
+        self.id_index_loader = id_index_loader
+        self.cache_size = cache_size
+        self.bulk_threshold = bulk_threshold
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._missing = set()
+        self._fetched = 0
+        self._bulk: Optional[HPEmbeddingsView] = None
+        self._id_index: Optional[Dict[str, str]] = None
+
+    @property
+    def bulk_loaded(self) -> bool:
+        """Whether the accessor has switched to the full embedding store."""
+        return self._bulk is not None
+
+    def load_all(self) -> HPEmbeddingsView:
+        """Load the full embedding store and serve all further lookups from it."""
+        if self._bulk is None:
+            logger.info(f"Switching to bulk HPO embedding load after {self._fetched} selective fetches")
+            self._bulk = self.bulk_loader().as_dict()
+            self._cache.clear()
+            self._missing.clear()
+        return self._bulk
+
+    def prefetch(self, hp_ids: Iterable[str]) -> None:
+        """Fetch all uncached ids of ``hp_ids`` in one round trip."""
+        if self._bulk is not None:
+            return
+        misses = list(dict.fromkeys(
+            hp_id for hp_id in hp_ids if hp_id not in self._cache and hp_id not in self._missing
+        ))
+        if not misses:
+            return
+        if self._fetched + len(misses) > self.bulk_threshold:
+            self.load_all()
+            return
+        found = self._fetch(misses)
+        self._fetched += len(misses)
+        for hp_id in misses:
+            if hp_id in found:
+                self._remember(hp_id, found[hp_id])
+            else:
+                self._missing.add(hp_id)
+
+    def _remember(self, hp_id: str, entry: Dict[str, Any]) -> None:
+        self._cache[hp_id] = entry
+        self._cache.move_to_end(hp_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _fetch(self, hp_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Fetch embeddings by the Chroma ids of ``hp_ids``; ids missing from the id index are skipped."""
+        if self.id_index_loader is None:
+            chroma_ids = hp_ids
+        else:
+            if self._id_index is None:
+                self._id_index = self.id_index_loader()
+            chroma_ids = [self._id_index[hp_id] for hp_id in hp_ids if hp_id in self._id_index]
+        if not chroma_ids:
+            return {}
+        return self._decode(self.collection.get(ids=chroma_ids, include=["metadatas", "embeddings"]), hp_ids)
+
+    @staticmethod
+    def _decode(page: Dict[str, Any], wanted: List[str]) -> Dict[str, Dict[str, Any]]:
+        embeddings = page.get("embeddings")
+        if embeddings is None or len(embeddings) == 0:
+            return {}
+        wanted = set(wanted)
+        found = {}
+        for (hpo_id, label), embedding in zip(decode_hpo_metadata(page.get("metadatas") or []), embeddings):
+            if hpo_id in wanted:
+                found[hpo_id] = {"label": label, "embeddings": np.asarray(embedding, dtype=np.float32)}
+        return found
+
+    def __getitem__(self, hp_id: str) -> Dict[str, Any]:
+        if self._bulk is not None:
+            return self._bulk[hp_id]
+        if hp_id not in self._cache and hp_id not in self._missing:
+            self.prefetch([hp_id])
+            if self._bulk is not None:
+                return self._bulk[hp_id]
+        if hp_id in self._missing:
+            raise KeyError(hp_id)
+        self._cache.move_to_end(hp_id)
+        return self._cache[hp_id]
+
+    def __contains__(self, hp_id: object) -> bool:
+        try:
+            self[hp_id]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.load_all())
+
+    def __len__(self) -> int:
+        return len(self.load_all())
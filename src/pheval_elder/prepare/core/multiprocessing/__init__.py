@@ -17,6 +17,15 @@ from pheval_elder.prepare.core.multiprocessing.best_match_multiprocessing import
     process_phenotype_sets_parallel,
     OptimizedTermSetPairwiseComparison,
 )
+from pheval_elder.prepare.core.multiprocessing.multi_strategy_multiprocessing import (
+    process_multi_strategy_parallel,
+)
+from pheval_elder.prepare.core.multiprocessing.shared_data import (
+    SharedDataPlane,
+    shared,
+    shared_collection,
+    shared_store,
+)
 
 __all__ = [
     "process_avg_analysis_parallel",
@@ -25,4 +34,9 @@ __all__ = [
     "OptimizedWeightedAverageDiseaseEmbedAnalysis",
     "process_phenotype_sets_parallel",
     "OptimizedTermSetPairwiseComparison",
+    "process_multi_strategy_parallel",
+    "SharedDataPlane",
+    "shared",
+    "shared_collection",
+    "shared_store",
 ]
\ No newline at end of file
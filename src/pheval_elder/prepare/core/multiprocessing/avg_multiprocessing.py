@@ -6,17 +6,29 @@ using the average embedding strategy.
 """
 
 import gc
-from typing import List, Tuple, Any
+import logging
+from typing import Any, Dict, List, Sequence, Tuple
 import multiprocessing as mp
 
 import numpy as np
-from pheval.post_processing.post_processing import PhEvalDiseaseResult
 from tqdm import tqdm
 
-import pheval_elder.prepare.core.collections.globals as g
 from pheval_elder.prepare.core.data_processing.data_processor import DataProcessor
+from pheval_elder.prepare.core.multiprocessing.shared_data import (
+    SharedDataPlane,
+    shared,
+    shared_collection,
+    shared_store,
+)
+from pheval_elder.prepare.core.query.exact_search import average_query_embeddings
+from pheval_elder.prepare.core.query.ranked_results import DiseaseTable, RankedResults
 from pheval_elder.prepare.core.query.optimized_parallel_best_match import distribute_sets_evenly
 
+logger = logging.getLogger(__name__)
+
+# Query embeddings sent per Chroma query call
+DEFAULT_QUERY_BATCH_SIZE = 100
+
 
 class OptimizedAverageDiseaseEmbedAnalysis:
     """Analyzer for average disease embedding analysis."""
@@ -24,11 +36,21 @@ class OptimizedAverageDiseaseEmbedAnalysis:
     def __init__(self, data_processor: DataProcessor):
         """Initialize the analyzer with a data processor."""
         self.data_processor = data_processor
+        self.hp_embedding_store = data_processor.hp_embedding_store
         self.hp_embeddings = data_processor.hp_embeddings
-        
-    def get_parallel_processing_data(self):
-        """Return the data needed for parallel processing."""
-        return self.hp_embeddings
+
+    def publish_parallel_processing_data(self, plane: SharedDataPlane, collection_key: str = "disease_collection"):
+        """Publish the data needed for parallel processing; the workers find the collection under ``collection_key``."""
+        plane.publish_store(self.hp_embedding_store)
+        plane.publish_object("disease_table", self.data_processor.disease_table)
+        db_manager = self.data_processor.db_manager
+        plane.publish_collection(
+            collection_key,
+            db_manager.path,
+            db_manager.disease_embeddings_collection("avg").name,
+            host=db_manager.host,
+            port=db_manager.port,
+        )
 
 
 def calculate_average_embedding(query, embedding_map):
@@ -43,23 +65,11 @@ def calculate_average_embedding(query, embedding_map):
         return None
 
 
-def sort_and_create_pheval_disease_results(query) -> List[PhEvalDiseaseResult]:
-    """Create PhEvalDiseaseResult objects from query results."""
-    disease_ids = query['ids'][0] if 'ids' in query and query['ids'] else []
-    distances = query['distances'][0] if 'distances' in query and query['distances'] else []
-    disease_names = (
-        [metadata['disease_name'] for metadata in query['metadatas'][0]]
-        if 'metadatas' in query and query['metadatas']
-        else []
-    )
-    sorted_results = sorted(zip(disease_ids, disease_names, distances), key=lambda x: x[2])
-    return [
-        PhEvalDiseaseResult(
-            disease_identifier=a,
-            disease_name=b,
-            score=c
-        ) for a, b, c in sorted_results
-    ]
+def ranked_results_from_query(query, table: DiseaseTable, position: int = 0) -> RankedResults:
+    """Create the RankedResults of the ``position``-th query embedding of a Chroma query (ids and distances)."""
+    disease_ids = query['ids'][position] if 'ids' in query and query['ids'] else []
+    distances = query['distances'][position] if 'distances' in query and query['distances'] else []
+    return RankedResults.from_ids(table, disease_ids, distances)
 
 
 def query_disease_avg_collection(pheno_set, hp_embeddings, n_results):
@@ -70,34 +80,67 @@ def query_disease_avg_collection(pheno_set, hp_embeddings, n_results):
 
     query_params = {
         "query_embeddings": [avg_embedding.tolist()],
-        "include": ["metadatas", "embeddings", "distances"],
+        "include": ["distances"],
         "n_results": n_results
     }
 
-    query_results = g.global_avg_disease_emb_collection.query(**query_params)
-    return sort_and_create_pheval_disease_results(query=query_results)
+    query_results = shared_collection("disease_collection").query(**query_params)
+    return ranked_results_from_query(query_results, shared("disease_table"))
 
 
-def process_avg_tasks(args) -> List[Tuple[Any, List[PhEvalDiseaseResult]]]:
-    """Process a batch of phenotype sets for average embedding analysis."""
-    batch, nr_of_results, processing_data = args
-    hp_embeddings = processing_data
-    results = []
-    for orig_idx, phenotype_set in batch:
-        result = query_disease_avg_collection(
-            pheno_set=phenotype_set,
-            hp_embeddings=hp_embeddings,
-            n_results=nr_of_results,
+def query_collection_batched(
+        collection,
+        table: DiseaseTable,
+        batch: Sequence[Tuple[Any, List[str]]],
+        n_results: int,
+        query_batch_size: int = DEFAULT_QUERY_BATCH_SIZE
+) -> List[Tuple[Any, RankedResults]]:
+    """
+    Query a disease collection for a batch of phenotype sets with multi-embedding queries.
+
+    All averaged query embeddings of the batch are computed first (one sparse-dense
+    product), then sent ``query_batch_size`` at a time and the results split per set.
+
+    Args:
+        collection: Disease embedding collection
+        table: Disease table the results point into
+        batch: (original index, phenotype set) pairs
+        n_results: Number of diseases per phenotype set
+        query_batch_size: Number of query embeddings per ``collection.query`` call
+
+    Returns:
+        (original index, results) pairs; phenotype sets without embedded phenotypes get no results
+    """
+    positions, queries = average_query_embeddings(shared_store(), [phenotype_set for _, phenotype_set in batch])
+    results: Dict[int, RankedResults] = {}
+    for start in range(0, len(positions), query_batch_size):
+        chunk = positions[start:start + query_batch_size]
+        query_results = collection.query(
+            query_embeddings=queries[start:start + query_batch_size].tolist(),
+            include=["distances"],
+            n_results=n_results,
         )
-        results.append((orig_idx, result))
-    return results
+        for i, position in enumerate(chunk):
+            results[int(position)] = ranked_results_from_query(query_results, table, position=i)
+    if len(positions) < len(batch):
+        logger.warning(f"{len(batch) - len(positions)} phenotype sets have no embedded phenotypes")
+    return [(orig_idx, results.get(position) or RankedResults.empty()) for position, (orig_idx, _) in enumerate(batch)]
+
+
+def process_avg_tasks(args) -> List[Tuple[Any, RankedResults]]:
+    """Process a batch of phenotype sets for average embedding analysis."""
+    batch, nr_of_results, query_batch_size = args
+    return query_collection_batched(
+        shared_collection("disease_collection"), shared("disease_table"), batch, nr_of_results, query_batch_size
+    )
 
 
 def process_avg_analysis_parallel(
         phenotype_sets: List[List[str]],
         oadea_analyzer,
-        nr_of_results: int
-) -> List[List[PhEvalDiseaseResult]]:
+        nr_of_results: int,
+        query_batch_size: int = DEFAULT_QUERY_BATCH_SIZE
+) -> List[RankedResults]:
     """
     Process phenotype sets in parallel for average embedding analysis.
     
@@ -105,36 +148,37 @@ def process_avg_analysis_parallel(
         phenotype_sets: List of phenotype sets (lists of HPO IDs)
         oadea_analyzer: Analyzer for average disease embedding analysis
         nr_of_results: Number of results to return
+        query_batch_size: Number of query embeddings per Chroma query call
         
     Returns:
-        List of lists of PhEvalDiseaseResult objects, one list per phenotype set
+        One RankedResults per phenotype set
     """
-    processing_data = oadea_analyzer.get_parallel_processing_data()
-
     num_cores = mp.cpu_count()
     num_workers = min(num_cores, len(phenotype_sets))
     
     distributed_sets = distribute_sets_evenly(phenotype_sets, num_workers)
 
     process_args = [
-            (worker_sets, nr_of_results, processing_data)
+            (worker_sets, nr_of_results, query_batch_size)
             for worker_sets in distributed_sets
             if worker_sets
         ]
 
-    with mp.Pool(num_cores) as pool:
-        batch_results = list(tqdm(
-            pool.imap(process_avg_tasks, process_args),
-            total=len(process_args),
-            desc="Processing phenotype sets in parallel for avg analysis"
-        ))
-        pool.close()
-        pool.join()
+    with SharedDataPlane() as plane:
+        oadea_analyzer.publish_parallel_processing_data(plane)
+        with plane.pool(num_workers) as pool:
+            batch_results = list(tqdm(
+                pool.imap(process_avg_tasks, process_args),
+                total=len(process_args),
+                desc="Processing phenotype sets in parallel for avg analysis"
+            ))
+            pool.close()
+            pool.join()
 
     print(f"\n----------\nFinished processing {len(phenotype_sets)} phenotype sets in parallel\n----------\n")
     gc.collect()
     
-    final_results = [[] for _ in range(len(phenotype_sets))]
+    final_results = [RankedResults.empty() for _ in range(len(phenotype_sets))]
     for worker_results in batch_results:
         for orig_idx, result_list in worker_results:
             final_results[orig_idx] = result_list
@@ -2,15 +2,28 @@ import gc
 import os
 import time
 from collections import defaultdict
-from typing import List, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 import psutil
-from pheval.post_processing.post_processing import PhEvalDiseaseResult
 from tqdm import tqdm
 
+from pheval_elder.prepare.core.multiprocessing.shared_data import SharedDataPlane, shared, shared_store
+from pheval_elder.prepare.core.query.best_match_engine import (
+    BestMatchEngine,
+    BMAAggregation,
+    similarity_tiles,
+    tile_capacity,
+)
+from pheval_elder.prepare.core.query.ranked_results import RankedResults
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore
+from pheval_elder.prepare.core.store.similarity_matrix import HPSimilarityMatrix
+
 worker_task_count = defaultdict(int)  # Track number of tasks per worker
 
+# weight of disease phenotypes without an HPOA frequency, as in OMIMHPOExtractor
+DEFAULT_PHENOTYPE_FREQUENCY = 0.5
+
 def log_memory_usage(stage):
     process = psutil.Process(os.getpid())
     mem = process.memory_info().rss / 1e9  # to GB
@@ -18,9 +31,22 @@ def log_memory_usage(stage):
 
 
 class OptimizedTermSetPairwiseComparison:
-    def __init__(self, data_processor):
+    def __init__(
+            self,
+            data_processor,
+            memory_budget_bytes: Optional[int] = None,
+            similarity_matrix: Optional[HPSimilarityMatrix] = None,
+            aggregations: Optional[Sequence[BMAAggregation]] = None
+    ):
         self.data_processor = data_processor
+        # per worker; with a budget the similarities are computed in tiles while scoring
+        self.memory_budget_bytes = memory_budget_bytes
+        # persisted all-pairs similarities; when given, similarities are looked up instead of computed
+        self.similarity_matrix = similarity_matrix
+        # every aggregation yields its own ranking from the same similarities
+        self.aggregations = [BMAAggregation(a) for a in aggregations or [BMAAggregation.BMA]]
         log_memory_usage("Before loading embeddings")
+        self.hp_embedding_store = data_processor.hp_embedding_store
         self.hp_embeddings = data_processor.hp_embeddings
         log_memory_usage("After loading embeddings")
         self.disease_to_hps_from_omim = data_processor.disease_to_hps
@@ -28,10 +54,24 @@ class OptimizedTermSetPairwiseComparison:
         self.disease_metadata = {}
         self.all_similarities = None
         self.disease_phenotype_indices = {}
+        self.disease_unit_vectors = None
+        # HPO id of every similarity-matrix column
+        self.disease_column_ids = []
 
 
     def precompute_similarities(self, all_phenotype_sets: List[List[str]]):
-        """Precompute all possible similarity scores between any input phenotype and disease phenotype."""
+        """
+        Precompute all possible similarity scores between any input phenotype and disease phenotype.
+
+        With a persisted similarity matrix nothing is computed: the input and disease
+        phenotypes are mapped to matrix rows and the workers look the similarities
+        up. With a memory budget only the disease side is prepared; the workers
+        compute the similarities tile by tile while scoring (see ``similarity_tiles``).
+        """
+        if self.similarity_matrix is not None:
+            self._index_similarity_matrix(all_phenotype_sets)
+            return
+
         print("Starting similarity precomputation...")
 
         # Get all disease phenotypes and build index maps
@@ -44,10 +84,22 @@ class OptimizedTermSetPairwiseComparison:
             }
 
         valid_disease_phenotypes = [hp for hp in all_disease_phenotypes if hp in self.hp_embeddings]
-        disease_embeddings_matrix = np.array([
-            self.hp_embeddings[hp]['embeddings']
-            for hp in valid_disease_phenotypes
-        ])
+        disease_embeddings_matrix = self.hp_embedding_store.unit_vectors(valid_disease_phenotypes)
+
+        # Pre-calculate disease-phenotype indices
+        disease_hp_index_map = {hp: i for i, hp in enumerate(valid_disease_phenotypes)}
+        self.disease_column_ids = valid_disease_phenotypes
+        for disease_id, disease_data in self.disease_to_hps_from_omim.items():
+            phenotype_indices = sorted({disease_hp_index_map[hp] for hp in disease_data["phenotypes"]
+                                        if hp in disease_hp_index_map})
+            if phenotype_indices:
+                self.disease_phenotype_indices[disease_id] = np.array(phenotype_indices)
+
+        if self.memory_budget_bytes is not None:
+            self.disease_unit_vectors = disease_embeddings_matrix
+            print(f"Prepared {len(valid_disease_phenotypes)} disease phenotypes for tiled similarities "
+                  f"within {self.memory_budget_bytes / 1e6:.0f} MB per worker")
+            return
 
         # Get all unique input phenotypes and build index map
         unique_input_hps = set()
@@ -59,10 +111,7 @@ class OptimizedTermSetPairwiseComparison:
         for idx, hp in enumerate(valid_input_hps):
             self.input_hp_index_map[hp] = idx
 
-        input_embeddings_matrix = np.array([
-            self.hp_embeddings[hp]['embeddings']
-            for hp in valid_input_hps
-        ])
+        input_embeddings_matrix = self.hp_embedding_store.unit_vectors(valid_input_hps)
 
         print(
             f"Computing similarities between {len(valid_input_hps)} \
@@ -70,89 +119,130 @@ class OptimizedTermSetPairwiseComparison:
             f"disease phenotypes..."
         )
 
-        # Compute all pairwise similarities at once
-        norm_disease = np.linalg.norm(disease_embeddings_matrix, axis=1).reshape(1, -1)
-        norm_input = np.linalg.norm(input_embeddings_matrix, axis=1).reshape(-1, 1)
+        # Compute all pairwise similarities at once; rows are L2-normalised, so cosine is a plain GEMM
         log_memory_usage("Before computing similarity matrix")
-        self.all_similarities = np.dot(input_embeddings_matrix, disease_embeddings_matrix.T) / (
-                    norm_input @ norm_disease)
+        self.all_similarities = input_embeddings_matrix @ disease_embeddings_matrix.T
         log_memory_usage("After computing similarity matrix")
 
-        # Pre-calculate disease-phenotype indices
-        for disease_id, disease_data in self.disease_to_hps_from_omim.items():
-            phenotype_indices = [i for i, hp in enumerate(valid_disease_phenotypes)
-                                 if hp in disease_data["phenotypes"]]
-            if phenotype_indices:
-                self.disease_phenotype_indices[disease_id] = np.array(phenotype_indices)
-
         print("Precomputation complete!")
 
-    def get_parallel_processing_data(self):
-        """Return the minimal data needed for parallel processing."""
-        return (self.input_hp_index_map,
-                self.disease_metadata,
-                self.all_similarities,
-                self.disease_phenotype_indices)
+    def _index_similarity_matrix(self, all_phenotype_sets: List[List[str]]):
+        """Point the input and disease phenotypes at rows of the persisted similarity matrix."""
+        matrix = self.similarity_matrix
+        for disease_id, disease_data in self.disease_to_hps_from_omim.items():
+            self.disease_metadata[disease_id] = {
+                "name": disease_data["disease_name"],
+                "phenotypes": set(disease_data["phenotypes"])
+            }
+            phenotype_rows = np.unique(matrix.rows(disease_data["phenotypes"]))
+            if len(phenotype_rows):
+                self.disease_phenotype_indices[disease_id] = phenotype_rows
+        for hp_set in all_phenotype_sets:
+            for hp in hp_set:
+                if hp in matrix:
+                    self.input_hp_index_map[hp] = matrix.index[hp]
+        self.all_similarities = matrix.matrix
+        self.disease_column_ids = matrix.ids
+        print(f"Using the persisted {len(matrix)} x {len(matrix)} HPO similarity matrix {matrix.path}")
+
+    def publish_parallel_processing_data(self, plane: SharedDataPlane):
+        """
+        Publish the data needed for parallel processing to the shared data plane.
+
+        The similarity matrix and the disease phenotype columns in disease-grouped
+        CSR order (one index array plus offsets, see BestMatchEngine) are shared
+        as arrays; the input index map and the disease table rows are sent once
+        per worker. In tiled mode the HPO store and the disease phenotype
+        embeddings are shared instead of the similarity matrix; a persisted
+        similarity matrix is shared by path without copying.
+        """
+        disease_ids = list(self.disease_phenotype_indices.keys())
+        disease_weights = None
+        if BMAAggregation.WEIGHTED in self.aggregations:
+            disease_weights = self.disease_weights(disease_ids)
+        engine = BestMatchEngine.from_disease_indices(
+            [self.disease_phenotype_indices[disease_id] for disease_id in disease_ids], disease_weights
+        )
+
+        if self.similarity_matrix is not None:
+            plane.publish_object("bm.memory_budget", None)
+            plane.publish("bm.similarities", self.similarity_matrix.matrix, path=self.similarity_matrix.path)
+        elif self.memory_budget_bytes is not None:
+            plane.publish_object("bm.memory_budget", self.memory_budget_bytes)
+            plane.publish_store(self.hp_embedding_store)
+            plane.publish("bm.disease_unit_vectors", self.disease_unit_vectors)
+        else:
+            plane.publish_object("bm.memory_budget", None)
+            handle = plane.publish("bm.similarities", self.all_similarities)
+            # Keep only the shared copy of the matrix in the parent as well
+            self.all_similarities = handle.attach()
+        plane.publish("bm.disease_indices", engine.columns)
+        plane.publish("bm.disease_offsets", engine.offsets)
+        if engine.weights is not None:
+            plane.publish("bm.disease_weights", engine.weights)
+        plane.publish("bm.disease_rows", self.data_processor.disease_table.rows(disease_ids))
+        plane.publish_object("bm.input_hp_index_map", self.input_hp_index_map)
+        plane.publish_object("bm.aggregations", self.aggregations)
+
+    def disease_weights(self, disease_ids: List[str]) -> List[np.ndarray]:
+        """HPOA frequencies of the phenotypes of every disease, aligned with their similarity-matrix columns."""
+        frequencies = self.data_processor.disease_to_hps_with_frequencies
+        weights = []
+        for disease_id in disease_ids:
+            disease_frequencies = frequencies.get(disease_id, {}).get("phenotypes_and_frequencies") or {}
+            weights.append(np.array([
+                disease_frequencies.get(self.disease_column_ids[column], DEFAULT_PHENOTYPE_FREQUENCY)
+                for column in self.disease_phenotype_indices[disease_id]
+            ], dtype=np.float32))
+        return weights
 
 
 def process_batch_of_sets(args):
-    """Process a batch of phenotype sets with minimal data."""
+    """Process a batch of phenotype sets, ranked by the first aggregation of the published analyzer."""
+    return next(iter(score_batch_of_sets(args).values()))
+
+
+def score_batch_of_sets(args) -> Dict[BMAAggregation, List[Tuple[int, RankedResults]]]:
+    """Process a batch of phenotype sets, scoring all diseases of many sets per call for every aggregation."""
     pid = os.getpid()
     worker_task_count[pid] += 1
 
-    indexed_phenotype_sets_batch, nr_of_results, processing_data = args
-    input_hp_index_map, disease_metadata, all_similarities, disease_phenotype_indices = processing_data
+    indexed_phenotype_sets_batch, nr_of_results = args
+    disease_rows = shared("bm.disease_rows")
+    memory_budget = shared("bm.memory_budget")
+    aggregations = shared("bm.aggregations")
+    engine = BestMatchEngine(
+        columns=shared("bm.disease_indices"),
+        offsets=shared("bm.disease_offsets"),
+        weights=shared("bm.disease_weights") if BMAAggregation.WEIGHTED in aggregations else None,
+    )
 
-    batch_results = []
     batch_start_time = time.time()
-
-    for orig_idx, phenotype_set in indexed_phenotype_sets_batch:
-        set_start_time = time.time()
-        log_memory_usage(f"Before processing phenotype set in worker {pid}")
-
-        # Get valid phenotypes and their indices
-        valid_phenotypes = [hp for hp in phenotype_set if hp in input_hp_index_map]
-        if not valid_phenotypes:
-            batch_results.append((orig_idx, []))  # Empty result for this set
-            continue
-
-        phenotype_indices = np.array([input_hp_index_map[hp] for hp in valid_phenotypes])
-        disease_scores = []
-
-        # Calculate scores for all diseases
-        for disease_id, indices in disease_phenotype_indices.items():
-            if indices.size == 0:
-                continue
-
-            relevant_similarities = all_similarities[phenotype_indices][:, indices]
-            max_similarities = np.max(relevant_similarities, axis=1)
-            avg_score = float(np.mean(max_similarities))
-
-            disease_scores.append((
-                disease_id,
-                disease_metadata[disease_id]["name"],
-                avg_score
-            ))
-
-        set_end_time = time.time()
-        print(f"Worker {pid} processed set of size {len(phenotype_set)} in {set_end_time - set_start_time:.2f} seconds")
-
-        log_memory_usage(f"After processing phenotype set in worker {pid}")
-
-        # Sort and get top results for this set
-        sorted_scores = sorted(disease_scores, key=lambda x: x[2], reverse=True)[:nr_of_results]
-        batch_results.append((
-            orig_idx,
-            [
-                PhEvalDiseaseResult(
-                    disease_identifier=disease_id,
-                    disease_name=disease_name,
-                    score=score
-                )
-                for disease_id, disease_name, score in sorted_scores
-            ]
-        ))
-
+    log_memory_usage(f"Before processing batch in worker {pid}")
+
+    if memory_budget is None:
+        input_hp_index_map = shared("bm.input_hp_index_map")
+        # Rows of the valid input phenotypes of every set; sets without any come back empty
+        term_sets = [
+            np.array([input_hp_index_map[hp] for hp in phenotype_set if hp in input_hp_index_map], dtype=np.int64)
+            for _, phenotype_set in indexed_phenotype_sets_batch
+        ]
+        top_results = engine.top_k_aggregations(shared("bm.similarities"), term_sets, nr_of_results, aggregations)
+    else:
+        top_results = tiled_top_k(
+            engine, shared_store(), shared("bm.disease_unit_vectors"),
+            [phenotype_set for _, phenotype_set in indexed_phenotype_sets_batch], nr_of_results, memory_budget,
+            aggregations,
+        )
+    batch_results = {
+        aggregation: [
+            (orig_idx, RankedResults(rows=disease_rows[top], scores=scores))
+            for (orig_idx, _), (top, scores) in zip(indexed_phenotype_sets_batch, aggregation_results)
+        ]
+        for aggregation, aggregation_results in top_results.items()
+    }
+
+    log_memory_usage(f"After processing batch in worker {pid}")
     batch_end_time = time.time()
     print(
         f"Worker {pid} completed batch of {len(indexed_phenotype_sets_batch)} sets in {batch_end_time - batch_start_time:.2f} seconds")
@@ -161,14 +251,39 @@ def process_batch_of_sets(args):
     return batch_results
 
 
+def tiled_top_k(
+        engine: BestMatchEngine,
+        store: HPEmbeddingStore,
+        disease_unit_vectors: np.ndarray,
+        phenotype_sets: List[List[str]],
+        nr_of_results: int,
+        memory_budget_bytes: int,
+        aggregations: Sequence[BMAAggregation] = (BMAAggregation.BMA,)
+) -> Dict[BMAAggregation, List[Tuple[np.ndarray, np.ndarray]]]:
+    """
+    Score phenotype sets tile by tile within ``memory_budget_bytes``.
+
+    Returns:
+        Per aggregation, one (disease indices, scores) pair per set
+    """
+    engine.max_block_bytes = min(engine.max_block_bytes, max(memory_budget_bytes // 4, 1))
+    terms_per_tile = tile_capacity(memory_budget_bytes, len(disease_unit_vectors), engine.n_diseases)
+    top_results = {BMAAggregation(aggregation): [None] * len(phenotype_sets) for aggregation in aggregations}
+    for positions, term_sets, tile in similarity_tiles(store, disease_unit_vectors, phenotype_sets, terms_per_tile):
+        tile_results = engine.top_k_aggregations(tile, term_sets, nr_of_results, aggregations)
+        for aggregation, results in tile_results.items():
+            for position, result in zip(positions, results):
+                top_results[aggregation][position] = result
+    return top_results
+
+
 def process_phenotype_sets_parallel(
         phenotype_sets: List[List[str]],
         tcp_analyzer,
         nr_of_results: int
-) -> List[List[PhEvalDiseaseResult]]:
-    """Process multiple phenotype sets in parallel."""
+) -> List[RankedResults]:
+    """Process multiple phenotype sets in parallel, one RankedResults per phenotype set."""
     import multiprocessing as mp
-    processing_data = tcp_analyzer.get_parallel_processing_data()
 
     num_cores = mp.cpu_count()
     num_workers = min(num_cores, len(phenotype_sets))
@@ -177,19 +292,21 @@ def process_phenotype_sets_parallel(
     distributed_sets = distribute_sets_evenly(phenotype_sets, num_workers)
 
     process_args = [
-        (worker_sets, nr_of_results, processing_data)
+        (worker_sets, nr_of_results)
         for worker_sets in distributed_sets
         if worker_sets
     ]
 
-    with mp.Pool(num_workers) as pool:
-        batch_results = list(tqdm(
-            pool.imap(process_batch_of_sets, process_args),
-            total=num_workers,
-            desc="Processing phenotype sets in parallel"
-        ))
-        pool.close()
-        pool.join()
+    with SharedDataPlane() as plane:
+        tcp_analyzer.publish_parallel_processing_data(plane)
+        with plane.pool(num_workers) as pool:
+            batch_results = list(tqdm(
+                pool.imap(process_batch_of_sets, process_args),
+                total=num_workers,
+                desc="Processing phenotype sets in parallel"
+            ))
+            pool.close()
+            pool.join()
 
     print(f"""
     \n           ----------               \n
@@ -197,7 +314,7 @@ def process_phenotype_sets_parallel(
     \n           ----------               \n""")
     gc.collect()
 
-    final_results = [[] for _ in range(len(phenotype_sets))]
+    final_results = [RankedResults.empty() for _ in range(len(phenotype_sets))]
 
     for worker_results in batch_results:
         for orig_idx, result_list in worker_results:
@@ -0,0 +1,120 @@
+"""
+Multiprocessing module for running several strategies in one pass.
+
+The HPO embeddings, disease table and the data of every strategy (disease
+collections for avg / wgt_avg, similarity matrix for tpc) are published once;
+every worker then computes all strategies for its phenotype sets, so the
+phenotype sets are distributed and the pool is started only once. The
+best-match strategies share one analyzer and are scored in a single pass,
+one BMA aggregation each.
+"""
+
+import gc
+import multiprocessing as mp
+from typing import Any, Dict, List, Tuple
+
+from tqdm import tqdm
+
+from pheval_elder.prepare.core.multiprocessing.avg_multiprocessing import (
+    DEFAULT_QUERY_BATCH_SIZE,
+    query_collection_batched,
+)
+from pheval_elder.prepare.core.multiprocessing.best_match_multiprocessing import score_batch_of_sets
+from pheval_elder.prepare.core.multiprocessing.shared_data import SharedDataPlane, shared, shared_collection
+from pheval_elder.prepare.core.query.best_match_engine import BMAAggregation
+from pheval_elder.prepare.core.query.optimized_parallel_best_match import distribute_sets_evenly
+from pheval_elder.prepare.core.query.ranked_results import RankedResults
+
+# strategies answered by querying their disease collection
+COLLECTION_STRATEGIES = ("avg", "wgt_avg")
+# best-match strategies and the aggregation each of them ranks by
+BEST_MATCH_STRATEGIES = {
+    "tpc": BMAAggregation.BMA,
+    "tpc_sym": BMAAggregation.SYMMETRIC,
+    "tpc_max": BMAAggregation.MAX,
+    "tpc_wgt": BMAAggregation.WEIGHTED,
+}
+
+
+def strategy_collection_key(strategy: str) -> str:
+    """Name the disease collection of ``strategy`` is published under."""
+    return f"disease_collection.{strategy}"
+
+
+def process_multi_strategy_tasks(args) -> Dict[str, List[Tuple[Any, RankedResults]]]:
+    """Process a batch of phenotype sets for all strategies."""
+    batch, strategies, nr_of_results, query_batch_size = args
+    results = {}
+    best_match = None
+    for strategy in strategies:
+        if strategy in COLLECTION_STRATEGIES:
+            results[strategy] = query_collection_batched(
+                shared_collection(strategy_collection_key(strategy)),
+                shared("disease_table"),
+                batch,
+                nr_of_results,
+                query_batch_size,
+            )
+        else:
+            if best_match is None:
+                best_match = score_batch_of_sets((batch, nr_of_results))
+            results[strategy] = best_match[BEST_MATCH_STRATEGIES[strategy]]
+    return results
+
+
+def process_multi_strategy_parallel(
+        phenotype_sets: List[List[str]],
+        analyzers: Dict[str, Any],
+        nr_of_results: int,
+        query_batch_size: int = DEFAULT_QUERY_BATCH_SIZE
+) -> Dict[str, List[RankedResults]]:
+    """
+    Process phenotype sets in parallel for several strategies in one pass.
+
+    Args:
+        phenotype_sets: List of phenotype sets (lists of HPO IDs)
+        analyzers: Analyzer per strategy; the best-match strategies share one analyzer that has
+            precomputed its similarities and scores the aggregations of all of them
+        nr_of_results: Number of results to return
+        query_batch_size: Number of query embeddings per Chroma query call
+
+    Returns:
+        One RankedResults per phenotype set for every strategy
+    """
+    strategies = list(analyzers)
+    num_workers = min(mp.cpu_count(), len(phenotype_sets))
+    distributed_sets = distribute_sets_evenly(phenotype_sets, num_workers)
+    process_args = [
+        (worker_sets, strategies, nr_of_results, query_batch_size)
+        for worker_sets in distributed_sets
+        if worker_sets
+    ]
+
+    with SharedDataPlane() as plane:
+        published = set()
+        for strategy, analyzer in analyzers.items():
+            if strategy in COLLECTION_STRATEGIES:
+                analyzer.publish_parallel_processing_data(plane, strategy_collection_key(strategy))
+            elif id(analyzer) not in published:
+                analyzer.publish_parallel_processing_data(plane)
+                published.add(id(analyzer))
+        with plane.pool(num_workers) as pool:
+            batch_results = list(tqdm(
+                pool.imap(process_multi_strategy_tasks, process_args),
+                total=len(process_args),
+                desc=f"Processing phenotype sets in parallel for {', '.join(strategies)}"
+            ))
+            pool.close()
+            pool.join()
+
+    print(f"\n----------\nFinished processing {len(phenotype_sets)} phenotype sets for {len(strategies)} strategies\n----------\n")
+    gc.collect()
+
+    final_results = {
+        strategy: [RankedResults.empty() for _ in range(len(phenotype_sets))] for strategy in strategies
+    }
+    for worker_results in batch_results:
+        for strategy, results in worker_results.items():
+            for orig_idx, ranked in results:
+                final_results[strategy][orig_idx] = ranked
+    return final_results
@@ -0,0 +1,247 @@
+"""
+Shared-memory data plane for the multiprocessing engines.
+
+The parent process publishes the large read-only inputs of a parallel run
+(embedding matrices, similarity matrices, index arrays) once as ``.npy`` files
+in a RAM-backed directory (``/dev/shm`` where available). Workers attach to
+them through the pool initializer by memory-mapping the files, so all
+processes share the same physical pages instead of receiving a pickled copy
+with every task. Arrays that are already backed by a file, such as a
+persisted HPEmbeddingStore, are published by path without copying.
+
+Small Python objects (id lists, index maps) are handed to the initializer as
+well, so they are transferred once per worker rather than once per task.
+Chroma collections are published as (path or server, name) handles; every
+worker opens its own client in the initializer, so no SQLite handle is shared across
+processes and the pools work with any start method (fork, spawn, forkserver).
+"""
+
+import logging
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass
+from multiprocessing.pool import Pool
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+import chromadb
+import numpy as np
+from chromadb.types import Collection
+
+from pheval_elder.prepare.core.store.embedding_store import EmbeddingPrecision, HPEmbeddingStore
+
+logger = logging.getLogger(__name__)
+
+SHARED_DATA_DIR_ENV = "ELDER_SHARED_DATA_DIR"
+
+# Data attached in the current (worker) process, filled by attach_shared_data
+_attached: Dict[str, Any] = {}
+
+
+@dataclass(frozen=True)
+class SharedArrayHandle:
+    """
+    Picklable reference to a published array.
+
+    Attributes:
+        path: Path of the ``.npy`` file holding the array
+        shape: Shape of the array
+        dtype: Data type of the array
+    """
+    path: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+    def attach(self) -> np.ndarray:
+        """Memory-map the array read-only."""
+        array = np.asarray(np.load(self.path, mmap_mode="r"))
+        if array.shape != tuple(self.shape) or array.dtype != np.dtype(self.dtype):
+            raise ValueError(f"Shared array {self.path} does not match its handle")
+        return array
+
+
+@dataclass(frozen=True)
+class CollectionHandle:
+    """
+    Picklable reference to a Chroma collection.
+
+    Attributes:
+        path: Path of the persistent Chroma DB
+        name: Name of the collection
+        host: Host of a Chroma server serving the collection instead of ``path``
+        port: Port of the Chroma server
+    """
+    path: str
+    name: str
+    host: Optional[str] = None
+    port: int = 8000
+
+    def open(self) -> Collection:
+        """Open the collection with a client of the current process."""
+        if self.host:
+            return chromadb.HttpClient(host=self.host, port=self.port).get_collection(self.name)
+        return chromadb.PersistentClient(path=self.path).get_collection(self.name)
+
+
+def default_shared_data_dir() -> Optional[str]:
+    """Return the base directory for published arrays: $ELDER_SHARED_DATA_DIR, /dev/shm or the temp dir."""
+    directory = os.environ.get(SHARED_DATA_DIR_ENV)
+    if directory:
+        return directory
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return None
+
+
+class SharedDataPlane:
+    """
+    Publishes read-only arrays and objects once for all workers of a pool.
+
+    Use as a context manager; the published files are removed on exit.
+
+    Example:
+        with SharedDataPlane() as plane:
+            plane.publish("similarities", matrix)
+            with plane.pool(4) as pool:
+                pool.map(task, args)
+
+    Inside a task, ``shared("similarities")`` returns the memory-mapped array.
+    """
+
+    def __init__(self, directory: Optional[Union[str, Path]] = None):
+        base = str(directory) if directory is not None else default_shared_data_dir()
+        if base is not None:
+            Path(base).mkdir(parents=True, exist_ok=True)
+        self.directory = Path(tempfile.mkdtemp(prefix="elder_shared_", dir=base))
+        self.arrays: Dict[str, SharedArrayHandle] = {}
+        self.objects: Dict[str, Any] = {}
+
+    def __enter__(self) -> "SharedDataPlane":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def publish(
+            self,
+            name: str,
+            array: np.ndarray,
+            path: Optional[Union[str, Path]] = None
+    ) -> SharedArrayHandle:
+        """
+        Publish an array for the workers.
+
+        Args:
+            name: Name the workers look the array up by
+            array: Array to publish
+            path: Existing ``.npy`` file holding exactly ``array``; published without copying
+
+        Returns:
+            Handle of the published array
+        """
+        if path is not None and Path(path).exists():
+            handle = SharedArrayHandle(path=str(path), shape=tuple(array.shape), dtype=array.dtype.str)
+        else:
+            file_path = self.directory / f"{name}.npy"
+            with open(file_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            handle = SharedArrayHandle(path=str(file_path), shape=tuple(array.shape), dtype=array.dtype.str)
+            logger.debug(f"Published {name} {array.shape} ({array.nbytes / 1e6:.1f} MB) to {file_path}")
+        self.arrays[name] = handle
+        return handle
+
+    def publish_object(self, name: str, obj: Any) -> None:
+        """Publish a small picklable object, transferred once per worker."""
+        self.objects[name] = obj
+
+    def publish_collection(
+            self,
+            name: str,
+            path: Union[str, Path],
+            collection_name: str,
+            host: Optional[str] = None,
+            port: int = 8000
+    ) -> None:
+        """
+        Publish a Chroma collection; each worker opens its own client for it on start-up.
+
+        Args:
+            name: Name the workers look the collection up by
+            path: Path of the persistent Chroma DB
+            collection_name: Name of the collection in the DB
+            host: Host of a Chroma server serving the collection, if any
+            port: Port of the Chroma server
+        """
+        self.objects[name] = CollectionHandle(path=str(path), name=collection_name, host=host, port=port)
+
+    def publish_store(self, store: HPEmbeddingStore, name: str = "hp") -> None:
+        """
+        Publish an HPO embedding store.
+
+        A store loaded from (or saved to) disk is shared by its matrix file;
+        otherwise the matrix is copied into the data plane once. Publishing a
+        store under a name that is already published is a no-op.
+        """
+        if f"{name}.matrix" in self.arrays:
+            return
+        self.publish(f"{name}.matrix", store.matrix, path=store.path)
+        if store.scales is not None:
+            self.publish(f"{name}.scales", store.scales)
+        if store.norms is not None:
+            self.publish(f"{name}.norms", store.norms)
+        self.publish_object(f"{name}.ids", store.ids)
+        self.publish_object(f"{name}.labels", store.labels)
+        self.publish_object(f"{name}.precision", store.precision.value)
+
+    def initargs(self) -> Tuple[Dict[str, SharedArrayHandle], Dict[str, Any]]:
+        """Arguments for ``attach_shared_data`` as pool initializer."""
+        return self.arrays, self.objects
+
+    def pool(self, processes: int, context: Optional[Any] = None) -> Pool:
+        """Create a pool whose workers attach to this data plane on start-up."""
+        context = context or mp
+        return context.Pool(processes, initializer=attach_shared_data, initargs=self.initargs())
+
+    def close(self) -> None:
+        """Remove the published files (arrays published by path are left untouched)."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def attach_shared_data(arrays: Dict[str, SharedArrayHandle], objects: Dict[str, Any]) -> None:
+    """Pool initializer: memory-map all published arrays and open all published collections."""
+    _attached.clear()
+    for name, handle in arrays.items():
+        _attached[name] = handle.attach()
+    for name, obj in objects.items():
+        _attached[name] = obj.open() if isinstance(obj, CollectionHandle) else obj
+
+
+def shared(name: str) -> Any:
+    """Return a published array or object attached in the current process."""
+    try:
+        return _attached[name]
+    except KeyError:
+        raise KeyError(f"'{name}' is not attached; was the pool created by SharedDataPlane.pool?") from None
+
+
+def shared_collection(name: str) -> Collection:
+    """Return a collection published with ``SharedDataPlane.publish_collection``."""
+    return shared(name)
+
+
+def shared_store(name: str = "hp") -> HPEmbeddingStore:
+    """Return the HPO embedding store published with ``SharedDataPlane.publish_store``."""
+    store = _attached.get(f"{name}.store")
+    if store is None:
+        store = HPEmbeddingStore(
+            ids=shared(f"{name}.ids"),
+            labels=shared(f"{name}.labels"),
+            matrix=shared(f"{name}.matrix"),
+            precision=EmbeddingPrecision(shared(f"{name}.precision")),
+            scales=_attached.get(f"{name}.scales"),
+            norms=_attached.get(f"{name}.norms"),
+        )
+        _attached[f"{name}.store"] = store
+    return store
@@ -10,11 +10,16 @@ from typing import List, Tuple, Any
 import multiprocessing as mp
 
 import numpy as np
-from pheval.post_processing.post_processing import PhEvalDiseaseResult
 from tqdm import tqdm
 
-import pheval_elder.prepare.core.collections.globals as g
 from pheval_elder.prepare.core.data_processing.data_processor import DataProcessor
+from pheval_elder.prepare.core.multiprocessing.avg_multiprocessing import (
+    DEFAULT_QUERY_BATCH_SIZE,
+    query_collection_batched,
+    ranked_results_from_query,
+)
+from pheval_elder.prepare.core.multiprocessing.shared_data import SharedDataPlane, shared, shared_collection
+from pheval_elder.prepare.core.query.ranked_results import RankedResults
 from pheval_elder.prepare.core.query.optimized_parallel_best_match import distribute_sets_evenly
 
 
@@ -24,11 +29,21 @@ class OptimizedWeightedAverageDiseaseEmbedAnalysis:
     def __init__(self, data_processor: DataProcessor):
         """Initialize the analyzer with a data processor."""
         self.data_processor = data_processor
+        self.hp_embedding_store = data_processor.hp_embedding_store
         self.hp_embeddings = data_processor.hp_embeddings
-        
-    def get_parallel_processing_data(self):
-        """Return the data needed for parallel processing."""
-        return self.hp_embeddings
+
+    def publish_parallel_processing_data(self, plane: SharedDataPlane, collection_key: str = "disease_collection"):
+        """Publish the data needed for parallel processing; the workers find the collection under ``collection_key``."""
+        plane.publish_store(self.hp_embedding_store)
+        plane.publish_object("disease_table", self.data_processor.disease_table)
+        db_manager = self.data_processor.db_manager
+        plane.publish_collection(
+            collection_key,
+            db_manager.path,
+            db_manager.disease_embeddings_collection("wgt_avg").name,
+            host=db_manager.host,
+            port=db_manager.port,
+        )
 
 
 def calculate_average_embedding(query, embedding_map):
@@ -43,25 +58,6 @@ def calculate_average_embedding(query, embedding_map):
         return None
 
 
-def sort_and_create_pheval_disease_results(query) -> List[PhEvalDiseaseResult]:
-    """Create PhEvalDiseaseResult objects from query results."""
-    disease_ids = query['ids'][0] if 'ids' in query and query['ids'] else []
-    distances = query['distances'][0] if 'distances' in query and query['distances'] else []
-    disease_names = (
-        [metadata['disease_name'] for metadata in query['metadatas'][0]]
-        if 'metadatas' in query and query['metadatas']
-        else []
-    )
-    sorted_results = sorted(zip(disease_ids, disease_names, distances), key=lambda x: x[2])
-    return [
-        PhEvalDiseaseResult(
-            disease_identifier=a,
-            disease_name=b,
-            score=c
-        ) for a, b, c in sorted_results
-    ]
-
-
 def query_disease_weighted_avg_collection(pheno_set, hp_embeddings, n_results):
     """Query the disease weighted average collection for a phenotype set."""
     avg_embedding = calculate_average_embedding(pheno_set, hp_embeddings)
@@ -70,34 +66,28 @@ def query_disease_weighted_avg_collection(pheno_set, hp_embeddings, n_results):
 
     query_params = {
         "query_embeddings": [avg_embedding.tolist()],
-        "include": ["metadatas", "embeddings", "distances"],
+        "include": ["distances"],
         "n_results": n_results
     }
 
-    query_results = g.global_wgt_avg_disease_embd_collection.query(**query_params)
-    return sort_and_create_pheval_disease_results(query=query_results)
+    query_results = shared_collection("disease_collection").query(**query_params)
+    return ranked_results_from_query(query_results, shared("disease_table"))
 
 
-def process_wgt_tasks(args) -> List[Tuple[Any, List[PhEvalDiseaseResult]]]:
+def process_wgt_tasks(args) -> List[Tuple[Any, RankedResults]]:
     """Process a batch of phenotype sets for weighted average embedding analysis."""
-    batch, nr_of_results, processing_data = args
-    hp_embeddings = processing_data
-    results = []
-    for orig_idx, phenotype_set in batch:
-        result = query_disease_weighted_avg_collection(
-            pheno_set=phenotype_set,
-            hp_embeddings=hp_embeddings,
-            n_results=nr_of_results,
-        )
-        results.append((orig_idx, result))
-    return results
+    batch, nr_of_results, query_batch_size = args
+    return query_collection_batched(
+        shared_collection("disease_collection"), shared("disease_table"), batch, nr_of_results, query_batch_size
+    )
 
 
 def process_wgt_avg_analysis_parallel(
         phenotype_sets: List[List[str]],
         owadea_analyzer,
-        nr_of_results: int
-) -> List[List[PhEvalDiseaseResult]]:
+        nr_of_results: int,
+        query_batch_size: int = DEFAULT_QUERY_BATCH_SIZE
+) -> List[RankedResults]:
     """
     Process phenotype sets in parallel for weighted average embedding analysis.
     
@@ -105,36 +95,37 @@ def process_wgt_avg_analysis_parallel(
         phenotype_sets: List of phenotype sets (lists of HPO IDs)
         owadea_analyzer: Analyzer for weighted average disease embedding analysis
         nr_of_results: Number of results to return
+        query_batch_size: Number of query embeddings per Chroma query call
         
     Returns:
-        List of lists of PhEvalDiseaseResult objects, one list per phenotype set
+        One RankedResults per phenotype set
     """
-    processing_data = owadea_analyzer.get_parallel_processing_data()
-
     num_cores = mp.cpu_count()
     num_workers = min(num_cores, len(phenotype_sets))
     
     distributed_sets = distribute_sets_evenly(phenotype_sets, num_workers)
 
     process_args = [
-            (worker_sets, nr_of_results, processing_data)
+            (worker_sets, nr_of_results, query_batch_size)
             for worker_sets in distributed_sets
             if worker_sets
         ]
 
-    with mp.Pool(num_cores) as pool:
-        batch_results = list(tqdm(
-            pool.imap(process_wgt_tasks, process_args),
-            total=len(process_args),
-            desc="Processing phenotype sets in parallel for wgt avg analysis"
-        ))
-        pool.close()
-        pool.join()
+    with SharedDataPlane() as plane:
+        owadea_analyzer.publish_parallel_processing_data(plane)
+        with plane.pool(num_workers) as pool:
+            batch_results = list(tqdm(
+                pool.imap(process_wgt_tasks, process_args),
+                total=len(process_args),
+                desc="Processing phenotype sets in parallel for wgt avg analysis"
+            ))
+            pool.close()
+            pool.join()
 
     print(f"\n----------\nFinished processing {len(phenotype_sets)} phenotype sets in parallel\n----------\n")
     gc.collect()
     
-    final_results = [[] for _ in range(len(phenotype_sets))]
+    final_results = [RankedResults.empty() for _ in range(len(phenotype_sets))]
     for worker_results in batch_results:
         for orig_idx, result_list in worker_results:
             final_results[orig_idx] = result_list
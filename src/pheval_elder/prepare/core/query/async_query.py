@@ -0,0 +1,112 @@
+"""
+Asynchronous disease queries against a Chroma server.
+
+When several evaluation jobs share one embedding DB, a Chroma server loads the
+HNSW indexes once and every job talks to it over HTTP instead of opening its
+own PersistentClient. AsyncQueryExecutor sends the query embeddings of all
+phenotype sets in batches over one pooled HTTP client, keeping at most
+``max_in_flight`` requests running at a time; the results keep the order of
+the phenotype sets.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence
+
+import chromadb
+import numpy as np
+
+from pheval_elder.prepare.core.query.exact_search import average_query_embeddings
+from pheval_elder.prepare.core.query.ranked_results import DiseaseTable, RankedResults
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_IN_FLIGHT = 8
+DEFAULT_QUERY_BATCH_SIZE = 100
+
+
+@dataclass
+class AsyncQueryExecutor:
+    """
+    Bounded-concurrency query executor for a collection served by a Chroma server.
+
+    Attributes:
+        host: Host of the Chroma server
+        port: Port of the Chroma server
+        collection_name: Name of the disease collection
+        max_in_flight: Maximum number of concurrent ``query`` requests
+        query_batch_size: Number of query embeddings per request
+    """
+    host: str
+    port: int
+    collection_name: str
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT
+    query_batch_size: int = DEFAULT_QUERY_BATCH_SIZE
+
+    async def query_async(self, queries: np.ndarray, n_results: int) -> List[Dict[str, Any]]:
+        """
+        Query the collection for all query embeddings.
+
+        Args:
+            queries: (n_queries x D) query embeddings
+            n_results: Number of diseases per query
+
+        Returns:
+            One Chroma query result (ids and distances) per batch of ``query_batch_size`` queries, in order
+        """
+        client = await chromadb.AsyncHttpClient(host=self.host, port=self.port)
+        collection = await client.get_collection(self.collection_name)
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async def query_batch(start: int) -> Dict[str, Any]:
+            async with semaphore:
+                return await collection.query(
+                    query_embeddings=queries[start:start + self.query_batch_size].tolist(),
+                    n_results=n_results,
+                    include=["distances"],
+                )
+
+        # gather returns the results in the order of the batches, whatever order they complete in
+        return await asyncio.gather(*(
+            query_batch(start) for start in range(0, len(queries), self.query_batch_size)
+        ))
+
+    def query(self, queries: np.ndarray, n_results: int) -> List[Dict[str, Any]]:
+        """Blocking wrapper of ``query_async``."""
+        return asyncio.run(self.query_async(queries, n_results))
+
+
+def async_query_analysis(
+        executor: AsyncQueryExecutor,
+        store: HPEmbeddingStore,
+        phenotype_sets: Sequence[List[str]],
+        nr_of_results: int,
+        table: DiseaseTable
+) -> List[RankedResults]:
+    """
+    Rank the diseases for all phenotype sets with queries to a Chroma server.
+
+    Args:
+        executor: Query executor of the disease collection
+        store: HPO embedding store the phenotype sets are averaged from
+        phenotype_sets: Phenotype sets of the phenopackets
+        nr_of_results: Number of diseases per phenotype set
+        table: Disease table the results point into
+
+    Returns:
+        One RankedResults per phenotype set, empty for sets without any embedded phenotype
+    """
+    positions, queries = average_query_embeddings(store, phenotype_sets)
+    results = [RankedResults.empty() for _ in range(len(phenotype_sets))]
+    if len(positions) == 0:
+        return results
+    batch_results = executor.query(queries, nr_of_results)
+    ids = [row for batch in batch_results for row in batch["ids"]]
+    distances = [row for batch in batch_results for row in batch["distances"]]
+    for position, disease_ids, disease_distances in zip(positions, ids, distances):
+        results[position] = RankedResults.from_ids(table, disease_ids, disease_distances)
+    if len(positions) < len(phenotype_sets):
+        logger.warning(f"{len(phenotype_sets) - len(positions)} phenotype sets have no embedded phenotypes")
+    return results
@@ -6,6 +6,8 @@ import numpy as np
 from pheval.post_processing.post_processing import PhEvalDiseaseResult
 from pydantic import BaseModel
 
+from pheval_elder.prepare.core.utils.similarity_service import NormalizedCosineSimilarity
+
 
 BEST_MATCH_SCORES = Dict[str, Dict[str, Dict[str, float]]]
 
@@ -23,19 +25,13 @@ class BestMatchScore(BaseModel):
 class TermSetPairWiseComparisonQuery:
     def __init__(self, data_processor):
         self.data_processor = data_processor
-        self.similarity_strategy = None
+        # store rows are L2-normalised, so the cosine is a plain dot product
+        self.similarity_strategy = NormalizedCosineSimilarity()
+        self.hp_embedding_store = self.data_processor.hp_embedding_store
         self.hp_embeddings = self.data_processor.hp_embeddings
         self.disease_to_hps_from_omim = self.data_processor.disease_to_hps
         self._cosine_cache = defaultdict()
 
-    @staticmethod
-    def cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
-        if not isinstance(vec1, np.ndarray):
-            vec1 = np.array(vec1)
-        if not isinstance(vec2, np.ndarray):
-            vec2 = np.array(vec2)
-        return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
-
     def cached_cosine_similarity(self, input_hp: str, disease_hp: str) -> float:
         key = (input_hp, disease_hp)
         if key in self._cosine_cache:
@@ -46,9 +42,10 @@ class TermSetPairWiseComparisonQuery:
         if disease_hp not in self.hp_embeddings:
             raise ValueError(f"Embedding for disease phenotype {disease_hp} not found in hp_embeddings.")
 
-        inp_embedding = self.hp_embeddings[input_hp]['embeddings']
-        disease_embedding = self.hp_embeddings[disease_hp]['embeddings']
-        similarity = self.cosine_similarity(inp_embedding, disease_embedding)
+        store = self.hp_embedding_store
+        similarity = self.similarity_strategy.calculate_similarity(
+            store.unit(store.index[input_hp]), store.unit(store.index[disease_hp])
+        )
         self._cosine_cache[key] = similarity
         return similarity
 
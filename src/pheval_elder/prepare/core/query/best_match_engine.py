@@ -0,0 +1,369 @@
+"""
+Vectorised best-match average (BMA) scoring.
+
+The BMA score of a disease for a phenotype set is the mean, over the terms of
+the set, of the best similarity of the term to any phenotype of the disease.
+BestMatchEngine keeps the similarity-matrix columns of all disease phenotypes
+in disease-grouped CSR order (``columns`` plus ``offsets``): gathering a block
+of similarity rows in that order and applying ``np.maximum.reduceat`` at the
+disease offsets yields the best match of every term to every disease at once.
+The per-set means are a second segmented reduction over the terms, so many
+phenotype sets are scored per call without any per-disease Python.
+
+Besides this one-directional BMA, the engine derives further aggregations
+(BMAAggregation) from the same gathered similarities: max-of-max is another
+reduction of the term maxima, HPOA-frequency-weighted BMA reduces the block
+scaled by per-entry weights, and symmetric BMA adds the mean best match of
+every disease phenotype to the set. Several aggregations are scored in one
+call and yield one ranking each.
+
+Instead of one (input terms x disease phenotypes) similarity matrix for the
+whole cohort, ``similarity_tiles`` computes float32 tiles for consecutive
+blocks of phenotype sets whose distinct terms fit a memory budget; each tile
+is scored and dropped before the next one is computed.
+"""
+
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore
+
+# bounds the (terms x disease phenotype entries) block gathered per reduction
+DEFAULT_MAX_BLOCK_BYTES = 64 * 1024 * 1024
+# phenotype sets scored per segmented reduction
+DEFAULT_SET_CHUNK_SIZE = 64
+
+
+class BMAAggregation(str, Enum):
+    """Aggregations of the best matches between a phenotype set and a disease."""
+    # mean over the terms of the set of their best match to the disease
+    BMA = "bma"
+    # mean of BMA and the mean over the disease phenotypes of their best match to the set
+    SYMMETRIC = "symmetric"
+    # best match of any term of the set
+    MAX = "max"
+    # BMA with every similarity scaled by the HPOA frequency of the disease phenotype
+    WEIGHTED = "weighted"
+
+
+@dataclass
+class BestMatchEngine:
+    """
+    Disease-grouped CSR layout of the disease phenotype columns of a similarity matrix.
+
+    Attributes:
+        columns: Similarity-matrix column of every (disease, phenotype) entry, grouped by disease
+        offsets: (n_diseases + 1) offsets of the diseases into ``columns``
+        max_block_bytes: Maximum size of the gathered block per reduction
+        set_chunk_size: Number of phenotype sets scored per segmented reduction
+        weights: Weight of every (disease, phenotype) entry, needed for the weighted aggregation
+    """
+    columns: np.ndarray
+    offsets: np.ndarray
+    max_block_bytes: int = DEFAULT_MAX_BLOCK_BYTES
+    set_chunk_size: int = DEFAULT_SET_CHUNK_SIZE
+    weights: Optional[np.ndarray] = None
+
+    def __post_init__(self):
+        self.columns = np.asarray(self.columns, dtype=np.int64)
+        self.offsets = np.asarray(self.offsets, dtype=np.int64)
+        if self.weights is not None:
+            self.weights = np.asarray(self.weights, dtype=np.float32)
+        # reduceat needs non-empty segments; diseases without phenotypes keep -inf
+        self._nonempty = np.flatnonzero(np.diff(self.offsets) > 0)
+        self._starts = self.offsets[:-1][self._nonempty]
+
+    @property
+    def n_diseases(self) -> int:
+        return len(self.offsets) - 1
+
+    @classmethod
+    def from_disease_indices(
+            cls,
+            disease_indices: Sequence[np.ndarray],
+            disease_weights: Optional[Sequence[np.ndarray]] = None,
+            **kwargs
+    ) -> "BestMatchEngine":
+        """
+        Create the engine from the similarity-matrix columns of every disease's phenotypes.
+
+        Args:
+            disease_indices: Similarity-matrix columns of the phenotypes of every disease
+            disease_weights: Weights aligned with ``disease_indices`` (for the weighted aggregation)
+            **kwargs: Further engine attributes
+        """
+        lengths = [len(indices) for indices in disease_indices]
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        columns = np.concatenate(disease_indices) if lengths and offsets[-1] else np.zeros(0, dtype=np.int64)
+        if disease_weights is not None:
+            kwargs["weights"] = (
+                np.concatenate(disease_weights) if lengths and offsets[-1] else np.zeros(0, dtype=np.float32)
+            )
+        return cls(columns=columns, offsets=offsets, **kwargs)
+
+    def term_maxima(self, similarities: np.ndarray, weighted: bool = False) -> np.ndarray:
+        """
+        Best match of every term to each disease.
+
+        Args:
+            similarities: (n_terms x n_columns) similarities of the terms to the disease phenotypes
+            weighted: Scale the similarities by the entry weights before taking the maxima
+
+        Returns:
+            (n_terms x n_diseases) float32 maxima, -inf for diseases without phenotypes
+        """
+        maxima, weighted_maxima = self._term_maxima(similarities, plain=not weighted, weighted=weighted)
+        return weighted_maxima if weighted else maxima
+
+    def _term_maxima(
+            self,
+            similarities: np.ndarray,
+            plain: bool = True,
+            weighted: bool = False
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """Plain and / or weighted term maxima, reduced from one gathered block per row block."""
+        shape = (len(similarities), self.n_diseases)
+        maxima = np.full(shape, -np.inf, dtype=np.float32) if plain else None
+        weighted_maxima = np.full(shape, -np.inf, dtype=np.float32) if weighted else None
+        if len(similarities) == 0 or len(self._nonempty) == 0:
+            return maxima, weighted_maxima
+        rows_per_block = max(1, self.max_block_bytes // max(len(self.columns) * similarities.itemsize, 1))
+        for start in range(0, len(similarities), rows_per_block):
+            block = np.take(similarities[start:start + rows_per_block], self.columns, axis=1)
+            if plain:
+                maxima[start:start + rows_per_block, self._nonempty] = np.maximum.reduceat(
+                    block, self._starts, axis=1
+                )
+            if weighted:
+                block *= self.weights
+                weighted_maxima[start:start + rows_per_block, self._nonempty] = np.maximum.reduceat(
+                    block, self._starts, axis=1
+                )
+        return maxima, weighted_maxima
+
+    def phenotype_means(self, similarities: np.ndarray, term_sets: Sequence[np.ndarray]) -> np.ndarray:
+        """
+        Mean over the phenotypes of every disease of their best match to the terms of each set.
+
+        Args:
+            similarities: (n_terms x n_columns) similarity matrix the term rows point into
+            term_sets: Similarity-matrix rows of the terms of every set
+
+        Returns:
+            (n_sets x n_diseases) float32 means, -inf for empty sets and diseases without phenotypes
+        """
+        means = np.full((len(term_sets), self.n_diseases), -np.inf, dtype=np.float32)
+        if len(self._nonempty) == 0:
+            return means
+        lengths = np.diff(self.offsets)[self._nonempty]
+        rows_per_block = max(1, self.max_block_bytes // max(len(self.columns) * similarities.itemsize, 1))
+        for position, terms in enumerate(term_sets):
+            if len(terms) == 0:
+                continue
+            best = np.full(len(self.columns), -np.inf, dtype=np.float32)
+            for start in range(0, len(terms), rows_per_block):
+                block = np.take(similarities[terms[start:start + rows_per_block]], self.columns, axis=1)
+                np.maximum(best, block.max(axis=0), out=best)
+            means[position, self._nonempty] = np.add.reduceat(best, self._starts) / lengths
+        return means
+
+    def score_aggregations(
+            self,
+            similarities: np.ndarray,
+            term_sets: Sequence[np.ndarray],
+            aggregations: Sequence[BMAAggregation]
+    ) -> Dict[BMAAggregation, np.ndarray]:
+        """
+        Scores of phenotype sets against all diseases for several aggregations at once.
+
+        Every block of similarities is gathered once; the term maxima (plain and
+        weighted) are reduced from it and shared by all aggregations built on them.
+
+        Args:
+            similarities: (n_terms x n_columns) similarity matrix the term rows point into
+            term_sets: Similarity-matrix rows of the terms of every set (duplicates counted)
+            aggregations: Aggregations to score
+
+        Returns:
+            (n_sets x n_diseases) float32 scores per aggregation, -inf for empty sets and
+            diseases without phenotypes
+
+        Raises:
+            ValueError: If the weighted aggregation is requested from an engine without weights
+        """
+        aggregations = [BMAAggregation(aggregation) for aggregation in aggregations]
+        if BMAAggregation.WEIGHTED in aggregations and self.weights is None:
+            raise ValueError("The weighted aggregation needs an engine with disease phenotype weights")
+        scores = {
+            aggregation: np.full((len(term_sets), self.n_diseases), -np.inf, dtype=np.float32)
+            for aggregation in aggregations
+        }
+        lengths = np.fromiter((len(terms) for terms in term_sets), dtype=np.int64, count=len(term_sets))
+        filled = np.flatnonzero(lengths)
+        if len(filled) == 0:
+            return scores
+        all_terms = np.concatenate([np.asarray(term_sets[i], dtype=np.int64) for i in filled])
+        # terms shared by several sets are reduced only once
+        unique_terms, inverse = np.unique(all_terms, return_inverse=True)
+        rows = similarities[unique_terms]
+        set_starts = np.zeros(len(filled), dtype=np.int64)
+        np.cumsum(lengths[filled][:-1], out=set_starts[1:])
+        counts = lengths[filled][:, None]
+
+        bma = None
+        maxima, weighted_maxima = self._term_maxima(
+            rows,
+            plain=bool({BMAAggregation.BMA, BMAAggregation.SYMMETRIC, BMAAggregation.MAX} & set(aggregations)),
+            weighted=BMAAggregation.WEIGHTED in aggregations,
+        )
+        if maxima is not None:
+            maxima = maxima[inverse]
+            bma = np.add.reduceat(maxima, set_starts, axis=0) / counts
+        for aggregation in aggregations:
+            if aggregation == BMAAggregation.BMA:
+                scores[aggregation][filled] = bma
+            elif aggregation == BMAAggregation.MAX:
+                scores[aggregation][filled] = np.maximum.reduceat(maxima, set_starts, axis=0)
+            elif aggregation == BMAAggregation.SYMMETRIC:
+                term_rows = np.split(inverse, set_starts[1:])
+                scores[aggregation][filled] = (bma + self.phenotype_means(rows, term_rows)) / 2
+            else:
+                scores[aggregation][filled] = np.add.reduceat(weighted_maxima[inverse], set_starts, axis=0) / counts
+        return scores
+
+    def score_sets(self, similarities: np.ndarray, term_sets: Sequence[np.ndarray]) -> np.ndarray:
+        """
+        BMA scores of phenotype sets against all diseases.
+
+        Args:
+            similarities: (n_terms x n_columns) similarity matrix the term rows point into
+            term_sets: Similarity-matrix rows of the terms of every set (duplicates counted)
+
+        Returns:
+            (n_sets x n_diseases) float32 scores, -inf for empty sets and diseases without phenotypes
+        """
+        return self.score_aggregations(similarities, term_sets, [BMAAggregation.BMA])[BMAAggregation.BMA]
+
+    def top_k(
+            self,
+            similarities: np.ndarray,
+            term_sets: Sequence[np.ndarray],
+            k: int
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Best ``k`` diseases of every phenotype set by BMA, highest score first.
+
+        Args:
+            similarities: (n_terms x n_columns) similarity matrix the term rows point into
+            term_sets: Similarity-matrix rows of the terms of every set
+            k: Number of diseases per set
+
+        Returns:
+            One (disease indices, scores) pair per set; diseases without phenotypes are left out
+        """
+        return self.top_k_aggregations(similarities, term_sets, k, [BMAAggregation.BMA])[BMAAggregation.BMA]
+
+    def top_k_aggregations(
+            self,
+            similarities: np.ndarray,
+            term_sets: Sequence[np.ndarray],
+            k: int,
+            aggregations: Sequence[BMAAggregation]
+    ) -> Dict[BMAAggregation, List[Tuple[np.ndarray, np.ndarray]]]:
+        """
+        Best ``k`` diseases of every phenotype set for each aggregation, highest score first.
+
+        Args:
+            similarities: (n_terms x n_columns) similarity matrix the term rows point into
+            term_sets: Similarity-matrix rows of the terms of every set
+            k: Number of diseases per set
+            aggregations: Aggregations to rank by
+
+        Returns:
+            Per aggregation, one (disease indices, scores) pair per set; diseases without
+            phenotypes are left out
+        """
+        results = {BMAAggregation(aggregation): [] for aggregation in aggregations}
+        k = min(k, self.n_diseases)
+        for start in range(0, len(term_sets), self.set_chunk_size):
+            chunk_scores = self.score_aggregations(
+                similarities, term_sets[start:start + self.set_chunk_size], aggregations
+            )
+            for aggregation, scores in chunk_scores.items():
+                results[aggregation].extend(self._top_k_rows(scores, k))
+        return results
+
+    def _top_k_rows(self, scores: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Best ``k`` columns of every row of ``scores`` with their finite scores, highest first."""
+        if 0 < k < self.n_diseases:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(k), (len(scores), k))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        results = []
+        for indices, row_scores in zip(top, top_scores):
+            finite = np.isfinite(row_scores)
+            results.append((indices[finite], row_scores[finite]))
+        return results
+
+
+def tile_capacity(memory_budget_bytes: int, n_columns: int, n_diseases: int) -> int:
+    """
+    Number of distinct input terms per similarity tile within ``memory_budget_bytes``.
+
+    A quarter of the budget is left to the gathered block of the engine; per
+    term the rest holds a tile row plus the engine's maxima and per-set rows.
+    """
+    bytes_per_term = 4 * (n_columns + 2 * n_diseases)
+    return max(1, (memory_budget_bytes - memory_budget_bytes // 4) // max(bytes_per_term, 1))
+
+
+def similarity_tiles(
+        store: HPEmbeddingStore,
+        disease_unit_vectors: np.ndarray,
+        phenotype_sets: Sequence[List[str]],
+        terms_per_tile: int
+) -> Iterator[Tuple[List[int], List[np.ndarray], np.ndarray]]:
+    """
+    Compute the similarities of consecutive blocks of phenotype sets, one tile per block.
+
+    A block is closed once its distinct embedded terms would exceed
+    ``terms_per_tile``; a single larger set forms a block of its own.
+
+    Args:
+        store: HPO embedding store the input terms are looked up in
+        disease_unit_vectors: (n_columns x D) L2-normalised disease phenotype embeddings
+        phenotype_sets: Phenotype sets to score
+        terms_per_tile: Maximum number of distinct terms per tile
+
+    Yields:
+        (positions of the sets in ``phenotype_sets``, tile rows of the terms of every set,
+        float32 (tile terms x n_columns) cosine similarities)
+    """
+    positions: List[int] = []
+    term_sets: List[np.ndarray] = []
+    tile_terms = {}
+
+    def tile():
+        units = store.unit_vectors(list(tile_terms))
+        return positions, term_sets, np.asarray(units @ disease_unit_vectors.T, dtype=np.float32)
+
+    for position, phenotype_set in enumerate(phenotype_sets):
+        terms = [hp for hp in phenotype_set if hp in store]
+        new_terms = {hp for hp in terms if hp not in tile_terms}
+        if positions and len(tile_terms) + len(new_terms) > terms_per_tile:
+            yield tile()
+            positions, term_sets, tile_terms = [], [], {}
+        for hp in terms:
+            tile_terms.setdefault(hp, len(tile_terms))
+        positions.append(position)
+        term_sets.append(np.array([tile_terms[hp] for hp in terms], dtype=np.int64))
+    if positions:
+        yield tile()
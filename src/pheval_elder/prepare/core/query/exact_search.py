@@ -0,0 +1,222 @@
+"""
+Exact in-process disease search for the average and weighted average strategies.
+
+With about 12k diseases, ranking the diseases for a phenotype set is a single
+(1 x D) . (D x n_diseases) product. ExactDiseaseSearch keeps the disease
+embedding matrix in memory, averages a whole batch of phenotype sets with one
+sparse-dense product and scores the batch against all diseases with one GEMM,
+selecting the top-k with ``argpartition``. The ranks are exact, unlike the
+approximate HNSW search, and the distances match the ones Chroma reports for
+the same similarity measure, so results are interchangeable with the Chroma
+backend.
+"""
+
+import logging
+from dataclasses import dataclass
+from enum import Enum
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from chromadb.types import Collection
+
+from pheval_elder.prepare.core.collections.disease_embedding_builder import (
+    DiseaseEmbeddingBuilder,
+    DiseaseEmbeddings,
+)
+from pheval_elder.prepare.core.query.ranked_results import DiseaseTable, RankedResults
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore, l2_normalize
+from pheval_elder.prepare.core.utils.similarity_measures import SimilarityMeasures
+
+logger = logging.getLogger(__name__)
+
+# Phenotype sets scored per GEMM, bounds the (sets x diseases) score matrix
+DEFAULT_QUERY_CHUNK_SIZE = 1024
+COLLECTION_PAGE_SIZE = 1000
+
+
+class SearchBackend(str, Enum):
+    """Backends answering avg / wgt_avg disease queries."""
+    CHROMA = "chroma"
+    EXACT = "exact"
+
+
+@dataclass
+class ExactDiseaseSearch:
+    """
+    Brute-force top-k search over a disease embedding matrix.
+
+    Attributes:
+        disease_ids: Disease ids, one per matrix row
+        disease_names: Disease names, one per matrix row
+        matrix: (n_diseases x D) float32 disease embeddings
+        similarity: Similarity measure; distances follow Chroma (1 - cos, 1 - ip, squared l2)
+    """
+    disease_ids: np.ndarray
+    disease_names: np.ndarray
+    matrix: np.ndarray
+    similarity: SimilarityMeasures = SimilarityMeasures.COSINE
+
+    def __post_init__(self):
+        self.similarity = SimilarityMeasures(self.similarity)
+        self.matrix = np.ascontiguousarray(self.matrix, dtype=np.float32)
+        if self.similarity == SimilarityMeasures.COSINE:
+            # cosine only needs unit rows, so the norms are dropped once here
+            self.matrix, _ = l2_normalize(self.matrix)
+        self._squared_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+
+    def __len__(self) -> int:
+        return len(self.disease_ids)
+
+    @classmethod
+    def from_disease_embeddings(
+            cls,
+            disease_embeddings: DiseaseEmbeddings,
+            similarity: SimilarityMeasures = SimilarityMeasures.COSINE
+    ) -> "ExactDiseaseSearch":
+        """Create the search from disease embeddings built with DiseaseEmbeddingBuilder."""
+        return cls(
+            disease_ids=disease_embeddings.disease_ids,
+            disease_names=disease_embeddings.disease_names,
+            matrix=disease_embeddings.matrix,
+            similarity=similarity,
+        )
+
+    @classmethod
+    def from_collection(
+            cls,
+            collection: Collection,
+            similarity: SimilarityMeasures = SimilarityMeasures.COSINE,
+            page_size: int = COLLECTION_PAGE_SIZE
+    ) -> "ExactDiseaseSearch":
+        """
+        Load all disease embeddings of a disease collection.
+
+        Args:
+            collection: Disease embedding collection (ids, embeddings and ``disease_name`` metadata)
+            similarity: Similarity measure of the collection
+            page_size: Number of rows read per request
+
+        Returns:
+            ExactDiseaseSearch over the collection content
+        """
+        count = collection.count()
+        ids, names, blocks = [], [], []
+        for offset in range(0, count, page_size):
+            page = collection.get(include=["metadatas", "embeddings"], limit=page_size, offset=offset)
+            ids.extend(page["ids"])
+            names.extend((metadata or {}).get("disease_name") for metadata in page["metadatas"])
+            blocks.append(np.asarray(page["embeddings"], dtype=np.float32))
+        matrix = np.vstack(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+        return cls(
+            disease_ids=np.asarray(ids, dtype=object),
+            disease_names=np.asarray(names, dtype=object),
+            matrix=matrix,
+            similarity=similarity,
+        )
+
+    def distances(self, queries: np.ndarray) -> np.ndarray:
+        """
+        Return the (n_queries x n_diseases) distance matrix, lower is closer.
+
+        Args:
+            queries: (n_queries x D) query embeddings
+
+        Returns:
+            float32 distances as Chroma computes them for the similarity measure
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        if self.similarity == SimilarityMeasures.COSINE:
+            queries, _ = l2_normalize(queries)
+            return 1.0 - queries @ self.matrix.T
+        inner = queries @ self.matrix.T
+        if self.similarity == SimilarityMeasures.IP:
+            return 1.0 - inner
+        query_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+        return np.maximum(query_norms + self._squared_norms[None, :] - 2 * inner, 0)
+
+    def search(
+            self,
+            queries: np.ndarray,
+            k: int,
+            chunk_size: int = DEFAULT_QUERY_CHUNK_SIZE
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the ``k`` closest diseases of every query.
+
+        Args:
+            queries: (n_queries x D) query embeddings
+            k: Number of diseases per query (all diseases if larger)
+            chunk_size: Number of queries scored per GEMM
+
+        Returns:
+            Tuple of (row indices, distances), both (n_queries x k) and sorted by ascending distance
+        """
+        k = min(k, len(self))
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        distances = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), chunk_size):
+            chunk_distances = self.distances(queries[start:start + chunk_size])
+            if k < len(self):
+                top = np.argpartition(chunk_distances, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(len(self)), chunk_distances.shape)
+            top_distances = np.take_along_axis(chunk_distances, top, axis=1)
+            order = np.argsort(top_distances, axis=1, kind="stable")
+            indices[start:start + len(top)] = np.take_along_axis(top, order, axis=1)
+            distances[start:start + len(top)] = np.take_along_axis(top_distances, order, axis=1)
+        return indices, distances
+
+
+def average_query_embeddings(
+        store: HPEmbeddingStore,
+        phenotype_sets: Sequence[List[str]]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Average the HPO embeddings of every phenotype set with one sparse-dense product.
+
+    Args:
+        store: HPO embedding store
+        phenotype_sets: Phenotype sets (lists of HPO ids, duplicates counted)
+
+    Returns:
+        Tuple of (positions of the sets with at least one embedded phenotype, (n x D) averaged embeddings)
+    """
+    averaged = DiseaseEmbeddingBuilder(store).average({
+        position: {"disease_name": None, "phenotypes": phenotype_set}
+        for position, phenotype_set in enumerate(phenotype_sets)
+    })
+    return np.asarray(averaged.disease_ids, dtype=np.int64), averaged.matrix
+
+
+def exact_search_analysis(
+        search: ExactDiseaseSearch,
+        store: HPEmbeddingStore,
+        phenotype_sets: Sequence[List[str]],
+        nr_of_results: int,
+        table: DiseaseTable,
+        chunk_size: int = DEFAULT_QUERY_CHUNK_SIZE
+) -> List[RankedResults]:
+    """
+    Rank the diseases for all phenotype sets with the exact search.
+
+    Args:
+        search: Exact search over the disease embeddings
+        store: HPO embedding store the phenotype sets are averaged from
+        phenotype_sets: Phenotype sets of the phenopackets
+        nr_of_results: Number of diseases per phenotype set
+        table: Disease table the results point into
+        chunk_size: Number of phenotype sets scored per GEMM
+
+    Returns:
+        One RankedResults per phenotype set, empty for sets without any embedded phenotype
+    """
+    positions, queries = average_query_embeddings(store, phenotype_sets)
+    indices, distances = search.search(queries, nr_of_results, chunk_size)
+    # search rows -> table rows, resolved once for all phenotype sets
+    table_rows = table.rows(search.disease_ids)
+    results = [RankedResults.empty() for _ in range(len(phenotype_sets))]
+    for position, row_indices, row_distances in zip(positions, indices, distances):
+        results[position] = RankedResults(rows=table_rows[row_indices], scores=row_distances)
+    if len(positions) < len(phenotype_sets):
+        logger.warning(f"{len(phenotype_sets) - len(positions)} phenotype sets have no embedded phenotypes")
+    return results
@@ -1,150 +1,113 @@
-
-from pheval.post_processing.post_processing import PhEvalDiseaseResult
-
 import multiprocessing as mp
-from typing import List, Dict, Set
+from typing import List
+
 import numpy as np
 from tqdm import tqdm
-from functools import partial
-from collections import defaultdict
+
+from pheval_elder.prepare.core.multiprocessing.best_match_multiprocessing import (
+    distribute_sets_evenly,
+    process_batch_of_sets,
+)
+from pheval_elder.prepare.core.multiprocessing.shared_data import SharedDataPlane
+from pheval_elder.prepare.core.query.best_match_engine import BestMatchEngine, BMAAggregation
+from pheval_elder.prepare.core.query.ranked_results import RankedResults
+
+# input phenotypes per similarity matrix product
+DEFAULT_CHUNK_ROWS = 1024
 
 
 class OptimizedMultiprocessing:
-    def __init__(self, data_processor, n_processes=None):
-        self.hp_embeddings = data_processor.hp_embeddings
+    """
+    Multi-process best-match analysis on index arrays.
+
+    The input and disease phenotypes are mapped to rows and columns of one
+    float32 (input phenotypes x disease phenotypes) similarity matrix, filled by
+    per-chunk matrix products of the L2-normalised embeddings. The matrix and the
+    disease-grouped columns of a BestMatchEngine are published once to the shared
+    data plane, and the workers score batches of phenotype sets against them.
+    Every distinct term of a phenotype set counts once.
+    """
+
+    def __init__(self, data_processor, n_processes=None, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        self.data_processor = data_processor
+        self.hp_embedding_store = data_processor.hp_embedding_store
         self.disease_to_hps = data_processor.disease_to_hps
         self.n_processes = n_processes or mp.cpu_count()
-        # Precompute disease phenotypes that have embeddings
-        self.valid_disease_phenotypes = {
-            disease_id: [p for p in data["phenotypes"] if p in self.hp_embeddings]
-            for disease_id, data in self.disease_to_hps.items()
-        }
-
-    @staticmethod
-    def cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
-        return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
-
-    def precompute_all_needed_similarities(self, phenotype_sets: List[List[str]]) -> Dict:
-        """Precompute all cosine similarities that will be needed"""
-        # Get unique phenotypes from input sets
-        all_input_phenotypes: Set[str] = set()
-        for pheno_set in phenotype_sets:
-            all_input_phenotypes.update(pheno_set)
-
-        # Get unique disease phenotypes
-        all_disease_phenotypes: Set[str] = set()
-        for disease_data in self.disease_to_hps.values():
-            all_disease_phenotypes.update(disease_data["phenotypes"])
-
-        # Filter for valid phenotypes
-        valid_input_phenotypes = {p for p in all_input_phenotypes if p in self.hp_embeddings}
-        valid_disease_phenotypes = {p for p in all_disease_phenotypes if p in self.hp_embeddings}
-
-        # Create pairs for computation
-        pairs_to_compute = [(i, d) for i in valid_input_phenotypes for d in valid_disease_phenotypes]
-
-        # Prepare embeddings dictionary
-        embeddings_dict = {
-            hp: np.array(self.hp_embeddings[hp]['embeddings'])
-            for hp in valid_input_phenotypes.union(valid_disease_phenotypes)
-        }
-
-        # Split for parallel processing
-        chunk_size = len(pairs_to_compute) // self.n_processes + 1
-        pair_chunks = [pairs_to_compute[i:i + chunk_size]
-                       for i in range(0, len(pairs_to_compute), chunk_size)]
-
-        # Process chunks in parallel
-        with mp.Pool(processes=self.n_processes) as pool:
-            chunk_results = list(tqdm(
-                pool.imap(
-                    partial(self._compute_similarities_chunk, embeddings_dict=embeddings_dict),
-                    pair_chunks
-                ),
-                total=len(pair_chunks),
-                desc="Computing cosine similarities"
-            ))
-
-        # Merge results
-        similarity_cache = {}
-        for chunk_result in chunk_results:
-            similarity_cache.update(chunk_result)
-
-        return similarity_cache
-
-    @staticmethod
-    def _compute_similarities_chunk(pairs: List[tuple], embeddings_dict: Dict) -> Dict:
-        chunk_results = {}
-        for hp1, hp2 in pairs:
-            vec1 = embeddings_dict[hp1]
-            vec2 = embeddings_dict[hp2]
-            similarity = np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
-            chunk_results[(hp1, hp2)] = similarity
-        return chunk_results
-
-    def _process_phenotype_set(self, args):
-        phenotype_set, similarity_cache = args
-
-        best_match_scores = defaultdict(lambda: {"best_scores": {}})
-        valid_phenotypes = [hp for hp in phenotype_set if hp in self.hp_embeddings]
-
-        if not valid_phenotypes:
-            print(f"No valid phenotypes found in set: {phenotype_set}")
-            return []
-
-        # Process each disease
-        for disease_id, disease_phenotypes in self.valid_disease_phenotypes.items():
-            if not disease_phenotypes:
-                continue
-
-            disease_name = self.disease_to_hps[disease_id]["disease_name"]
-
-            # For each input phenotype, find best matching disease phenotype
-            for input_hp in valid_phenotypes:
-                best_match = max(
-                    similarity_cache.get((input_hp, disease_hp), float('-inf'))
-                    for disease_hp in disease_phenotypes
-                )
-
-                if best_match > float('-inf'):
-                    best_match_scores[disease_id]["disease_name"] = disease_name
-                    best_match_scores[disease_id]["best_scores"][input_hp] = best_match
-
-        # Sort and create results
-        results = []
-        sorted_scores = sorted(
-            best_match_scores.items(),
-            key=lambda item: np.mean(list(item[1]["best_scores"].values())),
-            reverse=True
-        )
-
-        for disease_id, scores in sorted_scores[:self.nr_of_results]:
-            avg_score = float(np.mean(list(scores["best_scores"].values())))
-            results.append(PhEvalDiseaseResult(
-                disease_identifier=disease_id,
-                disease_name=scores["disease_name"],
-                score=avg_score
-            ))
-
-        return results
-
-    def process_all_sets(self, phenotype_sets: List[List[str]], nr_of_results: int):
-        """Process all phenotype sets with precomputed similarities"""
-        self.nr_of_results = nr_of_results  # Store for use in _process_phenotype_set
-
-        # First precompute all similarities
+        self.chunk_rows = chunk_rows
+        self.input_hp_index_map = {}
+        self.disease_ids = []
+        self.engine = None
+        self.similarities = None
+
+    def precompute_all_needed_similarities(self, phenotype_sets: List[List[str]]) -> np.ndarray:
+        """
+        Compute the similarities of all input phenotypes to all disease phenotypes.
+
+        Returns:
+            float32 (input phenotypes x disease phenotypes) cosine similarities
+        """
+        store = self.hp_embedding_store
+        valid_input_phenotypes = list(dict.fromkeys(hp for pheno_set in phenotype_sets for hp in pheno_set
+                                                    if hp in store))
+        self.input_hp_index_map = {hp: row for row, hp in enumerate(valid_input_phenotypes)}
+
+        disease_hp_index_map = {}
+        disease_indices = []
+        self.disease_ids = []
+        for disease_id, disease_data in self.disease_to_hps.items():
+            columns = sorted({disease_hp_index_map.setdefault(hp, len(disease_hp_index_map))
+                              for hp in disease_data["phenotypes"] if hp in store})
+            if columns:
+                self.disease_ids.append(disease_id)
+                disease_indices.append(np.array(columns, dtype=np.int64))
+        self.engine = BestMatchEngine.from_disease_indices(disease_indices)
+
+        disease_units = store.unit_vectors(list(disease_hp_index_map))
+        self.similarities = np.empty((len(valid_input_phenotypes), len(disease_units)), dtype=np.float32)
+        for start in tqdm(range(0, len(valid_input_phenotypes), self.chunk_rows), desc="Computing cosine similarities"):
+            input_units = store.unit_vectors(valid_input_phenotypes[start:start + self.chunk_rows])
+            # rows are L2-normalised, so the cosine is a plain matrix product
+            np.matmul(input_units, disease_units.T, out=self.similarities[start:start + len(input_units)])
+        print(f"Computed {self.similarities.shape[0]} x {self.similarities.shape[1]} similarities "
+              f"({self.similarities.nbytes / 1e6:.1f} MB)")
+        return self.similarities
+
+    def publish_parallel_processing_data(self, plane: SharedDataPlane):
+        """Publish the similarity matrix and the disease layout under the keys of ``process_batch_of_sets``."""
+        plane.publish_object("bm.memory_budget", None)
+        handle = plane.publish("bm.similarities", self.similarities)
+        # Keep only the shared copy of the matrix in the parent as well
+        self.similarities = handle.attach()
+        plane.publish("bm.disease_indices", self.engine.columns)
+        plane.publish("bm.disease_offsets", self.engine.offsets)
+        plane.publish("bm.disease_rows", self.data_processor.disease_table.rows(self.disease_ids))
+        plane.publish_object("bm.input_hp_index_map", self.input_hp_index_map)
+        plane.publish_object("bm.aggregations", [BMAAggregation.BMA])
+
+    def process_all_sets(self, phenotype_sets: List[List[str]], nr_of_results: int) -> List[RankedResults]:
+        """Process all phenotype sets with precomputed similarities, one RankedResults per phenotype set."""
         print("Precomputing cosine similarities...")
-        similarity_cache = self.precompute_all_needed_similarities(phenotype_sets)
+        self.precompute_all_needed_similarities(phenotype_sets)
 
-        # Process each phenotype set with the precomputed similarities
         print("Processing phenotype sets...")
-        process_args = [(pheno_set, similarity_cache) for pheno_set in phenotype_sets]
-
-        with mp.Pool(processes=self.n_processes) as pool:
-            results = list(tqdm(
-                pool.imap(self._process_phenotype_set, process_args),
-                total=len(phenotype_sets),
-                desc="Processing phenotype sets"
-            ))
-
-        return results
\ No newline at end of file
+        distinct_sets = [list(dict.fromkeys(pheno_set)) for pheno_set in phenotype_sets]
+        num_workers = max(1, min(self.n_processes, len(phenotype_sets)))
+        process_args = [
+            (worker_sets, nr_of_results)
+            for worker_sets in distribute_sets_evenly(distinct_sets, num_workers)
+            if worker_sets
+        ]
+
+        results = [RankedResults.empty() for _ in range(len(phenotype_sets))]
+        with SharedDataPlane() as plane:
+            self.publish_parallel_processing_data(plane)
+            with plane.pool(num_workers) as pool:
+                for batch_results in tqdm(
+                        pool.imap(process_batch_of_sets, process_args),
+                        total=len(process_args),
+                        desc="Processing phenotype sets"
+                ):
+                    for orig_idx, ranked in batch_results:
+                        results[orig_idx] = ranked
+        self.similarities = None
+        return results
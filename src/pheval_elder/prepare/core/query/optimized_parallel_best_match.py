@@ -9,6 +9,8 @@ import psutil
 from pheval.post_processing.post_processing import PhEvalDiseaseResult
 from tqdm import tqdm
 
+from pheval_elder.prepare.core.query.best_match_engine import BestMatchEngine
+
 worker_task_count = defaultdict(int)  # Track number of tasks per worker
 
 def log_memory_usage(stage):
@@ -21,6 +23,7 @@ class OptimizedTermSetPairwiseComparison:
     def __init__(self, data_processor):
         self.data_processor = data_processor
         log_memory_usage("Before loading embeddings")
+        self.hp_embedding_store = data_processor.hp_embedding_store
         self.hp_embeddings = data_processor.hp_embeddings
         log_memory_usage("After loading embeddings")
         self.disease_to_hps_from_omim = data_processor.disease_to_hps
@@ -44,10 +47,7 @@ class OptimizedTermSetPairwiseComparison:
             }
 
         valid_disease_phenotypes = [hp for hp in all_disease_phenotypes if hp in self.hp_embeddings]
-        disease_embeddings_matrix = np.array([
-            self.hp_embeddings[hp]['embeddings']
-            for hp in valid_disease_phenotypes
-        ])
+        disease_embeddings_matrix = self.hp_embedding_store.unit_vectors(valid_disease_phenotypes)
 
         # Get all unique input phenotypes and build index map
         unique_input_hps = set()
@@ -59,10 +59,7 @@ class OptimizedTermSetPairwiseComparison:
         for idx, hp in enumerate(valid_input_hps):
             self.input_hp_index_map[hp] = idx
 
-        input_embeddings_matrix = np.array([
-            self.hp_embeddings[hp]['embeddings']
-            for hp in valid_input_hps
-        ])
+        input_embeddings_matrix = self.hp_embedding_store.unit_vectors(valid_input_hps)
 
         print(
             f"Computing similarities between {len(valid_input_hps)} \
@@ -70,18 +67,16 @@ class OptimizedTermSetPairwiseComparison:
             f"disease phenotypes..."
         )
 
-        # Compute all pairwise similarities at once
-        norm_disease = np.linalg.norm(disease_embeddings_matrix, axis=1).reshape(1, -1)
-        norm_input = np.linalg.norm(input_embeddings_matrix, axis=1).reshape(-1, 1)
+        # Compute all pairwise similarities at once; rows are L2-normalised, so cosine is a plain GEMM
         log_memory_usage("Before computing similarity matrix")
-        self.all_similarities = np.dot(input_embeddings_matrix, disease_embeddings_matrix.T) / (
-                    norm_input @ norm_disease)
+        self.all_similarities = input_embeddings_matrix @ disease_embeddings_matrix.T
         log_memory_usage("After computing similarity matrix")
 
         # Pre-calculate disease-phenotype indices
+        disease_hp_index_map = {hp: i for i, hp in enumerate(valid_disease_phenotypes)}
         for disease_id, disease_data in self.disease_to_hps_from_omim.items():
-            phenotype_indices = [i for i, hp in enumerate(valid_disease_phenotypes)
-                                 if hp in disease_data["phenotypes"]]
+            phenotype_indices = sorted({disease_hp_index_map[hp] for hp in disease_data["phenotypes"]
+                                        if hp in disease_hp_index_map})
             if phenotype_indices:
                 self.disease_phenotype_indices[disease_id] = np.array(phenotype_indices)
 
@@ -96,63 +91,39 @@ class OptimizedTermSetPairwiseComparison:
 
 
 def process_batch_of_sets(args):
-    """Process a batch of phenotype sets with minimal data."""
+    """Process a batch of phenotype sets, scoring all diseases of many sets per call."""
     pid = os.getpid()
     worker_task_count[pid] += 1
 
     indexed_phenotype_sets_batch, nr_of_results, processing_data = args
     input_hp_index_map, disease_metadata, all_similarities, disease_phenotype_indices = processing_data
+    disease_ids = list(disease_phenotype_indices.keys())
+    engine = BestMatchEngine.from_disease_indices([disease_phenotype_indices[d] for d in disease_ids])
 
-    batch_results = []
     batch_start_time = time.time()
+    log_memory_usage(f"Before processing batch in worker {pid}")
 
-    for orig_idx, phenotype_set in indexed_phenotype_sets_batch:
-        set_start_time = time.time()
-        log_memory_usage(f"Before processing phenotype set in worker {pid}")
-
-        # Get valid phenotypes and their indices
-        valid_phenotypes = [hp for hp in phenotype_set if hp in input_hp_index_map]
-        if not valid_phenotypes:
-            batch_results.append((orig_idx, []))  # Empty result for this set
-            continue
-
-        phenotype_indices = np.array([input_hp_index_map[hp] for hp in valid_phenotypes])
-        disease_scores = []
-
-        # Calculate scores for all diseases
-        for disease_id, indices in disease_phenotype_indices.items():
-            if indices.size == 0:
-                continue
-
-            relevant_similarities = all_similarities[phenotype_indices][:, indices]
-            max_similarities = np.max(relevant_similarities, axis=1)
-            avg_score = float(np.mean(max_similarities))
-
-            disease_scores.append((
-                disease_id,
-                disease_metadata[disease_id]["name"],
-                avg_score
-            ))
-
-        set_end_time = time.time()
-        print(f"Worker {pid} processed set of size {len(phenotype_set)} in {set_end_time - set_start_time:.2f} seconds")
-
-        log_memory_usage(f"After processing phenotype set in worker {pid}")
-
-        # Sort and get top results for this set
-        sorted_scores = sorted(disease_scores, key=lambda x: x[2], reverse=True)[:nr_of_results]
+    term_sets = [
+        np.array([input_hp_index_map[hp] for hp in phenotype_set if hp in input_hp_index_map], dtype=np.int64)
+        for _, phenotype_set in indexed_phenotype_sets_batch
+    ]
+    batch_results = []
+    for (orig_idx, _), (top, scores) in zip(
+            indexed_phenotype_sets_batch, engine.top_k(all_similarities, term_sets, nr_of_results)
+    ):
         batch_results.append((
             orig_idx,
             [
                 PhEvalDiseaseResult(
-                    disease_identifier=disease_id,
-                    disease_name=disease_name,
-                    score=score
+                    disease_identifier=disease_ids[i],
+                    disease_name=disease_metadata[disease_ids[i]]["name"],
+                    score=float(score)
                 )
-                for disease_id, disease_name, score in sorted_scores
+                for i, score in zip(top, scores)
             ]
         ))
 
+    log_memory_usage(f"After processing batch in worker {pid}")
     batch_end_time = time.time()
     print(
         f"Worker {pid} completed batch of {len(indexed_phenotype_sets_batch)} sets in {batch_end_time - batch_start_time:.2f} seconds")
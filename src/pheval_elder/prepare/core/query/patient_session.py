@@ -0,0 +1,144 @@
+"""
+Interactive disease ranking while a patient's phenotype terms are refined.
+
+A PatientSession keeps the running sum and count of the embeddings of the
+patient's HPO terms, so adding or removing a term is an O(D) update of the
+averaged patient vector instead of re-averaging all terms. Every update
+rescores the patient vector against the in-memory disease matrix of an
+ExactDiseaseSearch and can report how far every disease moved in the ranking.
+"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from pheval_elder.prepare.core.query.exact_search import ExactDiseaseSearch
+from pheval_elder.prepare.core.query.ranked_results import DiseaseTable, RankedResults
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore
+from pheval_elder.prepare.core.utils.obsolete_hp_mapping import update_hpo_id
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SessionUpdate:
+    """
+    Ranking after an update of a PatientSession.
+
+    Attributes:
+        results: Top diseases of the patient vector, empty while the session has no embedded term
+        rank_delta: Per DiseaseTable row, previous rank minus new rank (positive: moved up);
+            None without rank deltas or when there was no previous ranking
+    """
+    results: RankedResults
+    rank_delta: Optional[np.ndarray] = None
+
+
+@dataclass
+class PatientSession:
+    """
+    Running average of a patient's HPO term embeddings, rescored on every change.
+
+    Attributes:
+        search: Exact search over the disease embeddings of the strategy
+        store: HPO embedding store the terms are looked up in
+        table: Disease table the results point into
+        nr_of_results: Number of diseases per ranking
+        rank_deltas: Track the rank of every disease and report rank deltas
+    """
+    search: ExactDiseaseSearch
+    store: HPEmbeddingStore
+    table: DiseaseTable
+    nr_of_results: int = 10
+    rank_deltas: bool = False
+    counts: Dict[str, int] = field(default_factory=dict, init=False)
+
+    def __post_init__(self):
+        # float64 so that long add / remove sequences do not accumulate float32 rounding
+        self._sum = np.zeros(self.store.dimension, dtype=np.float64)
+        self._count = 0
+        self._ranks: Optional[np.ndarray] = None
+        # search rows -> table rows, resolved once for the session
+        self._table_rows = self.table.rows(self.search.disease_ids)
+
+    def __len__(self) -> int:
+        """Number of embedded terms in the session, duplicates counted."""
+        return self._count
+
+    @property
+    def terms(self) -> List[str]:
+        """Embedded terms of the session, in the order they were added."""
+        return list(self.counts)
+
+    @property
+    def embedding(self) -> Optional[np.ndarray]:
+        """Averaged patient vector, None while the session has no embedded term."""
+        if self._count == 0:
+            return None
+        return (self._sum / self._count).astype(np.float32)
+
+    def add(self, hp_id: str) -> SessionUpdate:
+        """
+        Add a term to the patient and rescore.
+
+        Terms without an embedding are ignored with a warning; adding a term twice
+        counts it twice, as in the averaged phenotype sets of the batch analyses.
+        """
+        hp_id = update_hpo_id(hp_id)
+        if hp_id not in self.store:
+            logger.warning(f"{hp_id} has no embedding, ignoring it")
+            return self.rescore()
+        self._sum += self.store.vector(hp_id)
+        self._count += 1
+        self.counts[hp_id] = self.counts.get(hp_id, 0) + 1
+        return self.rescore()
+
+    def remove(self, hp_id: str) -> SessionUpdate:
+        """
+        Remove one occurrence of a term from the patient and rescore.
+
+        Raises:
+            KeyError: If the term is not in the session
+        """
+        hp_id = update_hpo_id(hp_id)
+        if hp_id not in self.counts:
+            raise KeyError(f"{hp_id} is not in the session")
+        self.counts[hp_id] -= 1
+        if self.counts[hp_id] == 0:
+            del self.counts[hp_id]
+        self._count -= 1
+        if self._count == 0:
+            # drop the rounding residue instead of carrying it into the next term
+            self._sum[:] = 0
+        else:
+            self._sum -= self.store.vector(hp_id)
+        return self.rescore()
+
+    def rescore(self) -> SessionUpdate:
+        """Rank the diseases for the current patient vector."""
+        embedding = self.embedding
+        if embedding is None:
+            self._ranks = None
+            return SessionUpdate(results=RankedResults.empty())
+
+        distances = self.search.distances(embedding[None, :])[0]
+        k = min(self.nr_of_results, len(distances))
+        rank_delta = None
+        if self.rank_deltas:
+            order = np.argsort(distances, kind="stable")
+            ranks = np.empty(len(order), dtype=np.int32)
+            ranks[order] = np.arange(len(order), dtype=np.int32)
+            if self._ranks is not None:
+                rank_delta = np.zeros(len(self.table), dtype=np.int32)
+                rank_delta[self._table_rows] = self._ranks - ranks
+            self._ranks = ranks
+            top = order[:k]
+        else:
+            top = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+            top = top[np.argsort(distances[top], kind="stable")]
+        return SessionUpdate(
+            results=RankedResults(rows=self._table_rows[top], scores=distances[top]),
+            rank_delta=rank_delta,
+        )
@@ -1,8 +1,11 @@
+import json
 from dataclasses import dataclass
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from chromadb.types import Collection
 from deprecation import deprecated
 
+from pheval_elder.prepare.core.collections.incremental import BUILD_HASH_KEY
+from pheval_elder.prepare.core.query.exact_search import ExactDiseaseSearch
 from pheval_elder.prepare.core.store.chromadb_manager import ChromaDBManager
 from pheval_elder.prepare.core.data_processing.data_processor import DataProcessor
 from pheval_elder.prepare.core.collections.disease_avg_embedding_service import DiseaseAvgEmbeddingService
@@ -16,18 +19,25 @@ class QueryService:
     db_manager: ChromaDBManager
     average_llm_embedding_service: Optional[DiseaseAvgEmbeddingService] = None
     weighted_average_llm_embedding_service: Optional[DiseaseWeightedAvgEmbeddingService] = None
+    # single phenotype sets only need a few HPO embeddings, fetch them by id
+    lazy_embeddings: bool = True
     similarity_strategy=None,[]
 
     def __post_init__(self):
         self.db_manager = self.db_manager
         self.data_processor = self.data_processor
         self.similarity_strategy = self.similarity_strategy
-        self.hp_embeddings = self.data_processor.hp_embeddings
+        if self.lazy_embeddings:
+            self.hp_embeddings = self.data_processor.lazy_hp_embeddings()
+        else:
+            self.hp_embeddings = self.data_processor.hp_embeddings
         self.disease_to_hps_from_omim = self.data_processor.disease_to_hps_with_frequencies
         if self.average_llm_embedding_service:
             self.disease_service = self.average_llm_embedding_service
         if self.weighted_average_llm_embedding_service:
             self.disease_weighted_service = self.weighted_average_llm_embedding_service
+        # exact searches over fully loaded disease collections, keyed by collection name
+        self._exact_searches: Dict[str, Tuple[str, ExactDiseaseSearch]] = {}
 
 
     '''
@@ -54,7 +64,7 @@ class QueryService:
 
         query_params = {
             "query_embeddings": [avg_embedding.tolist()],
-            "include": ["embeddings", "distances"],
+            "include": ["distances"],
             "n_results": n_results
         }
 
@@ -123,7 +133,7 @@ class QueryService:
 
             query_params = {
                 "query_embeddings": [avg_embedding.tolist()],
-                "include": ["embeddings", "distances"],
+                "include": ["distances"],
                 "n_results": n_results
             }
 
@@ -156,7 +166,7 @@ class QueryService:
 
         query_params = {
             "query_embeddings": [avg_embedding.tolist()],
-            "include": ["metadatas","embeddings", "distances"],
+            "include": ["metadatas", "distances"],
             "n_results": n_results
         }
 
@@ -182,26 +192,21 @@ class QueryService:
         :param n_results: Optional number of results to return. Returns all if None.
         :return: List of diseases sorted by closeness to the average HPO embeddings.
         """
-        print("n_results at default  = :" + f"{n_results}")
+        if n_results is None:
+            return [(disease_id, distance) for disease_id, _, distance in self.rank_all_diseases(
+                hpo_ids, self.disease_service.disease_new_avg_embeddings_collection
+            )]
+
         avg_embedding = self.data_processor.calculate_average_embedding(hpo_ids, self.hp_embeddings)
         if avg_embedding is None:
             raise ValueError("No valid embeddings found for provided HPO terms.")
 
         query_params = {
             "query_embeddings": [avg_embedding.tolist()],
-            "include": ["embeddings", "distances"]
+            "include": ["distances"],
+            "n_results": n_results
         }
 
-        if n_results is None:
-            estimated_total = self.disease_service.disease_new_avg_embeddings_collection.get(include=['metadatas'])
-            estimated_length = len(estimated_total["metadatas"])  # 12468 - 1
-            print(f"Estimated length (n_results) == {estimated_length}")
-            max_n_results = self.binary_search_max_results_nocol(query_params, 11700, estimated_length)
-            query_params["n_results"] = max_n_results
-            print(f"Using max safe n_results: {max_n_results}")
-        else:
-            query_params["n_results"] = n_results
-
         query_results = self.disease_service.disease_new_avg_embeddings_collection.query(**query_params)
         disease_ids = query_results['ids'][0] if 'ids' in query_results and query_results['ids'] else []
         distances = query_results['distances'][0] if 'distances' in query_results and query_results['distances'] else []
@@ -210,6 +215,56 @@ class QueryService:
         sorted_results = sorted(zip(disease_ids, distances), key=lambda x: x[1])  # remember to add label
         return sorted_results
 
+    '''
+    The following ranks every disease of a collection in one pass, with an exact scan instead of HNSW queries
+    '''
+
+    def exact_search(self, collection: Collection) -> ExactDiseaseSearch:
+        """
+        Return the exact search over all diseases of a collection.
+
+        The collection is read once and kept in memory; it is only read again when
+        its build hash (``elder_build_hash`` metadata) changed. Collections without a
+        build hash are checked against their content fingerprint instead.
+        """
+        version = self.collection_version(collection)
+        cached = self._exact_searches.get(collection.name)
+        if cached is None or cached[0] != version:
+            search = ExactDiseaseSearch.from_collection(collection, self.db_manager.similarity)
+            self._exact_searches[collection.name] = (version, search)
+            return search
+        return cached[1]
+
+    @staticmethod
+    def collection_version(collection: Collection) -> str:
+        """Build hash of a disease collection, or its fingerprint if it carries none."""
+        build_hash = (collection.metadata or {}).get(BUILD_HASH_KEY)
+        if build_hash:
+            return build_hash
+        return json.dumps(ChromaDBManager.collection_fingerprint(collection), sort_keys=True)
+
+    def rank_all_diseases(
+        self,
+        hpo_ids: List[str],
+        collection: Collection
+    ) -> List[Tuple[str, str, float]]:
+        """
+        Rank every disease of a collection by closeness to the average embedding of given HPO terms.
+
+        :param hpo_ids: List of HPO term IDs.
+        :param collection: Disease embedding collection (average or weighted average).
+        :return: (disease id, disease name, distance) of all diseases, closest first.
+        """
+        avg_embedding = self.data_processor.calculate_average_embedding(hpo_ids, self.hp_embeddings)
+        if avg_embedding is None:
+            raise ValueError("No valid embeddings found for provided HPO terms.")
+        search = self.exact_search(collection)
+        indices, distances = search.search(avg_embedding[None, :], len(search))
+        return [
+            (search.disease_ids[i], search.disease_names[i], float(distance))
+            for i, distance in zip(indices[0], distances[0])
+        ]
+
     '''
     The following are util functions (but they are not necessary, having the top10 results printed is everything it needs,
     it would just be to check if it maybe does not find a specific diseasea:
@@ -227,6 +282,7 @@ class QueryService:
         sorted_results = sorted(zip(disease_ids, disease_names, distances), key=lambda x: x[2])
         return sorted_results
 
+    @deprecated  # rank_all_diseases returns the complete ranking in one pass
     def binary_search_max_results_nocol(
         self,
         query_params,
@@ -0,0 +1,95 @@
+"""
+Compact, array-based disease rankings.
+
+The analyses return one RankedResults per phenotype set: the ranked disease
+rows (int32) of a shared DiseaseTable and their scores (float32). Only these
+two arrays cross process boundaries and are cached; disease ids and names are
+resolved from the table when the PhEval result files are written.
+"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Sequence
+
+import numpy as np
+from pheval.post_processing.post_processing import PhEvalDiseaseResult
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DiseaseTable:
+    """
+    Id / name table the disease rows of RankedResults point into.
+
+    Attributes:
+        disease_ids: Disease ids, one per row
+        disease_names: Disease names, one per row
+    """
+    disease_ids: np.ndarray
+    disease_names: np.ndarray
+    index: Dict[str, int] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.disease_ids = np.asarray(self.disease_ids, dtype=object)
+        self.disease_names = np.asarray(self.disease_names, dtype=object)
+        self.index = {disease_id: row for row, disease_id in enumerate(self.disease_ids)}
+
+    def __len__(self) -> int:
+        return len(self.disease_ids)
+
+    @classmethod
+    def from_disease_to_hps(cls, disease_to_hps: Dict[str, Dict[str, Any]]) -> "DiseaseTable":
+        """Create the table from a ``disease_id -> {"disease_name": ..., ...}`` mapping."""
+        return cls(
+            disease_ids=list(disease_to_hps.keys()),
+            disease_names=[data.get("disease_name") for data in disease_to_hps.values()],
+        )
+
+    def rows(self, disease_ids: Iterable[str]) -> np.ndarray:
+        """Return the int32 rows of ``disease_ids``, -1 for ids that are not in the table."""
+        return np.fromiter((self.index.get(disease_id, -1) for disease_id in disease_ids), dtype=np.int32)
+
+
+@dataclass
+class RankedResults:
+    """
+    Ranked diseases of one phenotype set.
+
+    Attributes:
+        rows: int32 DiseaseTable rows, best match first
+        scores: float32 scores of the rows
+    """
+    rows: np.ndarray
+    scores: np.ndarray
+
+    def __post_init__(self):
+        self.rows = np.asarray(self.rows, dtype=np.int32)
+        self.scores = np.asarray(self.scores, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @classmethod
+    def empty(cls) -> "RankedResults":
+        return cls(rows=np.zeros(0, dtype=np.int32), scores=np.zeros(0, dtype=np.float32))
+
+    @classmethod
+    def from_ids(cls, table: DiseaseTable, disease_ids: Sequence[str], scores: Sequence[float]) -> "RankedResults":
+        """Create the results from disease ids (e.g. a Chroma query), dropping ids missing from the table."""
+        rows = table.rows(disease_ids)
+        known = rows >= 0
+        if not known.all():
+            logger.warning(f"Dropping {int((~known).sum())} results with diseases missing from the disease table")
+        return cls(rows=rows[known], scores=np.asarray(scores, dtype=np.float32)[known])
+
+    def to_pheval_results(self, table: DiseaseTable) -> List[PhEvalDiseaseResult]:
+        """Resolve the rows against ``table`` into PhEvalDiseaseResults, keeping the ranking."""
+        return [
+            PhEvalDiseaseResult(
+                disease_identifier=table.disease_ids[row],
+                disease_name=table.disease_names[row],
+                score=float(score),
+            )
+            for row, score in zip(self.rows, self.scores)
+        ]
@@ -0,0 +1,216 @@
+"""
+Result cache for phenotype-set analyses.
+
+Evaluation sweeps rerun the same phenopackets across models, k values and
+strategies, and many phenopackets share the same phenotype terms. Results are
+cached under a key built from the canonical phenotype set (obsolete ids
+mapped, de-duplicated, sorted) together with the strategy, the model
+fingerprint, the similarity measure and k. The cache has an in-memory LRU
+tier and an optional on-disk tier (one JSON file per key), so a phenotype set
+is only scored once per configuration, also across runs. Cached entries are
+RankedResults; their rows point into the disease table of the annotations the
+model fingerprint covers.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from pheval_elder.prepare.core.query.ranked_results import RankedResults
+from pheval_elder.prepare.core.utils.obsolete_hp_mapping import update_hpo_id
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_DIR = "elder_result_cache"
+DEFAULT_MEMORY_ENTRIES = 4096
+
+
+def canonical_phenotype_set(hpo_ids: Iterable[str]) -> Tuple[str, ...]:
+    """Map obsolete HPO ids to their replacements, de-duplicate and sort."""
+    return tuple(sorted({update_hpo_id(hpo_id) for hpo_id in hpo_ids}))
+
+
+def result_cache_key(
+        hpo_ids: Iterable[str],
+        strategy: str,
+        model_fingerprint: Any,
+        similarity: str,
+        k: int
+) -> str:
+    """
+    Build the cache key of an analysis of one phenotype set.
+
+    Args:
+        hpo_ids: Phenotype set (HPO ids)
+        strategy: Analysis strategy, including anything that changes its results (e.g. the backend)
+        model_fingerprint: JSON-serialisable fingerprint of the embeddings and annotations used
+        similarity: Similarity measure
+        k: Number of results
+
+    Returns:
+        Hex digest identifying the analysis
+    """
+    payload = json.dumps(
+        {
+            "phenotypes": canonical_phenotype_set(hpo_ids),
+            "strategy": strategy,
+            "model": model_fingerprint,
+            "similarity": similarity,
+            "k": k,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    """Hit and miss counters of a ResultCache."""
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.hits} hits ({self.memory_hits} memory, {self.disk_hits} disk), "
+            f"{self.misses} misses, hit rate {self.hit_rate:.1%}"
+        )
+
+
+@dataclass
+class ResultCache:
+    """
+    Two-tier cache of analysis results.
+
+    Attributes:
+        directory: Directory of the on-disk tier, None keeps the cache in memory only
+        max_entries: Number of results kept in the in-memory LRU tier
+        stats: Hit and miss counters
+    """
+    directory: Optional[Union[str, Path]] = None
+    max_entries: int = DEFAULT_MEMORY_ENTRIES
+    stats: CacheStats = field(default_factory=CacheStats)
+
+    def __post_init__(self):
+        if self.directory is not None:
+            self.directory = Path(self.directory)
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self._memory: "OrderedDict[str, RankedResults]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _remember(self, key: str, results: RankedResults) -> None:
+        self._memory[key] = results
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[RankedResults]:
+        """Return the cached results of ``key``, or None on a miss."""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.stats.memory_hits += 1
+            return self._memory[key]
+        if self.directory is not None:
+            path = self._path(key)
+            if path.exists():
+                try:
+                    entry = json.loads(path.read_text())
+                    results = RankedResults(rows=entry["rows"], scores=entry["scores"])
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning(f"Ignoring unreadable cache entry {path}: {e}")
+                else:
+                    self._remember(key, results)
+                    self.stats.disk_hits += 1
+                    return results
+        self.stats.misses += 1
+        return None
+
+    def contains(self, key: str) -> bool:
+        """Whether ``key`` is cached in either tier, without counting a lookup."""
+        return key in self._memory or (self.directory is not None and self._path(key).exists())
+
+    def put(self, key: str, results: RankedResults) -> None:
+        """Store the results of ``key`` in both tiers."""
+        self._remember(key, results)
+        if self.directory is None:
+            return
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        entry = {"rows": results.rows.tolist(), "scores": results.scores.tolist()}
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(entry))
+        os.replace(tmp_path, path)
+
+    def clear(self) -> None:
+        """Drop the in-memory tier; the on-disk tier is kept."""
+        self._memory.clear()
+
+    def cached_analysis(
+            self,
+            phenotype_sets: Sequence[List[str]],
+            key: Callable[[List[str]], str],
+            analysis: Callable[[List[List[str]]], List[RankedResults]]
+    ) -> List[RankedResults]:
+        """
+        Run ``analysis`` only for the phenotype sets whose results are not cached.
+
+        Phenotype sets with the same key are scored once, as their canonical set
+        (see ``canonical_phenotype_set``) so the cached results match every set
+        sharing the key.
+
+        Args:
+            phenotype_sets: Phenotype sets to analyse
+            key: Function building the cache key of a phenotype set
+            analysis: Analysis of a list of phenotype sets, one RankedResults per set. It
+                receives new canonical lists (sorted, de-duplicated, obsolete ids mapped),
+                not the caller's phenotype set objects, and must return its results
+                positionally, in the order of its input.
+
+        Returns:
+            One RankedResults per phenotype set, in input order
+        """
+        keys = [key(phenotype_set) for phenotype_set in phenotype_sets]
+        results: List[Optional[RankedResults]] = [None] * len(phenotype_sets)
+        missing: Dict[str, List[int]] = {}
+        for position, set_key in enumerate(keys):
+            if set_key in missing:
+                missing[set_key].append(position)
+                self.stats.memory_hits += 1
+                continue
+            cached = self.get(set_key)
+            if cached is None:
+                missing[set_key] = [position]
+            else:
+                results[position] = cached
+
+        if missing:
+            computed = analysis([
+                list(canonical_phenotype_set(phenotype_sets[positions[0]])) for positions in missing.values()
+            ])
+            for (set_key, positions), set_results in zip(missing.items(), computed):
+                self.put(set_key, set_results)
+                for position in positions:
+                    results[position] = set_results
+
+        logger.info(f"Result cache: {self.stats.summary()}")
+        return results
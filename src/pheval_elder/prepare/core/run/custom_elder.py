@@ -13,9 +13,10 @@ from pheval_elder.prepare.core.utils.similarity_measures import SimilarityMeasur
 
 """
 class CustomElderRunner:
-    def __init__(self, similarity_measure=SimilarityMeasures.COSINE):
+    def __init__(self, similarity_measure=SimilarityMeasures.COSINE, lazy_embeddings=True):
         self.db_manager = ChromaDBManager(similarity=similarity_measure)
-        self.data_processor = DataProcessor(self.db_manager)
+        # single phenotype sets only need a few HPO embeddings, fetch them by id
+        self.data_processor = DataProcessor(self.db_manager, lazy_embeddings=lazy_embeddings)
         self.disease_service = DiseaseAvgEmbeddingService(self.data_processor)
 
     def initialize_data(self):
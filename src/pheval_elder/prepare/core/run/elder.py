@@ -7,16 +7,29 @@ analysis on phenotype sets using different strategies.
 
 import time
 from dataclasses import dataclass
-from typing import Iterator, List, Any, Dict, Optional, Union, Type
+from typing import Callable, Iterator, List, Any, Dict, Optional, Tuple, Union, Type
 
 from pheval.post_processing.post_processing import PhEvalDiseaseResult
 
 from pheval_elder.prepare.core.collections.disease_avg_embedding_service import DiseaseAvgEmbeddingService
 from pheval_elder.prepare.core.collections.disease_weighted_avg_embedding_service import DiseaseWeightedAvgEmbeddingService
+from pheval_elder.prepare.core.collections.disease_embedding_builder import DiseaseEmbeddingBuilder
 from pheval_elder.prepare.core.data_processing.data_processor import DataProcessor
+from pheval_elder.prepare.core.query.async_query import (
+    DEFAULT_MAX_IN_FLIGHT,
+    AsyncQueryExecutor,
+    async_query_analysis,
+)
+from pheval_elder.prepare.core.query.best_match_engine import BMAAggregation
+from pheval_elder.prepare.core.query.exact_search import ExactDiseaseSearch, SearchBackend, exact_search_analysis
 from pheval_elder.prepare.core.query.multi_process_best_match import OptimizedMultiprocessing
+from pheval_elder.prepare.core.query.patient_session import PatientSession
+from pheval_elder.prepare.core.query.ranked_results import DiseaseTable, RankedResults
+from pheval_elder.prepare.core.query.result_cache import ResultCache, canonical_phenotype_set, result_cache_key
 from pheval_elder.prepare.core.query.termsetpairwise import TermSetPairWiseComparisonQuery
-from pheval_elder.prepare.core.store.chromadb_manager import ChromaDBManager
+from pheval_elder.prepare.core.store.chromadb_manager import DEFAULT_CHROMA_PORT, ChromaDBManager
+from pheval_elder.prepare.core.store.embedding_store import EmbeddingPrecision
+from pheval_elder.prepare.core.store.index_profiles import IndexProfile
 from pheval_elder.prepare.core.utils.similarity_measures import SimilarityMeasures
 
 # Import multiprocessing modules
@@ -32,6 +45,13 @@ from pheval_elder.prepare.core.multiprocessing.best_match_multiprocessing import
     OptimizedTermSetPairwiseComparison,
     process_phenotype_sets_parallel,
 )
+from pheval_elder.prepare.core.multiprocessing.multi_strategy_multiprocessing import (
+    BEST_MATCH_STRATEGIES,
+    process_multi_strategy_parallel,
+)
+
+# strategies a multi-strategy run can compute in one pass
+MULTI_STRATEGIES = ("avg", "wgt_avg", *BEST_MATCH_STRATEGIES)
 
 
 @dataclass
@@ -50,25 +70,48 @@ class ElderRunner:
     db_collection_path: str
     nr_of_results: int
     similarity_measure: SimilarityMeasures = SimilarityMeasures.COSINE
+    embedding_precision: EmbeddingPrecision = EmbeddingPrecision.FLOAT32
+    incremental_update: bool = False
+    search_backend: SearchBackend = SearchBackend.CHROMA
+    query_batch_size: int = 100
+    use_result_cache: bool = False
+    result_cache_dir: Optional[str] = None
+    chroma_host: Optional[str] = None
+    chroma_port: int = DEFAULT_CHROMA_PORT
+    index_profile: IndexProfile = IndexProfile.BALANCED
+    max_in_flight_queries: int = DEFAULT_MAX_IN_FLIGHT
+    tcp_memory_budget_mb: Optional[int] = None
+    tcp_similarity_matrix: bool = False
     results_dir_name: Optional[str] = None
     results_sub_dir: Optional[str] = None
+    strategies: Optional[List[str]] = None
     
     # Services for different strategies
     data_processor: Optional[DataProcessor] = None
     disease_service: Optional[DiseaseAvgEmbeddingService] = None
     disease_weighted_service: Optional[DiseaseWeightedAvgEmbeddingService] = None
     db_manager: Optional[ChromaDBManager] = None
+    result_cache: Optional[ResultCache] = None
 
     def __post_init__(self):
         """Initialize the runner after dataclass initialization."""
         # Normalize embedding model name
         self.embedding_model = self.embedding_model.lower()
+        self.search_backend = SearchBackend(self.search_backend)
+        self.index_profile = IndexProfile(self.index_profile)
+        unsupported = set(self.strategies or []) - set(MULTI_STRATEGIES)
+        if unsupported:
+            raise ValueError(
+                f"Unsupported strategies for a multi-strategy run: {', '.join(sorted(unsupported))}; "
+                f"choose from {', '.join(MULTI_STRATEGIES)}"
+            )
         
         # Set result directory names if not provided
+        results_dir_name, results_sub_dir = self.result_dir_names(self.strategy)
         if not self.results_dir_name:
-            self.results_dir_name = f"{self.embedding_model}_{self.strategy}_{self.nr_of_phenopackets}pp_top{self.nr_of_results}"
+            self.results_dir_name = results_dir_name
         if not self.results_sub_dir:
-            self.results_sub_dir = f"{self.embedding_model}_{self.strategy}_{self.collection_name}_{self.nr_of_phenopackets}pp_top{self.nr_of_results}"
+            self.results_sub_dir = results_sub_dir
         
         # Initialize database manager
         self.db_manager = ChromaDBManager(
@@ -78,42 +121,175 @@ class ElderRunner:
             strategy=self.strategy,
             nr_of_phenopackets=self.nr_of_phenopackets,
             path=self.db_collection_path,
-            nr_of_results=self.nr_of_results
+            nr_of_results=self.nr_of_results,
+            host=self.chroma_host,
+            port=self.chroma_port,
+            index_profile=self.index_profile,
         )
         
         # Initialize data processor
-        self.data_processor = DataProcessor(db_manager=self.db_manager)
+        self.data_processor = DataProcessor(
+            db_manager=self.db_manager,
+            embedding_precision=self.embedding_precision
+        )
         
-        # Initialize services based on strategy
-        if self.strategy == "avg":
+        # Initialize services based on strategies
+        if "avg" in self.run_strategies:
             self.disease_service = DiseaseAvgEmbeddingService(data_processor=self.data_processor)
-        elif self.strategy == "wgt_avg":
+        if "wgt_avg" in self.run_strategies:
             self.disease_weighted_service = DiseaseWeightedAvgEmbeddingService(data_processor=self.data_processor)
 
+        if self.use_result_cache and self.result_cache is None:
+            self.result_cache = ResultCache(directory=self.result_cache_dir or self.data_processor.result_cache_dir)
+
+    @property
+    def run_strategies(self) -> List[str]:
+        """Strategies of this run: ``strategies`` for a multi-strategy run, otherwise just ``strategy``."""
+        return list(self.strategies) if self.strategies else [self.strategy]
+
+    def result_dir_names(self, strategy: str) -> Tuple[str, str]:
+        """Results dir name and sub dir name of ``strategy``."""
+        return (
+            f"{self.embedding_model}_{strategy}_{self.nr_of_phenopackets}pp_top{self.nr_of_results}",
+            f"{self.embedding_model}_{strategy}_{self.collection_name}_{self.nr_of_phenopackets}pp_top{self.nr_of_results}",
+        )
+
     def initialize_data(self):
         """Initialize data for processing."""
-        print(f"Initializing data for strategy: {self.strategy}")
+        print(f"Initializing data for strategies: {', '.join(self.run_strategies)}")
         # Load HP embeddings and disease-to-HP mappings
         _ = self.data_processor.hp_embeddings
         _ = self.data_processor.disease_to_hps
-        if self.strategy == "wgt_avg":
+        if {"wgt_avg", "tpc_wgt"} & set(self.run_strategies):
             _ = self.data_processor.disease_to_hps_with_frequencies
 
     def setup_collections(self):
         """Set up collections for processing."""
-        print(f"Setting up collections for strategy: {self.strategy}")
-        if self.strategy == "avg" and self.disease_service:
-            self.disease_service.process_data()
-        elif self.strategy == "wgt_avg" and self.disease_weighted_service:
-            self.disease_weighted_service.process_data()
+        print(f"Setting up collections for strategies: {', '.join(self.run_strategies)}")
+        if "avg" in self.run_strategies and self.disease_service:
+            self.disease_service.process_data(incremental=self.incremental_update)
+        if "wgt_avg" in self.run_strategies and self.disease_weighted_service:
+            self.disease_weighted_service.process_data(incremental=self.incremental_update)
+
+    @property
+    def disease_table(self) -> DiseaseTable:
+        """Id / name table the rows of the RankedResults returned by the optimized analyses point into."""
+        return self.data_processor.disease_table
+
+    def pheval_results(self, results: RankedResults) -> List[PhEvalDiseaseResult]:
+        """Resolve RankedResults into PhEvalDiseaseResults, for writing the PhEval result files."""
+        return results.to_pheval_results(self.disease_table)
+
+    def model_fingerprint(self) -> Dict[str, Any]:
+        """Fingerprint of everything the results depend on besides strategy, similarity and k."""
+        return {
+            "hp_collection": self.data_processor.hp_collection_fingerprint,
+            "hpoa": self.data_processor.hpoa_hash,
+            "precision": EmbeddingPrecision(self.embedding_precision).value,
+        }
+
+    def cached_analysis(
+            self,
+            phenotype_sets: List[List[str]],
+            nr_of_results: int,
+            strategy: str,
+            analysis: Callable[[List[List[str]], int], List[RankedResults]]
+    ) -> List[RankedResults]:
+        """
+        Answer the phenotype sets from the result cache and run ``analysis`` for the rest.
+
+        Without a result cache, ``analysis`` runs for all phenotype sets. With it,
+        ``analysis`` receives the canonical lists of the uncached sets (see
+        ``ResultCache.cached_analysis``) and must return its results positionally.
+        """
+        if self.result_cache is None:
+            return analysis(phenotype_sets, nr_of_results)
+        fingerprint = self.model_fingerprint()
+        similarity = SimilarityMeasures(self.similarity_measure).value
+        results = self.result_cache.cached_analysis(
+            phenotype_sets,
+            key=lambda phenotype_set: result_cache_key(
+                phenotype_set, strategy, fingerprint, similarity, nr_of_results
+            ),
+            analysis=lambda missing: analysis(missing, nr_of_results),
+        )
+        print(f"Result cache: {self.result_cache.stats.summary()}")
+        return results
+
+    def exact_disease_search(self, strategy: Optional[str] = None) -> ExactDiseaseSearch:
+        """Build the in-process exact search over the disease embeddings of ``strategy`` (default: the current one)."""
+        builder = DiseaseEmbeddingBuilder(store=self.data_processor.hp_embedding_store)
+        if (strategy or self.strategy) == "wgt_avg":
+            disease_embeddings = builder.weighted_average(self.data_processor.disease_to_hps_with_frequencies)
+        else:
+            disease_embeddings = builder.average(self.data_processor.disease_to_hps)
+        return ExactDiseaseSearch.from_disease_embeddings(disease_embeddings, self.similarity_measure)
+
+    def patient_session(self, strategy: Optional[str] = None, rank_deltas: bool = False) -> PatientSession:
+        """Start an interactive PatientSession over the disease embeddings of ``strategy`` (default: the current one)."""
+        return PatientSession(
+            search=self.exact_disease_search(strategy),
+            store=self.data_processor.hp_embedding_store,
+            table=self.disease_table,
+            nr_of_results=self.nr_of_results,
+            rank_deltas=rank_deltas,
+        )
+
+    def exact_analysis(self, phenotype_sets, nr_of_results, strategy: Optional[str] = None):
+        """Rank the diseases for all phenotype sets with the exact in-process search."""
+        strategy = strategy or self.strategy
+        print(f"Running exact {strategy} analysis on {len(phenotype_sets)} phenotype sets")
+        start_time = time.time()
+        results = exact_search_analysis(
+            self.exact_disease_search(strategy),
+            self.data_processor.hp_embedding_store,
+            phenotype_sets,
+            nr_of_results,
+            self.disease_table,
+        )
+        print(f"Exact {strategy} analysis completed in {time.time() - start_time:.2f} seconds")
+        return results
+
+    def server_analysis(self, phenotype_sets, nr_of_results, collection):
+        """Rank the diseases for all phenotype sets with bounded concurrent queries to the Chroma server."""
+        print(f"Running {collection.name} analysis on {len(phenotype_sets)} phenotype sets "
+              f"against the Chroma server at {self.chroma_host}:{self.chroma_port}")
+        start_time = time.time()
+        executor = AsyncQueryExecutor(
+            host=self.chroma_host,
+            port=self.chroma_port,
+            collection_name=collection.name,
+            max_in_flight=self.max_in_flight_queries,
+            query_batch_size=self.query_batch_size,
+        )
+        results = async_query_analysis(
+            executor,
+            self.data_processor.hp_embedding_store,
+            phenotype_sets,
+            nr_of_results,
+            self.disease_table,
+        )
+        print(f"{collection.name} analysis completed in {time.time() - start_time:.2f} seconds")
+        return results
 
     def optimized_avg_analysis(self, phenotype_sets, nr_of_results):
-        """Run optimized average embedding analysis on phenotype sets."""
+        """Run optimized average embedding analysis on phenotype sets, consulting the result cache first."""
+        return self.cached_analysis(
+            phenotype_sets, nr_of_results, self.cache_label("avg"), self._optimized_avg_analysis
+        )
+
+    def _optimized_avg_analysis(self, phenotype_sets, nr_of_results):
+        if self.search_backend == SearchBackend.EXACT:
+            return self.exact_analysis(phenotype_sets, nr_of_results)
+        if self.db_manager.is_remote:
+            return self.server_analysis(
+                phenotype_sets, nr_of_results, self.db_manager.disease_embeddings_collection("avg")
+            )
         print(f"Running optimized average analysis on {len(phenotype_sets)} phenotype sets")
         oadea = OptimizedAverageDiseaseEmbedAnalysis(
             data_processor=self.data_processor
         )
-        return process_avg_analysis_parallel(phenotype_sets, oadea, nr_of_results)
+        return process_avg_analysis_parallel(phenotype_sets, oadea, nr_of_results, self.query_batch_size)
 
     def avg_analysis(self, input_hpos, nr_of_results):
         """Run average embedding analysis on phenotype sets."""
@@ -130,12 +306,23 @@ class ElderRunner:
         )
 
     def optimized_wgt_avg_analysis(self, phenotype_sets, nr_of_results):
-        """Run optimized weighted average embedding analysis on phenotype sets."""
+        """Run optimized weighted average embedding analysis on phenotype sets, consulting the result cache first."""
+        return self.cached_analysis(
+            phenotype_sets, nr_of_results, self.cache_label("wgt_avg"), self._optimized_wgt_avg_analysis
+        )
+
+    def _optimized_wgt_avg_analysis(self, phenotype_sets, nr_of_results):
+        if self.search_backend == SearchBackend.EXACT:
+            return self.exact_analysis(phenotype_sets, nr_of_results)
+        if self.db_manager.is_remote:
+            return self.server_analysis(
+                phenotype_sets, nr_of_results, self.db_manager.disease_embeddings_collection("wgt_avg")
+            )
         print(f"Running optimized weighted average analysis on {len(phenotype_sets)} phenotype sets")
         owadea = OptimizedWeightedAverageDiseaseEmbedAnalysis(
             data_processor=self.data_processor,
         )
-        return process_wgt_avg_analysis_parallel(phenotype_sets, owadea, nr_of_results)
+        return process_wgt_avg_analysis_parallel(phenotype_sets, owadea, nr_of_results, self.query_batch_size)
 
     def wgt_avg_analysis(self, input_hpos, nr_of_results):
         """Run weighted average embedding analysis on phenotype sets."""
@@ -151,7 +338,7 @@ class ElderRunner:
             n_results=nr_of_results
         )
 
-    def tcp_analysis_multi(self, input_hpos, nr_of_results):
+    def tcp_analysis_multi(self, input_hpos, nr_of_results) -> List[RankedResults]:
         """Run multi-process term-set pairwise comparison analysis on phenotype sets."""
         print(f"Running multi-process TCP analysis on {len(input_hpos)} phenotype sets")
         tcp = OptimizedMultiprocessing(data_processor=self.data_processor)
@@ -163,14 +350,147 @@ class ElderRunner:
         tcp = TermSetPairWiseComparisonQuery(data_processor=self.data_processor)
         return tcp.termset_pairwise_comparison_disease_embeddings(input_hpos, nr_of_results)
 
-    def tcp_analysis_optimized(self, phenotype_sets: List[List[str]], nr_of_results: int) -> List[
-        List[PhEvalDiseaseResult]]:
-        """Run optimized term-set pairwise comparison analysis on phenotype sets."""
+    def tcp_analyzer(
+            self,
+            aggregations: Optional[List[BMAAggregation]] = None
+    ) -> OptimizedTermSetPairwiseComparison:
+        """
+        Best-match analyzer ranking by ``aggregations`` (default: BMA).
+
+        With ``tcp_similarity_matrix`` the similarities are looked up in the persisted
+        HPO similarity matrix; otherwise, with ``tcp_memory_budget_mb``, they are
+        computed in tiles.
+
+        Raises:
+            FileNotFoundError: If the similarity matrix is requested but missing or stale
+        """
+        similarity_matrix = None
+        if self.tcp_similarity_matrix:
+            similarity_matrix = self.data_processor.load_similarity_matrix()
+            if similarity_matrix is None:
+                raise FileNotFoundError(
+                    f"No up-to-date HPO similarity matrix in {self.data_processor.similarity_matrix_dir}; "
+                    f"build it with `elder build-similarities`"
+                )
+        memory_budget_bytes = self.tcp_memory_budget_mb * 1024 * 1024 if self.tcp_memory_budget_mb else None
+        return OptimizedTermSetPairwiseComparison(
+            data_processor=self.data_processor, memory_budget_bytes=memory_budget_bytes,
+            similarity_matrix=similarity_matrix, aggregations=aggregations,
+        )
+
+    def tcp_analysis_optimized(self, phenotype_sets: List[List[str]], nr_of_results: int) -> List[RankedResults]:
+        """Run optimized term-set pairwise comparison analysis on phenotype sets, consulting the result cache first."""
+        return self.cached_analysis(phenotype_sets, nr_of_results, self.cache_label("tpc"), self._tcp_analysis_optimized)
+
+    def _tcp_analysis_optimized(self, phenotype_sets, nr_of_results):
         print(f"Running optimized TCP analysis on {len(phenotype_sets)} phenotype sets")
         start_time = time.time()
-        tcp = OptimizedTermSetPairwiseComparison(data_processor=self.data_processor)
+        tcp = self.tcp_analyzer()
         tcp.precompute_similarities(phenotype_sets)
         results = process_phenotype_sets_parallel(phenotype_sets, tcp, nr_of_results)
         end_time = time.time()
         print(f"TCP analysis completed in {end_time - start_time:.2f} seconds")
-        return results
\ No newline at end of file
+        return results
+
+    def multi_strategy_analysis(
+            self,
+            phenotype_sets: List[List[str]],
+            nr_of_results: int,
+            strategies: Optional[List[str]] = None
+    ) -> Dict[str, List[RankedResults]]:
+        """
+        Rank the diseases for all phenotype sets with several strategies in one pass.
+
+        The phenotype sets missing from the result cache for any of the strategies
+        are analysed once for all strategies together; everything else is answered
+        from the cache.
+
+        Args:
+            phenotype_sets: Phenotype sets of the phenopackets
+            nr_of_results: Number of diseases per phenotype set
+            strategies: Strategies to run (default: ``run_strategies``)
+
+        Returns:
+            One RankedResults per phenotype set for every strategy
+        """
+        strategies = list(strategies or self.run_strategies)
+        if self.result_cache is None:
+            return self._multi_strategy_pass(phenotype_sets, nr_of_results, strategies)
+
+        fingerprint = self.model_fingerprint()
+        similarity = SimilarityMeasures(self.similarity_measure).value
+        # the cache hands canonical lists to the analysis, so combined results are keyed by canonical set
+        missing = list(dict.fromkeys(
+            canonical_phenotype_set(phenotype_set) for phenotype_set in phenotype_sets
+            if not all(
+                self.result_cache.contains(result_cache_key(
+                    phenotype_set, self.cache_label(strategy), fingerprint, similarity, nr_of_results
+                ))
+                for strategy in strategies
+            )
+        ))
+        combined = self._multi_strategy_pass([list(key) for key in missing], nr_of_results, strategies) if missing else {}
+        by_set = {
+            strategy: dict(zip(missing, combined.get(strategy, [])))
+            for strategy in strategies
+        }
+
+        def combined_results(strategy):
+            def analysis(sets, k):
+                # sets the cache dropped after the lookup above are analysed on their own
+                keys = [canonical_phenotype_set(phenotype_set) for phenotype_set in sets]
+                rest = [key for key in dict.fromkeys(keys) if key not in by_set[strategy]]
+                if rest:
+                    computed = self._multi_strategy_pass([list(key) for key in rest], k, [strategy])[strategy]
+                    by_set[strategy].update(zip(rest, computed))
+                return [by_set[strategy][key] for key in keys]
+            return analysis
+
+        return {
+            strategy: self.cached_analysis(
+                phenotype_sets, nr_of_results, self.cache_label(strategy), combined_results(strategy)
+            )
+            for strategy in strategies
+        }
+
+    def cache_label(self, strategy: str) -> str:
+        """Strategy label of the result cache keys of ``strategy``."""
+        if strategy in BEST_MATCH_STRATEGIES:
+            label = "tcp" if strategy == "tpc" else f"tcp/{BEST_MATCH_STRATEGIES[strategy].value}"
+            # similarities looked up in the float16 matrix can shift scores in the last digits
+            return f"{label}/float16" if self.tcp_similarity_matrix else label
+        if self.search_backend == SearchBackend.CHROMA:
+            # HNSW results depend on the index parameters of the collection
+            return f"{strategy}/{self.search_backend.value}/{self.index_profile.value}"
+        return f"{strategy}/{self.search_backend.value}"
+
+    def _multi_strategy_pass(self, phenotype_sets, nr_of_results, strategies):
+        print(f"Running {', '.join(strategies)} analysis on {len(phenotype_sets)} phenotype sets in one pass")
+        start_time = time.time()
+        results = {}
+        analyzers = {}
+        best_match = [strategy for strategy in strategies if strategy in BEST_MATCH_STRATEGIES]
+        if best_match:
+            # one similarity pass, one aggregation per best-match strategy
+            tcp = self.tcp_analyzer([BEST_MATCH_STRATEGIES[strategy] for strategy in best_match])
+            tcp.precompute_similarities(phenotype_sets)
+            analyzers.update((strategy, tcp) for strategy in best_match)
+        for strategy in strategies:
+            if strategy in BEST_MATCH_STRATEGIES:
+                continue
+            elif self.search_backend == SearchBackend.EXACT:
+                results[strategy] = self.exact_analysis(phenotype_sets, nr_of_results, strategy)
+            elif self.db_manager.is_remote:
+                results[strategy] = self.server_analysis(
+                    phenotype_sets, nr_of_results, self.db_manager.disease_embeddings_collection(strategy)
+                )
+            elif strategy == "avg":
+                analyzers[strategy] = OptimizedAverageDiseaseEmbedAnalysis(data_processor=self.data_processor)
+            else:
+                analyzers[strategy] = OptimizedWeightedAverageDiseaseEmbedAnalysis(data_processor=self.data_processor)
+        if analyzers:
+            results.update(process_multi_strategy_parallel(
+                phenotype_sets, analyzers, nr_of_results, self.query_batch_size
+            ))
+        print(f"Analysis of {', '.join(strategies)} completed in {time.time() - start_time:.2f} seconds")
+        return results
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import logging
 from collections.abc import Sequence
 from typing import Optional, ClassVar, Iterable, Dict, Any
@@ -14,16 +16,25 @@ from venomx.model.venomx import Index
 
 from pheval_elder.metadata.metadata import Metadata
 from pheval_elder.prepare.config import config_loader
+from pheval_elder.prepare.core.store.index_profiles import IndexProfile, hnsw_params
 from pheval_elder.prepare.core.utils.utils import populate_venomx, normalize_metadata
 from pheval_elder.prepare.core.utils.similarity_measures import SimilarityMeasures
 
 
 logger = logging.getLogger(__name__)
 
+FINGERPRINT_SAMPLE_SIZE = 64
+DEFAULT_CHROMA_PORT = 8000
+
 @dataclass
 class ChromaDBManager:
     """
     Manager for ChromaDB operations including collection management and data insertion.
+
+    With ``host`` set, the collections are served by a Chroma server (client/server
+    mode) and ``path`` is only used for the local side data (embedding store,
+    manifests, result cache); otherwise ``path`` is the persistent Chroma DB.
+    ``index_profile`` selects the HNSW parameters of the disease collections.
     """
     name: ClassVar[str] = "chromadb"
     collection_name: Optional[str] = None
@@ -37,9 +48,13 @@ class ChromaDBManager:
     nr_of_phenopackets: Optional[str] = None
     nr_of_results: Optional[int] = None
     auto_create: bool = False
+    host: Optional[str] = None
+    port: int = DEFAULT_CHROMA_PORT
+    index_profile: IndexProfile = IndexProfile.BALANCED
 
     def __post_init__(self):
         """Initialize ChromaDB client and collection after dataclass initialization."""
+        self.index_profile = IndexProfile(self.index_profile)
         if not self.auto_create:
             if self.collection_name is None:
                 raise RuntimeError(f"Collection name of embedded HP data (curateGPT output) must be provided.")
@@ -47,15 +62,35 @@ class ChromaDBManager:
             if self.path is None:
                 config = config_loader.load_config()
                 self.path = config["chroma_db_path"]
-                self.client = chromadb.PersistentClient(path=self.path)
-            else:
-                self.client = chromadb.PersistentClient(path=self.path)
+            self.client = self.create_client()
                 
             if self.ont_hp is None and self.collection_name and not self.auto_create:
                 self.ont_hp = self.client.get_collection(self.collection_name)
         else:
             self.handle_auto_create()
 
+    @property
+    def is_remote(self) -> bool:
+        """Whether the collections are served by a Chroma server."""
+        return bool(self.host)
+
+    def create_client(self) -> API:
+        """Create an HTTP client for the Chroma server at ``host``, or a persistent client for ``path``."""
+        if self.is_remote:
+            logger.info(f"Connecting to Chroma server at {self.host}:{self.port}")
+            return chromadb.HttpClient(host=self.host, port=self.port)
+        return chromadb.PersistentClient(path=self.path)
+
+    def disease_embeddings_collection(self, strategy: Optional[str] = None) -> Collection:
+        """Get the disease embedding collection of ``strategy`` ("avg" / "wgt_avg"), default the manager's strategy."""
+        return self._get_disease_avg_embeddings_collection(
+            self.collection_name,
+            strategy or self.strategy,
+            self.model_shorthand,
+            self.nr_of_phenopackets,
+            self.nr_of_results
+        )
+
     @property
     def disease_weighted_avg_embeddings_collection(self) -> Collection:
         """Get collection for weighted average disease embeddings."""
@@ -108,8 +143,12 @@ class ChromaDBManager:
 
     def get_or_create_collection(self, name: str) -> Collection:
         """
-        Get or create a ChromaDB collection with appropriate settings.
-        
+        Get or create a disease collection with the HNSW parameters of ``index_profile``.
+
+        Chroma cannot change the index of an existing collection, so a collection
+        built with other HNSW parameters is dropped and recreated empty; it is
+        rebuilt by the disease embedding services.
+
         Args:
             name: Name of the collection
             
@@ -121,19 +160,81 @@ class ChromaDBManager:
         """
         try:
             similarity_str_value = self.similarity.value if self.similarity else SimilarityMeasures.COSINE.value
-            collection = self.client.get_or_create_collection(
-                name=name,
-                # TODO: this is for HPO, adjust for others (maybe a bool flag in params, to adjust)
-                metadata={
-                    "hnsw:space": similarity_str_value,
-                    "hnsw:search_ef": 800,
-                    "hnsw:construction_ef": 200,
-                    "hnsw:M": 16
-                })
+            params = hnsw_params(self.index_profile)
+            metadata = params.metadata(similarity_str_value)
+            collection = self.client.get_or_create_collection(name=name, metadata=metadata)
+            if not params.matches(collection.metadata or {}):
+                logger.warning(
+                    f"{name} was built with other HNSW parameters than the {self.index_profile.value} "
+                    f"profile ({params.label}), recreating it"
+                )
+                self.client.delete_collection(name)
+                collection = self.client.create_collection(name=name, metadata=metadata)
             return collection
         except Exception as e:
             raise ValueError(f"Error getting/creating collection {name}: {str(e)}")
 
+    @staticmethod
+    def collection_model_name(collection: Collection) -> Optional[str]:
+        """Return the embedding model name from the venomx metadata of a collection, if present."""
+        venomx_json = (collection.metadata or {}).get("_venomx")
+        if not venomx_json:
+            return None
+        try:
+            return (json.loads(venomx_json).get("embedding_model") or {}).get("name")
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Failed to read venomx metadata of {collection.name}: {e}")
+            return None
+
+    @staticmethod
+    def collection_fingerprint(collection: Collection, sample_size: int = FINGERPRINT_SAMPLE_SIZE) -> Dict[str, Any]:
+        """
+        Compute a cheap fingerprint of a collection's content.
+
+        Covers the collection name, the row count, the embedding model from the
+        venomx metadata and a hash over the ids and embeddings of the first and
+        last ``sample_size`` rows. Only two small pages are read, so the
+        fingerprint can be checked on every run.
+
+        Args:
+            collection: Chroma collection
+            sample_size: Number of rows hashed at each end of the collection
+
+        Returns:
+            Dictionary with collection, count, model and sample_hash
+        """
+        count = collection.count()
+        digest = hashlib.sha256()
+        for offset in sorted({0, max(count - sample_size, 0)}):
+            page = collection.get(include=["embeddings"], limit=sample_size, offset=offset)
+            digest.update("\n".join(page.get("ids") or []).encode("utf-8"))
+            embeddings = page.get("embeddings")
+            if embeddings is not None and len(embeddings) > 0:
+                digest.update(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes())
+        return {
+            "collection": collection.name,
+            "count": count,
+            "model": ChromaDBManager.collection_model_name(collection),
+            "sample_hash": digest.hexdigest(),
+        }
+
+    @staticmethod
+    def merge_collection_metadata(collection: Collection, **values: Any) -> Dict[str, Any]:
+        """
+        Add or overwrite keys in the metadata of a collection, keeping the existing keys.
+
+        Chroma replaces the whole metadata on ``modify`` and rejects changing the
+        distance function, so ``hnsw:space`` is left out of the update; the
+        collection keeps its distance function.
+
+        Returns:
+            The metadata passed to ``modify``
+        """
+        metadata = {k: v for k, v in (collection.metadata or {}).items() if k != "hnsw:space"}
+        metadata.update(values)
+        collection.modify(metadata=metadata)
+        return metadata
+
     def list_collections(self) -> Sequence[Collection]:
         """List all collections in the ChromaDB instance."""
         return self.client.list_collections()
@@ -262,5 +363,5 @@ class ChromaDBManager:
             config = config_loader.load_config()
             self.path = config["chroma_db_path"]
             
-        self.client = chromadb.PersistentClient(path=self.path)
+        self.client = self.create_client()
         self.ont_hp = self.client.get_or_create_collection(self.collection_name)
\ No newline at end of file
@@ -0,0 +1,507 @@
+"""
+Contiguous HPO embedding store.
+
+This module holds all HPO term embeddings of a collection as a single
+(N x D) matrix plus an id -> row index. The store is persisted as a
+memory-mappable ``.npy`` file next to the ChromaDB directory, so it can be
+loaded in milliseconds and every process mapping it shares the same
+page-cache pages instead of holding its own copy.
+
+The matrix is kept in float32 by default; float16 and symmetric int8 (with
+per-row scales) are available as reduced-precision modes.
+
+Stores built by Elder are pre-normalised: the matrix holds L2-normalised rows
+and the original row norms are kept alongside. Cosine similarity is then a
+plain dot product of stored rows, while the raw vectors (needed for averaging
+and for L2 / inner-product scores) are recovered as ``unit * norm``.
+"""
+
+import json
+import logging
+import os
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from pheval_elder.prepare.core.utils.similarity_measures import SimilarityMeasures
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_STORE_DIR = "elder_embeddings"
+
+
+class EmbeddingPrecision(str, Enum):
+    """Storage precision of embedding matrices."""
+    FLOAT32 = "float32"
+    FLOAT16 = "float16"
+    INT8 = "int8"
+
+
+def quantize_matrix(
+        matrix: np.ndarray,
+        precision: EmbeddingPrecision
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Convert a matrix to the given storage precision.
+
+    int8 uses symmetric per-row quantisation: each row is scaled by
+    ``max(|row|) / 127`` and the scales are returned alongside the data.
+
+    Args:
+        matrix: (N x D) matrix to convert
+        precision: Target storage precision
+
+    Returns:
+        Tuple of (stored data, per-row float32 scales or None)
+    """
+    precision = EmbeddingPrecision(precision)
+    if precision == EmbeddingPrecision.FLOAT32:
+        return np.ascontiguousarray(matrix, dtype=np.float32), None
+    if precision == EmbeddingPrecision.FLOAT16:
+        return np.ascontiguousarray(matrix, dtype=np.float16), None
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127.0 if matrix.size else np.zeros(len(matrix), dtype=np.float32)
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    data = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return data, scales
+
+
+def l2_normalize(matrix: np.ndarray, copy: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    L2-normalise the rows of a float matrix.
+
+    Args:
+        matrix: (N x D) float matrix
+        copy: Normalise a float32 copy instead of ``matrix`` itself
+
+    Returns:
+        Tuple of (float32 matrix with unit rows, float32 original row norms); all-zero rows stay zero
+    """
+    matrix = np.array(matrix, dtype=np.float32, copy=True) if copy else np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1).astype(np.float32) if matrix.size else np.zeros(len(matrix), np.float32)
+    matrix /= np.where(norms > 0, norms, 1.0)[:, None]
+    return matrix, norms
+
+
+def dequantize_matrix(data: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    """Convert stored data (any precision) back to float32."""
+    dense = np.asarray(data, dtype=np.float32)
+    if scales is not None:
+        dense = dense * np.asarray(scales, dtype=np.float32)[..., None]
+    return dense
+
+
+@dataclass
+class HPEmbeddingStore:
+    """
+    HPO embeddings as one contiguous matrix with an id -> row index.
+
+    Attributes:
+        ids: HPO ids, one per matrix row
+        labels: HPO labels, one per matrix row
+        matrix: (N x D) embedding matrix in the storage precision
+        index: Mapping of HPO id to matrix row (derived from ids if not given)
+        path: Path of the persisted matrix file, if the store is backed by one
+        precision: Storage precision of ``matrix``
+        scales: Per-row scales of an int8 matrix
+        norms: Original row norms; when set, ``matrix`` holds L2-normalised rows
+        fingerprint: Fingerprint of the source collection the store was built from
+        chroma_ids: Chroma ids of the rows in the source collection, if known
+    """
+    ids: List[str]
+    labels: List[str]
+    matrix: np.ndarray
+    index: Dict[str, int] = field(default=None)
+    path: Optional[Path] = None
+    precision: EmbeddingPrecision = EmbeddingPrecision.FLOAT32
+    scales: Optional[np.ndarray] = None
+    norms: Optional[np.ndarray] = None
+    fingerprint: Optional[Dict[str, Any]] = None
+    chroma_ids: Optional[List[str]] = None
+
+    def __post_init__(self):
+        if self.index is None:
+            self.index = {hp_id: row for row, hp_id in enumerate(self.ids)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, hp_id: str) -> bool:
+        return hp_id in self.index
+
+    @property
+    def dimension(self) -> int:
+        """Embedding dimension (number of matrix columns)."""
+        return int(self.matrix.shape[1]) if self.matrix.ndim == 2 else 0
+
+    @property
+    def normalized(self) -> bool:
+        """Whether the matrix holds L2-normalised rows."""
+        return self.norms is not None
+
+    @property
+    def nbytes(self) -> int:
+        """In-memory footprint of the matrix (plus scales and norms)."""
+        extra = sum(a.nbytes for a in (self.scales, self.norms) if a is not None)
+        return int(self.matrix.nbytes + extra)
+
+    def rows(self, hp_ids: Sequence[str]) -> np.ndarray:
+        """Return the matrix rows of the given HPO ids, skipping unknown ids."""
+        return np.fromiter(
+            (self.index[hp_id] for hp_id in hp_ids if hp_id in self.index),
+            dtype=np.int64,
+        )
+
+    def _stored(self, rows: Union[int, np.ndarray, slice]) -> np.ndarray:
+        """Return the given matrix rows as float32, dequantising reduced-precision storage."""
+        if self.precision == EmbeddingPrecision.FLOAT32:
+            return self.matrix[rows]
+        return dequantize_matrix(self.matrix[rows], self.scales[rows] if self.scales is not None else None)
+
+    def dense(self, rows: Union[int, np.ndarray, slice]) -> np.ndarray:
+        """Return the raw float32 embeddings of the given matrix rows."""
+        stored = self._stored(rows)
+        if self.norms is None:
+            return stored
+        norms = self.norms[rows]
+        return stored * (norms[..., None] if np.ndim(norms) else norms)
+
+    def unit(self, rows: Union[int, np.ndarray, slice]) -> np.ndarray:
+        """Return the L2-normalised float32 embeddings of the given matrix rows."""
+        if self.norms is not None:
+            return self._stored(rows)
+        stored = np.atleast_2d(self._stored(rows))
+        unit, _ = l2_normalize(stored)
+        return unit if np.ndim(rows) or isinstance(rows, slice) else unit[0]
+
+    def vector(self, hp_id: str) -> np.ndarray:
+        """Return the float32 embedding of a single HPO id."""
+        return self.dense(self.index[hp_id])
+
+    def vectors(self, hp_ids: Sequence[str]) -> np.ndarray:
+        """Return the float32 embeddings of the given HPO ids as a (n x D) matrix, skipping unknown ids."""
+        return self.dense(self.rows(hp_ids))
+
+    def unit_vectors(self, hp_ids: Sequence[str]) -> np.ndarray:
+        """Return the L2-normalised embeddings of the given HPO ids as a (n x D) matrix, skipping unknown ids."""
+        return self.unit(self.rows(hp_ids))
+
+    def row_norms(self, rows: Union[int, np.ndarray, slice]) -> np.ndarray:
+        """Return the original L2 norms of the given matrix rows."""
+        if self.norms is not None:
+            return self.norms[rows]
+        return np.linalg.norm(np.atleast_2d(self._stored(rows)), axis=1).astype(np.float32)
+
+    def similarities(
+            self,
+            rows_a: np.ndarray,
+            rows_b: np.ndarray,
+            measure: SimilarityMeasures = SimilarityMeasures.COSINE
+    ) -> np.ndarray:
+        """
+        Return the (len(rows_a) x len(rows_b)) score matrix of two sets of rows.
+
+        Cosine is the dot product of the unit rows; inner product and squared
+        L2 distance are derived from it with the stored norms.
+
+        Args:
+            rows_a: Matrix rows of the first set
+            rows_b: Matrix rows of the second set
+            measure: Similarity measure (L2 returns squared distances, lower is closer)
+
+        Returns:
+            float32 score matrix
+        """
+        cosine = self.unit(rows_a) @ self.unit(rows_b).T
+        if measure == SimilarityMeasures.COSINE:
+            return cosine
+        norms_a = self.row_norms(rows_a)[:, None]
+        norms_b = self.row_norms(rows_b)[None, :]
+        inner = cosine * norms_a * norms_b
+        if measure == SimilarityMeasures.IP:
+            return inner
+        return np.maximum(norms_a ** 2 + norms_b ** 2 - 2 * inner, 0)
+
+    def normalize(self) -> "HPEmbeddingStore":
+        """Return the store with L2-normalised rows and the original norms (self if already normalised)."""
+        if self.norms is not None:
+            return self
+        unit, norms = l2_normalize(self._stored(slice(None)))
+        matrix, scales = quantize_matrix(unit, self.precision)
+        return HPEmbeddingStore(
+            ids=self.ids, labels=self.labels, matrix=matrix, index=self.index,
+            precision=self.precision, scales=scales, norms=norms, fingerprint=self.fingerprint,
+            chroma_ids=self.chroma_ids,
+        )
+
+    def with_precision(self, precision: EmbeddingPrecision) -> "HPEmbeddingStore":
+        """Return a copy of the store converted to the given storage precision."""
+        precision = EmbeddingPrecision(precision)
+        if precision == self.precision:
+            return self
+        matrix, scales = quantize_matrix(self._stored(slice(None)), precision)
+        return HPEmbeddingStore(
+            ids=self.ids, labels=self.labels, matrix=matrix, index=self.index,
+            precision=precision, scales=scales, norms=self.norms, fingerprint=self.fingerprint,
+            chroma_ids=self.chroma_ids,
+        )
+
+    def as_dict(self) -> "HPEmbeddingsView":
+        """Return a read-only dict view in the legacy ``{id: {"label", "embeddings"}}`` format."""
+        return HPEmbeddingsView(self)
+
+    @classmethod
+    def from_embeddings_dict(cls, embeddings_dict: Dict[str, Dict[str, Any]]) -> "HPEmbeddingStore":
+        """Build a normalised store from a legacy ``{id: {"label", "embeddings"}}`` dictionary."""
+        ids = list(embeddings_dict.keys())
+        labels = [embeddings_dict[hp_id].get("label", "Unknown") for hp_id in ids]
+        matrix = np.asarray([embeddings_dict[hp_id]["embeddings"] for hp_id in ids], dtype=np.float32)
+        matrix, norms = l2_normalize(matrix, copy=False)
+        return cls(ids=ids, labels=labels, matrix=matrix, norms=norms)
+
+    @staticmethod
+    def store_paths(
+            directory: Union[str, Path],
+            name: str,
+            precision: EmbeddingPrecision = EmbeddingPrecision.FLOAT32
+    ) -> Dict[str, Path]:
+        """
+        Return the paths of the matrix, scales, norms and sidecar files for a store name.
+
+        float32 stores use ``<name>.npy``; reduced-precision stores add the
+        precision to the name, e.g. ``<name>.int8.npy``.
+        """
+        directory = Path(directory)
+        precision = EmbeddingPrecision(precision)
+        base = name if precision == EmbeddingPrecision.FLOAT32 else f"{name}.{precision.value}"
+        return {
+            "matrix": directory / f"{base}.npy",
+            "scales": directory / f"{base}.scales.npy",
+            "norms": directory / f"{base}.norms.npy",
+            "meta": directory / f"{base}.json",
+        }
+
+    def save(self, directory: Union[str, Path], name: str, **extra_meta) -> Path:
+        """
+        Persist the store as ``<name>.npy`` (matrix) and ``<name>.json`` (ids, labels).
+
+        Files are written to temporary names first and moved into place, so a
+        concurrently loading process never maps a half-written matrix.
+
+        Args:
+            directory: Directory to write the store to
+            name: Base name of the store files
+            **extra_meta: Additional entries for the sidecar file
+
+        Returns:
+            Path of the matrix file
+        """
+        paths = self.store_paths(directory, name, self.precision)
+        paths["matrix"].parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_matrix = paths["matrix"].with_suffix(".npy.tmp")
+        with open(tmp_matrix, "wb") as f:
+            np.save(f, np.ascontiguousarray(self.matrix))
+        if self.scales is not None:
+            tmp_scales = paths["scales"].with_suffix(".npy.tmp")
+            with open(tmp_scales, "wb") as f:
+                np.save(f, np.ascontiguousarray(self.scales, dtype=np.float32))
+            os.replace(tmp_scales, paths["scales"])
+        if self.norms is not None:
+            tmp_norms = paths["norms"].with_suffix(".npy.tmp")
+            with open(tmp_norms, "wb") as f:
+                np.save(f, np.ascontiguousarray(self.norms, dtype=np.float32))
+            os.replace(tmp_norms, paths["norms"])
+        tmp_meta = paths["meta"].with_suffix(".json.tmp")
+        with open(tmp_meta, "w") as f:
+            json.dump(
+                {
+                    "count": len(self.ids),
+                    "dimension": self.dimension,
+                    "precision": self.precision.value,
+                    "normalized": self.normalized,
+                    "fingerprint": self.fingerprint,
+                    "ids": self.ids,
+                    "labels": self.labels,
+                    **({"chroma_ids": self.chroma_ids} if self.chroma_ids is not None else {}),
+                    **extra_meta,
+                },
+                f,
+            )
+        os.replace(tmp_matrix, paths["matrix"])
+        os.replace(tmp_meta, paths["meta"])
+        self.path = paths["matrix"]
+        logger.info(
+            f"Saved {self.precision.value} HPO embedding store ({len(self.ids)} x {self.dimension}) "
+            f"to {paths['matrix']}"
+        )
+        return paths["matrix"]
+
+    @staticmethod
+    def read_meta(
+            directory: Union[str, Path],
+            name: str,
+            precision: EmbeddingPrecision = EmbeddingPrecision.FLOAT32
+    ) -> Optional[Dict[str, Any]]:
+        """Read the sidecar file of a persisted store, or None if it does not exist or is unreadable."""
+        meta_path = HPEmbeddingStore.store_paths(directory, name, precision)["meta"]
+        if not meta_path.exists():
+            return None
+        try:
+            with open(meta_path, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Failed to read embedding store metadata {meta_path}: {e}")
+            return None
+
+    @classmethod
+    def load(
+            cls,
+            directory: Union[str, Path],
+            name: str,
+            precision: EmbeddingPrecision = EmbeddingPrecision.FLOAT32,
+            mmap: bool = True
+    ) -> Optional["HPEmbeddingStore"]:
+        """
+        Load a persisted store.
+
+        Args:
+            directory: Directory the store was saved to
+            name: Base name of the store files
+            precision: Storage precision of the store to load
+            mmap: Memory-map the matrix read-only instead of reading it into memory
+
+        Returns:
+            The store, or None if no (consistent) store exists
+        """
+        precision = EmbeddingPrecision(precision)
+        paths = cls.store_paths(directory, name, precision)
+        meta = cls.read_meta(directory, name, precision)
+        if meta is None or not paths["matrix"].exists():
+            return None
+        mmap_mode = "r" if mmap else None
+        # np.asarray drops the np.memmap subclass but keeps the mapping as buffer
+        matrix = np.asarray(np.load(paths["matrix"], mmap_mode=mmap_mode))
+        scales = None
+        if precision == EmbeddingPrecision.INT8:
+            if not paths["scales"].exists():
+                logger.warning(f"Embedding store {paths['matrix']} has no scales file, ignoring it")
+                return None
+            scales = np.asarray(np.load(paths["scales"], mmap_mode=mmap_mode))
+        norms = None
+        if meta.get("normalized"):
+            if not paths["norms"].exists():
+                logger.warning(f"Embedding store {paths['matrix']} has no norms file, ignoring it")
+                return None
+            norms = np.asarray(np.load(paths["norms"], mmap_mode=mmap_mode))
+        if matrix.shape[0] != len(meta["ids"]):
+            logger.warning(f"Embedding store {paths['matrix']} is inconsistent with its metadata, ignoring it")
+            return None
+        return cls(
+            ids=meta["ids"],
+            labels=meta["labels"],
+            matrix=matrix,
+            path=paths["matrix"],
+            precision=precision,
+            scales=scales,
+            norms=norms,
+            fingerprint=meta.get("fingerprint"),
+            chroma_ids=meta.get("chroma_ids"),
+        )
+
+
+def list_stores(directory: Union[str, Path]) -> List[Dict[str, Any]]:
+    """
+    List the persisted stores in a directory.
+
+    Args:
+        directory: Embedding store directory
+
+    Returns:
+        One entry per store with its name, precision, count, dimension, fingerprint,
+        files and total size in bytes
+    """
+    directory = Path(directory)
+    if not directory.is_dir():
+        return []
+    stores = []
+    for meta_path in sorted(directory.glob("*.json")):
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Skipping unreadable embedding store metadata {meta_path}: {e}")
+            continue
+        precision = EmbeddingPrecision(meta.get("precision", EmbeddingPrecision.FLOAT32.value))
+        base = meta_path.name[:-len(".json")]
+        suffix = "" if precision == EmbeddingPrecision.FLOAT32 else f".{precision.value}"
+        if suffix and not base.endswith(suffix):
+            continue
+        name = base[:-len(suffix)] if suffix else base
+        files = [path for path in HPEmbeddingStore.store_paths(directory, name, precision).values() if path.exists()]
+        stores.append({
+            "name": name,
+            "precision": precision.value,
+            "count": meta.get("count"),
+            "dimension": meta.get("dimension"),
+            "normalized": meta.get("normalized", False),
+            "fingerprint": meta.get("fingerprint"),
+            "files": files,
+            "size": sum(path.stat().st_size for path in files),
+        })
+    return stores
+
+
+def purge_stores(directory: Union[str, Path], name: Optional[str] = None) -> List[Path]:
+    """
+    Delete persisted stores (all precisions) and leftover temporary files.
+
+    Args:
+        directory: Embedding store directory
+        name: Only delete the stores of this collection (all stores if None)
+
+    Returns:
+        The deleted files
+    """
+    directory = Path(directory)
+    deleted = []
+    for store in list_stores(directory):
+        if name is None or store["name"] == name:
+            for path in store["files"]:
+                path.unlink(missing_ok=True)
+                deleted.append(path)
+    if directory.is_dir():
+        for path in directory.glob("*.tmp"):
+            if name is None or path.name.startswith(f"{name}."):
+                path.unlink(missing_ok=True)
+                deleted.append(path)
+    return deleted
+
+
+class HPEmbeddingsView(Mapping):
+    """
+    Read-only dict view over an HPEmbeddingStore.
+
+    Keeps the legacy ``hp_embeddings[hp_id]["embeddings"]`` API working while the
+    data itself stays in the store's contiguous matrix.
+    """
+
+    def __init__(self, store: HPEmbeddingStore):
+        self.store = store
+
+    def __getitem__(self, hp_id: str) -> Dict[str, Any]:
+        row = self.store.index[hp_id]
+        return {"label": self.store.labels[row], "embeddings": self.store.dense(row)}
+
+    def __contains__(self, hp_id: object) -> bool:
+        return hp_id in self.store.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store.ids)
+
+    def __len__(self) -> int:
+        return len(self.store.ids)
@@ -0,0 +1,76 @@
+"""
+HNSW index profiles of the disease collections.
+
+Chroma fixes the HNSW parameters of a collection when it is created:
+``M`` (graph degree) and ``construction_ef`` shape the index, ``search_ef``
+sets how many candidates a query explores. The profiles trade recall of the
+approximate search against build and query time; ``elder index-sweep``
+measures the trade-off on the actual disease collections.
+"""
+
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Dict
+
+
+class IndexProfile(str, Enum):
+    """Named HNSW parameter sets of the disease collections."""
+    EXACT = "exact"
+    BALANCED = "balanced"
+    FAST = "fast"
+
+
+@dataclass(frozen=True)
+class HNSWParams:
+    """
+    HNSW parameters of a Chroma collection.
+
+    Attributes:
+        M: Number of neighbours per node of the graph
+        construction_ef: Candidate list size while building the index
+        search_ef: Candidate list size while querying
+    """
+    M: int
+    construction_ef: int
+    search_ef: int
+
+    @classmethod
+    def parse(cls, text: str) -> "HNSWParams":
+        """Parse ``M:construction_ef:search_ef``, e.g. ``16:200:800``."""
+        try:
+            m, construction_ef, search_ef = (int(value) for value in text.split(":"))
+        except ValueError:
+            raise ValueError(f"Expected HNSW parameters as M:construction_ef:search_ef, got {text!r}")
+        return cls(M=m, construction_ef=construction_ef, search_ef=search_ef)
+
+    @property
+    def label(self) -> str:
+        return f"{self.M}:{self.construction_ef}:{self.search_ef}"
+
+    def metadata(self, space: str) -> Dict[str, Any]:
+        """Collection metadata creating an index with these parameters for the distance function ``space``."""
+        return {
+            "hnsw:space": space,
+            "hnsw:search_ef": self.search_ef,
+            "hnsw:construction_ef": self.construction_ef,
+            "hnsw:M": self.M,
+        }
+
+    def matches(self, metadata: Dict[str, Any]) -> bool:
+        """Whether the metadata of a collection records these parameters."""
+        return all(metadata.get(key) == value for key, value in self.metadata("").items() if key != "hnsw:space")
+
+
+# exact: the candidate list covers the ~12k diseases, so queries are practically
+# exhaustive (use search_backend "exact" for guaranteed exact ranks);
+# balanced: the long-standing defaults; fast: small graph and candidate list
+INDEX_PROFILES: Dict[IndexProfile, HNSWParams] = {
+    IndexProfile.EXACT: HNSWParams(M=32, construction_ef=400, search_ef=16384),
+    IndexProfile.BALANCED: HNSWParams(M=16, construction_ef=200, search_ef=800),
+    IndexProfile.FAST: HNSWParams(M=8, construction_ef=100, search_ef=64),
+}
+
+
+def hnsw_params(profile: IndexProfile) -> HNSWParams:
+    """Return the HNSW parameters of ``profile``."""
+    return INDEX_PROFILES[IndexProfile(profile)]
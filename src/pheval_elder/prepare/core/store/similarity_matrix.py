@@ -0,0 +1,167 @@
+"""
+Persistent all-pairs HPO similarity matrix.
+
+The cosine similarities between all embedded HPO terms of a collection are
+stored once as a symmetric (N x N) float16 ``.npy`` matrix next to the
+ChromaDB directory, together with a sidecar file holding the row ids and the
+fingerprint of the embedding store it was built from. For ~18k terms the
+matrix takes about 650 MB; it is memory-mapped read-only, so best-match runs
+look similarities up instead of recomputing them and all worker processes
+share the same page-cache pages.
+
+The build computes the upper triangle in square tiles on a thread pool (the
+matrix products release the GIL) and mirrors every tile into the lower
+triangle, writing straight into the memory-mapped output file.
+"""
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+from tqdm import tqdm
+
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_MATRIX_DIR = "elder_similarities"
+DEFAULT_TILE_SIZE = 2048
+
+
+@dataclass
+class HPSimilarityMatrix:
+    """
+    Memory-mapped (N x N) float16 cosine similarities of all HPO terms of a collection.
+
+    Attributes:
+        ids: HPO ids, one per matrix row (and column)
+        matrix: (N x N) float16 similarity matrix
+        index: Mapping of HPO id to matrix row (derived from ids if not given)
+        path: Path of the persisted matrix file
+        fingerprint: Fingerprint of the embedding store the matrix was built from
+    """
+    ids: List[str]
+    matrix: np.ndarray
+    index: Dict[str, int] = field(default=None)
+    path: Optional[Path] = None
+    fingerprint: Optional[Dict[str, Any]] = None
+
+    def __post_init__(self):
+        if self.index is None:
+            self.index = {hp_id: row for row, hp_id in enumerate(self.ids)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, hp_id: str) -> bool:
+        return hp_id in self.index
+
+    def rows(self, hp_ids: Sequence[str]) -> np.ndarray:
+        """Return the matrix rows of the given HPO ids, skipping unknown ids."""
+        return np.fromiter(
+            (self.index[hp_id] for hp_id in hp_ids if hp_id in self.index),
+            dtype=np.int64,
+        )
+
+    def matches(self, store: HPEmbeddingStore) -> bool:
+        """Whether the matrix was built from (a store with the same fingerprint and ids as) ``store``."""
+        return self.fingerprint == store.fingerprint and self.ids == list(store.ids)
+
+    @staticmethod
+    def matrix_paths(directory: Union[str, Path], name: str) -> Dict[str, Path]:
+        """Return the paths of the matrix and sidecar files for a collection name."""
+        directory = Path(directory)
+        return {
+            "matrix": directory / f"{name}.float16.npy",
+            "meta": directory / f"{name}.json",
+        }
+
+    @classmethod
+    def load(cls, directory: Union[str, Path], name: str) -> Optional["HPSimilarityMatrix"]:
+        """
+        Memory-map a persisted similarity matrix read-only.
+
+        Args:
+            directory: Directory the matrix was built in
+            name: Name of the HPO collection the matrix belongs to
+
+        Returns:
+            The matrix, or None if no (consistent) matrix exists
+        """
+        paths = cls.matrix_paths(directory, name)
+        if not paths["meta"].exists() or not paths["matrix"].exists():
+            return None
+        try:
+            with open(paths["meta"], "r") as f:
+                meta = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Failed to read similarity matrix metadata {paths['meta']}: {e}")
+            return None
+        matrix = np.asarray(np.load(paths["matrix"], mmap_mode="r"))
+        if matrix.shape != (len(meta["ids"]), len(meta["ids"])):
+            logger.warning(f"Similarity matrix {paths['matrix']} is inconsistent with its metadata, ignoring it")
+            return None
+        return cls(ids=meta["ids"], matrix=matrix, path=paths["matrix"], fingerprint=meta.get("fingerprint"))
+
+    @classmethod
+    def build(
+            cls,
+            store: HPEmbeddingStore,
+            directory: Union[str, Path],
+            name: str,
+            tile_size: int = DEFAULT_TILE_SIZE,
+            workers: Optional[int] = None
+    ) -> "HPSimilarityMatrix":
+        """
+        Compute and persist the similarity matrix of all terms of ``store``.
+
+        The matrix is written to a temporary file and moved into place once
+        complete, so a concurrently loading process never maps a partial matrix.
+
+        Args:
+            store: HPO embedding store to compute the similarities of
+            directory: Directory to write the matrix to
+            name: Name of the HPO collection the store belongs to
+            tile_size: Edge length of the square tiles computed per task
+            workers: Number of threads computing tiles (default: CPU count)
+
+        Returns:
+            The memory-mapped matrix
+        """
+        paths = cls.matrix_paths(directory, name)
+        paths["matrix"].parent.mkdir(parents=True, exist_ok=True)
+        n = len(store)
+        tile_size = max(1, tile_size)
+        units = np.ascontiguousarray(store.unit(slice(None)), dtype=np.float32)
+
+        tmp_matrix = paths["matrix"].with_suffix(".npy.tmp")
+        output = np.lib.format.open_memmap(tmp_matrix, mode="w+", dtype=np.float16, shape=(n, n))
+        starts = range(0, n, tile_size)
+        tiles = [(i, j) for i in starts for j in starts if j >= i]
+
+        def compute_tile(tile):
+            i, j = tile
+            block = (units[i:i + tile_size] @ units[j:j + tile_size].T).astype(np.float16)
+            output[i:i + tile_size, j:j + tile_size] = block
+            if i != j:
+                output[j:j + tile_size, i:i + tile_size] = block.T
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            for _ in tqdm(executor.map(compute_tile, tiles), total=len(tiles),
+                          desc=f"Computing {n} x {n} HPO similarities"):
+                pass
+        output.flush()
+        del output
+
+        tmp_meta = paths["meta"].with_suffix(".json.tmp")
+        with open(tmp_meta, "w") as f:
+            json.dump({"count": n, "dtype": "float16", "fingerprint": store.fingerprint, "ids": list(store.ids)}, f)
+        os.replace(tmp_matrix, paths["matrix"])
+        os.replace(tmp_meta, paths["meta"])
+        logger.info(f"Saved {n} x {n} HPO similarity matrix to {paths['matrix']}")
+        return cls.load(directory, name)
@@ -0,0 +1,40 @@
+"""
+Phenopacket helpers.
+
+Reads the observed phenotypes of every phenopacket in a directory, mapping
+obsolete HPO ids to their replacements, as all Elder runners do.
+"""
+
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from pheval.utils.file_utils import all_files
+from pheval.utils.phenopacket_utils import PhenopacketUtil, phenopacket_reader
+
+from pheval_elder.prepare.core.utils.obsolete_hp_mapping import update_hpo_id
+
+
+def read_phenotype_sets(
+        phenopackets_dir: Union[str, Path],
+        limit: Optional[int] = None
+) -> Tuple[List[str], List[List[str]]]:
+    """
+    Read the observed phenotype sets of all phenopackets in a directory.
+
+    Args:
+        phenopackets_dir: Directory containing phenopacket JSON files
+        limit: Maximum number of phenopackets to read (all if None)
+
+    Returns:
+        Tuple of (file names, phenotype sets), in directory order
+    """
+    file_names = []
+    phenotype_sets = []
+    for file_path in all_files(Path(phenopackets_dir)):
+        if limit is not None and len(file_names) >= limit:
+            break
+        phenopacket_util = PhenopacketUtil(phenopacket_reader(file_path))
+        observed_phenotypes = phenopacket_util.observed_phenotypic_features()
+        file_names.append(file_path.name)
+        phenotype_sets.append([update_hpo_id(phenotype.type.id) for phenotype in observed_phenotypes])
+    return file_names, phenotype_sets
@@ -18,6 +18,12 @@ class CosineSimilarity(SimilarityService):
         return dot_product / (norm_a * norm_b)
 
 
+class NormalizedCosineSimilarity(SimilarityService):
+    """Cosine similarity of vectors that are already L2-normalised (e.g. HPEmbeddingStore.unit rows)."""
+    def calculate_similarity(self, vector_a: List[float], vector_b: List[float]) -> float:
+        return float(np.dot(vector_a, vector_b))
+
+
 class L2Distance(SimilarityService):
     def calculate_similarity(self, vector_a: List[float], vector_b: List[float]) -> float:
         # Implement L2 distance calculation
@@ -0,0 +1,103 @@
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import chromadb
+import numpy as np
+
+from pheval_elder.prepare.core.collections.disease_embedding_builder import DiseaseEmbeddingBuilder
+from pheval_elder.prepare.core.multiprocessing.shared_data import CollectionHandle
+from pheval_elder.prepare.core.query.async_query import AsyncQueryExecutor, async_query_analysis
+from pheval_elder.prepare.core.query.exact_search import average_query_embeddings
+from pheval_elder.prepare.core.query.ranked_results import DiseaseTable
+from pheval_elder.prepare.core.store.chromadb_manager import ChromaDBManager
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+class TestChromaServerQueries(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.port = _free_port()
+        cls.server = subprocess.Popen(
+            [sys.executable, "-m", "chromadb.cli.cli", "run", "--path", cls.tmp.name, "--port", str(cls.port)],
+            cwd=cls.tmp.name,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.time() + 60
+        while True:
+            try:
+                cls.client = chromadb.HttpClient(host="localhost", port=cls.port)
+                cls.client.heartbeat()
+                break
+            except Exception:
+                if time.time() > deadline or cls.server.poll() is not None:
+                    cls.tearDownClass()
+                    raise unittest.SkipTest("Chroma server could not be started")
+                time.sleep(0.5)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.wait()
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        rng = np.random.default_rng(17)
+        self.store = HPEmbeddingStore.from_embeddings_dict({
+            f"HP:{i:07d}": {"label": f"term {i}", "embeddings": rng.normal(size=8).tolist()} for i in range(30)
+        })
+        disease_to_hps = {
+            f"OMIM:{d}": {"disease_name": f"disease {d}",
+                          "phenotypes": [f"HP:{i:07d}" for i in rng.choice(30, size=3, replace=False)]}
+            for d in range(50)
+        }
+        self.table = DiseaseTable.from_disease_to_hps(disease_to_hps)
+        diseases = DiseaseEmbeddingBuilder(self.store).average(disease_to_hps)
+        self.collection = self.client.get_or_create_collection(
+            "server_query_test", metadata={"hnsw:space": "cosine"}
+        )
+        self.collection.upsert(ids=list(diseases.disease_ids), embeddings=diseases.matrix.tolist())
+        self.phenotype_sets = [
+            [f"HP:{i:07d}" for i in rng.choice(30, size=4, replace=False)] for _ in range(9)
+        ]
+        self.phenotype_sets.insert(4, ["HP:9999999"])
+
+    def test_results_keep_phenopacket_order(self):
+        executor = AsyncQueryExecutor(
+            host="localhost", port=self.port, collection_name=self.collection.name,
+            max_in_flight=2, query_batch_size=2,
+        )
+        results = async_query_analysis(executor, self.store, self.phenotype_sets, 5, self.table)
+        self.assertEqual(len(results), len(self.phenotype_sets))
+        self.assertEqual(len(results[4]), 0)
+
+        positions, queries = average_query_embeddings(self.store, self.phenotype_sets)
+        for position, query in zip(positions, queries):
+            expected = self.collection.query(query_embeddings=[query.tolist()], n_results=5)
+            self.assertEqual([self.table.disease_ids[row] for row in results[position].rows], expected["ids"][0])
+            np.testing.assert_allclose(results[position].scores, expected["distances"][0], atol=1e-5)
+
+    def test_manager_and_worker_handles_use_the_server(self):
+        self.client.get_or_create_collection("hp_server_test")
+        manager = ChromaDBManager(
+            collection_name="hp_server_test", path=self.tmp.name, host="localhost", port=self.port
+        )
+        self.assertTrue(manager.is_remote)
+        self.assertEqual(manager.ont_hp.name, "hp_server_test")
+        handle = CollectionHandle(path=self.tmp.name, name=self.collection.name, host="localhost", port=self.port)
+        self.assertEqual(handle.open().count(), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import tempfile
+import unittest
+
+import chromadb
+import numpy as np
+
+from pheval_elder.prepare.core.collections.disease_embedding_builder import DiseaseEmbeddingBuilder
+from pheval_elder.prepare.core.multiprocessing.avg_multiprocessing import (
+    calculate_average_embedding,
+    query_collection_batched,
+    ranked_results_from_query,
+)
+from pheval_elder.prepare.core.multiprocessing.shared_data import SharedDataPlane, attach_shared_data
+from pheval_elder.prepare.core.query.ranked_results import DiseaseTable
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore
+
+
+class CountingCollection:
+    """Wraps a Chroma collection and records the number of query embeddings per call."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.calls = []
+
+    def query(self, **kwargs):
+        self.calls.append(len(kwargs["query_embeddings"]))
+        return self.collection.query(**kwargs)
+
+
+class TestBatchedCollectionQueries(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(5)
+        self.store = HPEmbeddingStore.from_embeddings_dict({
+            f"HP:{i:07d}": {"label": f"term {i}", "embeddings": rng.normal(size=8).tolist()} for i in range(30)
+        })
+        disease_to_hps = {
+            f"OMIM:{d}": {"disease_name": f"disease {d}",
+                          "phenotypes": [f"HP:{i:07d}" for i in rng.choice(30, size=3, replace=False)]}
+            for d in range(40)
+        }
+        self.table = DiseaseTable.from_disease_to_hps(disease_to_hps)
+        diseases = DiseaseEmbeddingBuilder(self.store).average(disease_to_hps)
+        self.collection = chromadb.PersistentClient(path=self.tmp.name).create_collection(
+            "batched_query_test", metadata={"hnsw:space": "cosine"}
+        )
+        self.collection.add(
+            ids=list(diseases.disease_ids),
+            embeddings=diseases.matrix.tolist(),
+            metadatas=[{"disease_name": name} for name in diseases.disease_names],
+        )
+        self.batch = [
+            (10 + n, [f"HP:{i:07d}" for i in rng.choice(30, size=4, replace=False)]) for n in range(5)
+        ]
+        self.batch.insert(2, (99, ["HP:9999999"]))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_batched_queries_match_single_queries(self):
+        counting = CountingCollection(self.collection)
+        with SharedDataPlane(self.tmp.name) as plane:
+            plane.publish_store(self.store)
+            attach_shared_data(*plane.initargs())
+            results = query_collection_batched(counting, self.table, self.batch, n_results=5, query_batch_size=2)
+
+        self.assertEqual(counting.calls, [2, 2, 1])
+        self.assertEqual([orig_idx for orig_idx, _ in results], [orig_idx for orig_idx, _ in self.batch])
+        self.assertEqual(results[2][0], 99)
+        self.assertEqual(len(results[2][1]), 0)
+        hp_embeddings = self.store.as_dict()
+        for orig_idx, phenotype_set in self.batch:
+            if orig_idx == 99:
+                continue
+            single = ranked_results_from_query(self.collection.query(
+                query_embeddings=[calculate_average_embedding(phenotype_set, hp_embeddings).tolist()],
+                n_results=5,
+            ), self.table)
+            batched = dict(results)[orig_idx]
+            self.assertEqual(batched.rows.tolist(), single.rows.tolist())
+            np.testing.assert_allclose(batched.scores, single.scores, atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
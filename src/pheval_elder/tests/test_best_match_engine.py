@@ -0,0 +1,202 @@
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from pheval_elder.prepare.core.multiprocessing.best_match_multiprocessing import (
+    OptimizedTermSetPairwiseComparison,
+    process_phenotype_sets_parallel,
+)
+from pheval_elder.prepare.core.query.best_match_engine import BestMatchEngine, BMAAggregation, similarity_tiles
+from pheval_elder.prepare.core.query.multi_process_best_match import OptimizedMultiprocessing
+from pheval_elder.prepare.core.query.ranked_results import DiseaseTable
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore
+
+
+def naive_bma(similarities, term_rows, disease_indices):
+    """Reference: per-disease loop of the original best-match scorer."""
+    return np.array([
+        np.mean(np.max(similarities[term_rows][:, indices], axis=1)) if len(indices) else -np.inf
+        for indices in disease_indices
+    ], dtype=np.float32)
+
+
+class TestBestMatchEngine(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(21)
+        self.similarities = rng.uniform(-1, 1, size=(25, 40)).astype(np.float32)
+        self.disease_indices = [np.sort(rng.choice(40, size=rng.integers(1, 6), replace=False)) for _ in range(30)]
+        self.disease_indices[7] = np.zeros(0, dtype=np.int64)
+        self.term_sets = [rng.choice(25, size=rng.integers(1, 6)) for _ in range(11)]
+        self.term_sets[4] = np.zeros(0, dtype=np.int64)
+        self.term_sets[5] = np.array([3, 3, 9])
+
+    def test_scores_match_per_disease_loop(self):
+        # tiny blocks and chunks exercise the blocked reductions
+        for engine in (
+                BestMatchEngine.from_disease_indices(self.disease_indices),
+                BestMatchEngine.from_disease_indices(self.disease_indices, max_block_bytes=1, set_chunk_size=3),
+        ):
+            scores = engine.score_sets(self.similarities, self.term_sets)
+            for term_rows, row in zip(self.term_sets, scores):
+                if len(term_rows) == 0:
+                    self.assertTrue(np.all(np.isneginf(row)))
+                    continue
+                np.testing.assert_allclose(row, naive_bma(self.similarities, term_rows, self.disease_indices),
+                                           atol=1e-6)
+
+            top = engine.top_k(self.similarities, self.term_sets, 5)
+            self.assertEqual(len(top), len(self.term_sets))
+            self.assertEqual(len(top[4][0]), 0)
+            expected = naive_bma(self.similarities, self.term_sets[0], self.disease_indices)
+            self.assertEqual(top[0][0].tolist(), np.argsort(-expected, kind="stable")[:5].tolist())
+            all_diseases = engine.top_k(self.similarities, self.term_sets[:1], 100)[0][0]
+            self.assertNotIn(7, all_diseases.tolist())
+            self.assertEqual(len(all_diseases), 29)
+
+    def test_aggregations_match_per_disease_loops(self):
+        rng = np.random.default_rng(25)
+        weights = [rng.uniform(0.05, 1, size=len(indices)).astype(np.float32) for indices in self.disease_indices]
+
+        def reference(aggregation, term_rows):
+            scores = []
+            for indices, disease_weights in zip(self.disease_indices, weights):
+                if len(indices) == 0:
+                    scores.append(-np.inf)
+                    continue
+                block = self.similarities[term_rows][:, indices]
+                if aggregation == BMAAggregation.MAX:
+                    scores.append(block.max())
+                elif aggregation == BMAAggregation.SYMMETRIC:
+                    scores.append((block.max(axis=1).mean() + block.max(axis=0).mean()) / 2)
+                elif aggregation == BMAAggregation.WEIGHTED:
+                    scores.append((block * disease_weights).max(axis=1).mean())
+                else:
+                    scores.append(block.max(axis=1).mean())
+            return np.array(scores, dtype=np.float32)
+
+        aggregations = list(BMAAggregation)
+        for engine in (
+                BestMatchEngine.from_disease_indices(self.disease_indices, weights),
+                BestMatchEngine.from_disease_indices(self.disease_indices, weights, max_block_bytes=1,
+                                                     set_chunk_size=3),
+        ):
+            scores = engine.score_aggregations(self.similarities, self.term_sets, aggregations)
+            self.assertEqual(list(scores), aggregations)
+            for aggregation in aggregations:
+                for term_rows, row in zip(self.term_sets, scores[aggregation]):
+                    if len(term_rows) == 0:
+                        self.assertTrue(np.all(np.isneginf(row)))
+                        continue
+                    np.testing.assert_allclose(row, reference(aggregation, term_rows), atol=1e-6)
+
+            top = engine.top_k_aggregations(self.similarities, self.term_sets, 4, ["max", "symmetric"])
+            expected = reference(BMAAggregation.SYMMETRIC, self.term_sets[1])
+            np.testing.assert_allclose(top[BMAAggregation.SYMMETRIC][1][1], np.sort(expected)[::-1][:4], atol=1e-6)
+            self.assertEqual(len(top[BMAAggregation.MAX]), len(self.term_sets))
+
+        with self.assertRaises(ValueError):
+            BestMatchEngine.from_disease_indices(self.disease_indices).score_aggregations(
+                self.similarities, self.term_sets, [BMAAggregation.WEIGHTED]
+            )
+
+    def test_similarity_tiles_respect_the_term_limit(self):
+        rng = np.random.default_rng(4)
+        store = HPEmbeddingStore.from_embeddings_dict({
+            f"HP:{i:07d}": {"label": f"term {i}", "embeddings": rng.normal(size=8).tolist()} for i in range(20)
+        })
+        disease_units = store.unit_vectors([f"HP:{i:07d}" for i in range(10)])
+        phenotype_sets = [[f"HP:{i:07d}" for i in rng.choice(20, size=3, replace=False)] for _ in range(9)]
+        phenotype_sets[2] = ["HP:9999999"]
+        phenotype_sets[6] = [f"HP:{i:07d}" for i in range(8)]
+
+        positions = []
+        for tile_positions, term_sets, tile in similarity_tiles(store, disease_units, phenotype_sets, 6):
+            self.assertEqual(tile.dtype, np.float32)
+            self.assertTrue(len(tile) <= 6 or len(tile_positions) == 1)
+            for position, term_rows in zip(tile_positions, term_sets):
+                terms = [hp for hp in phenotype_sets[position] if hp in store]
+                np.testing.assert_allclose(tile[term_rows], store.unit_vectors(terms) @ disease_units.T, atol=1e-6)
+            positions.extend(tile_positions)
+        self.assertEqual(positions, list(range(len(phenotype_sets))))
+
+    def test_parallel_best_match_uses_engine_scores(self):
+        rng = np.random.default_rng(3)
+        store = HPEmbeddingStore.from_embeddings_dict({
+            f"HP:{i:07d}": {"label": f"term {i}", "embeddings": rng.normal(size=8).tolist()} for i in range(30)
+        })
+        disease_to_hps = {
+            f"OMIM:{d}": {"disease_name": f"disease {d}",
+                          "phenotypes": [f"HP:{i:07d}" for i in rng.choice(30, size=4, replace=False)]}
+            for d in range(20)
+        }
+        data_processor = SimpleNamespace(
+            hp_embedding_store=store, hp_embeddings=store.as_dict(), disease_to_hps=disease_to_hps,
+            disease_table=DiseaseTable.from_disease_to_hps(disease_to_hps),
+        )
+        phenotype_sets = [[f"HP:{i:07d}" for i in rng.choice(30, size=3, replace=False)] for _ in range(5)]
+        tcp = OptimizedTermSetPairwiseComparison(data_processor)
+        tcp.precompute_similarities(phenotype_sets)
+        results = process_phenotype_sets_parallel(phenotype_sets, tcp, 3)
+        # a budget of one term per tile forces one tile per phenotype set
+        tiled = OptimizedTermSetPairwiseComparison(data_processor, memory_budget_bytes=1)
+        tiled.precompute_similarities(phenotype_sets)
+        self.assertIsNone(tiled.all_similarities)
+        tiled_results = process_phenotype_sets_parallel(phenotype_sets, tiled, 3)
+
+        for phenotype_set, ranked, tiled_ranked in zip(phenotype_sets, results, tiled_results):
+            self.assertEqual(tiled_ranked.rows.tolist(), ranked.rows.tolist())
+            np.testing.assert_allclose(tiled_ranked.scores, ranked.scores, atol=1e-6)
+            query = store.unit_vectors(phenotype_set)
+            expected = {
+                disease_id: float(np.mean(np.max(query @ store.unit_vectors(data["phenotypes"]).T, axis=1)))
+                for disease_id, data in disease_to_hps.items()
+            }
+            best = sorted(expected, key=expected.get, reverse=True)[:3]
+            self.assertEqual([data_processor.disease_table.disease_ids[row] for row in ranked.rows], best)
+            np.testing.assert_allclose(ranked.scores, [expected[d] for d in best], atol=1e-5)
+
+    def test_multi_process_best_match_counts_distinct_terms(self):
+        rng = np.random.default_rng(24)
+        store = HPEmbeddingStore.from_embeddings_dict({
+            f"HP:{i:07d}": {"label": f"term {i}", "embeddings": rng.normal(size=8).tolist()} for i in range(30)
+        })
+        disease_to_hps = {
+            f"OMIM:{d}": {"disease_name": f"disease {d}",
+                          "phenotypes": [f"HP:{i:07d}" for i in rng.choice(30, size=4, replace=False)]}
+            for d in range(20)
+        }
+        disease_to_hps["OMIM:99"] = {"disease_name": "unembedded", "phenotypes": ["HP:9999999"]}
+        data_processor = SimpleNamespace(
+            hp_embedding_store=store, disease_to_hps=disease_to_hps,
+            disease_table=DiseaseTable.from_disease_to_hps(disease_to_hps),
+        )
+        phenotype_sets = [[f"HP:{i:07d}" for i in rng.choice(30, size=3, replace=False)] for _ in range(6)]
+        phenotype_sets[2] = phenotype_sets[2] + [phenotype_sets[2][0], "HP:9999999"]
+        phenotype_sets[4] = ["HP:9999999"]
+
+        tcp = OptimizedMultiprocessing(data_processor, n_processes=2, chunk_rows=4)
+        similarities = tcp.precompute_all_needed_similarities(phenotype_sets)
+        disease_terms = {hp for data in disease_to_hps.values() for hp in data["phenotypes"] if hp in store}
+        input_terms = {hp for phenotype_set in phenotype_sets for hp in phenotype_set if hp in store}
+        self.assertEqual(similarities.shape, (len(input_terms), len(disease_terms)))
+        results = tcp.process_all_sets(phenotype_sets, 5)
+
+        self.assertEqual(len(results[4]), 0)
+        for phenotype_set, ranked in zip(phenotype_sets, results):
+            terms = [hp for hp in dict.fromkeys(phenotype_set) if hp in store]
+            if not terms:
+                continue
+            query = store.unit_vectors(terms)
+            expected = {
+                disease_id: float(np.mean(np.max(query @ store.unit_vectors(data["phenotypes"]).T, axis=1)))
+                for disease_id, data in disease_to_hps.items() if disease_id != "OMIM:99"
+            }
+            # diseases sharing their best phenotypes tie, so compare the scores of the returned diseases
+            ranked_ids = [data_processor.disease_table.disease_ids[row] for row in ranked.rows]
+            np.testing.assert_allclose(ranked.scores, [expected[d] for d in ranked_ids], atol=1e-5)
+            np.testing.assert_allclose(ranked.scores, sorted(expected.values(), reverse=True)[:5], atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+
+from pheval_elder.prepare.core.collections.disease_embedding_builder import DiseaseEmbeddingBuilder
+from pheval_elder.prepare.core.data_processing.data_processor import DataProcessor
+from pheval_elder.prepare.core.store.embedding_store import EmbeddingPrecision, HPEmbeddingStore
+
+
+class TestDiseaseEmbeddingBuilder(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(4)
+        self.embeddings_dict = {
+            f"HP:{i:07d}": {"label": f"term {i}", "embeddings": rng.normal(size=6).tolist()} for i in range(12)
+        }
+        self.store = HPEmbeddingStore.from_embeddings_dict(self.embeddings_dict)
+        self.disease_to_hps = {
+            "OMIM:1": {"disease_name": "one", "phenotypes": ["HP:0000001", "HP:0000002", "HP:0000003"]},
+            "OMIM:2": {"disease_name": "two", "phenotypes": ["HP:0000004", "HP:9999999", "HP:0000004"]},
+            "OMIM:3": {"disease_name": "three", "phenotypes": ["HP:9999999"]},
+        }
+        self.disease_to_hps_with_frequencies = {
+            "OMIM:1": {"disease_name": "one",
+                       "phenotypes_and_frequencies": {"HP:0000001": 0.8, "HP:0000005": 0.2, "HP:0000006": 0.0}},
+            "OMIM:2": {"disease_name": "two", "phenotypes_and_frequencies": {"HP:0000007": 0.0}},
+        }
+
+    def test_average_matches_per_disease_loop(self):
+        result = DiseaseEmbeddingBuilder(self.store).average(self.disease_to_hps)
+        self.assertEqual(list(result.disease_ids), ["OMIM:1", "OMIM:2"])
+        self.assertEqual(list(result.disease_names), ["one", "two"])
+        self.assertEqual(result.matrix.shape, (2, 6))
+        self.assertEqual(result.matrix.dtype, np.float32)
+        for row, disease_id in enumerate(result.disease_ids):
+            expected = DataProcessor.calculate_average_embedding(
+                self.disease_to_hps[disease_id]["phenotypes"], self.embeddings_dict
+            )
+            np.testing.assert_allclose(result.matrix[row], expected, atol=1e-5)
+
+    def test_weighted_average_matches_per_disease_loop(self):
+        result = DiseaseEmbeddingBuilder(self.store).weighted_average(self.disease_to_hps_with_frequencies)
+        self.assertEqual(list(result.disease_ids), ["OMIM:1"])
+        expected = DataProcessor.calculate_average_embedding_weighted(
+            self.disease_to_hps_with_frequencies["OMIM:1"]["phenotypes_and_frequencies"], self.embeddings_dict
+        )
+        np.testing.assert_allclose(result.matrix[0], expected, atol=1e-5)
+
+    def test_reduced_precision_store(self):
+        float32 = DiseaseEmbeddingBuilder(self.store).average(self.disease_to_hps)
+        int8 = DiseaseEmbeddingBuilder(self.store.with_precision(EmbeddingPrecision.INT8)).average(self.disease_to_hps)
+        np.testing.assert_allclose(int8.matrix, float32.matrix, atol=0.05)
+
+    def test_batches(self):
+        result = DiseaseEmbeddingBuilder(self.store).average(self.disease_to_hps)
+        batches = list(result.batches(1))
+        self.assertEqual([list(ids) for ids, _, _ in batches], [["OMIM:1"], ["OMIM:2"]])
+        np.testing.assert_array_equal(batches[1][2], result.matrix[1:2])
+
+
+if __name__ == '__main__':
+    unittest.main()
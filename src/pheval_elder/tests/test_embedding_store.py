@@ -0,0 +1,238 @@
+import json
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from pheval_elder.prepare.core.data_processing.data_processor import DataProcessor
+from pheval_elder.post_process.precision_report import precision_accuracy_report
+from pheval_elder.prepare.core.query.termsetpairwise import TermSetPairWiseComparisonQuery
+from pheval_elder.prepare.core.store.chromadb_manager import ChromaDBManager
+from pheval_elder.prepare.core.store.embedding_store import (
+    EmbeddingPrecision,
+    HPEmbeddingStore,
+    dequantize_matrix,
+    list_stores,
+    purge_stores,
+    quantize_matrix,
+)
+from pheval_elder.prepare.core.utils.similarity_measures import SimilarityMeasures
+
+
+class FakeCollection:
+    """Minimal stand-in for a Chroma collection holding curateGPT-style metadata."""
+
+    name = "fake_hpo_embeddings"
+
+    def __init__(self, entries, model="fake-model"):
+        self.entries = entries
+        self.metadata = {"_venomx": json.dumps({"embedding_model": {"name": model}})}
+        self.get_calls = []
+
+    def count(self):
+        return len(self.entries)
+
+    def get(self, include=None, limit=None, offset=None, ids=None, where=None):
+        self.get_calls.append((include, limit, offset))
+        entries = self.entries[offset or 0:]
+        if limit is not None:
+            entries = entries[:limit]
+        return {
+            "ids": [e[0] for e in entries],
+            "metadatas": [{"_json": json.dumps({"original_id": e[0], "label": e[1]})} for e in entries],
+            "embeddings": np.array([e[2] for e in entries]),
+        }
+
+
+class TestHPEmbeddingStore(unittest.TestCase):
+    def setUp(self):
+        self.embeddings_dict = {
+            "HP:0000001": {"label": "All", "embeddings": [1.0, 0.0, 0.0]},
+            "HP:0000002": {"label": "Two", "embeddings": [0.0, 2.0, 0.0]},
+            "HP:0000003": {"label": "Three", "embeddings": [0.0, 0.0, 3.0]},
+        }
+        self.store = HPEmbeddingStore.from_embeddings_dict(self.embeddings_dict)
+
+    def test_matrix_is_contiguous_float32(self):
+        self.assertEqual(self.store.matrix.dtype, np.float32)
+        self.assertEqual(self.store.matrix.shape, (3, 3))
+        self.assertEqual(self.store.index["HP:0000002"], 1)
+
+    def test_rows_are_normalized_with_norms(self):
+        self.assertTrue(self.store.normalized)
+        np.testing.assert_allclose(np.linalg.norm(self.store.matrix, axis=1), 1.0)
+        np.testing.assert_allclose(self.store.norms, [1.0, 2.0, 3.0])
+        np.testing.assert_array_equal(self.store.unit_vectors(["HP:0000002"]), [[0.0, 1.0, 0.0]])
+
+    def test_similarities_match_brute_force(self):
+        rng = np.random.default_rng(2)
+        raw = rng.normal(size=(6, 5)).astype(np.float32)
+        store = HPEmbeddingStore(ids=list("abcdef"), labels=list("abcdef"), matrix=raw).normalize()
+        rows_a, rows_b = np.array([0, 1, 2]), np.array([3, 4, 5])
+        a, b = raw[rows_a], raw[rows_b]
+        cosine = a @ b.T / np.outer(np.linalg.norm(a, axis=1), np.linalg.norm(b, axis=1))
+        np.testing.assert_allclose(store.similarities(rows_a, rows_b), cosine, atol=1e-5)
+        np.testing.assert_allclose(store.similarities(rows_a, rows_b, SimilarityMeasures.IP), a @ b.T, atol=1e-4)
+        l2 = ((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2)
+        np.testing.assert_allclose(store.similarities(rows_a, rows_b, SimilarityMeasures.L2), l2, atol=1e-4)
+        np.testing.assert_allclose(store.vectors(["b"]), raw[[1]], rtol=1e-5)
+
+    def test_pairwise_query_cosine_on_unit_rows(self):
+        store = HPEmbeddingStore.from_embeddings_dict({
+            "HP:0000001": {"label": "One", "embeddings": [3.0, 4.0]},
+            "HP:0000002": {"label": "Two", "embeddings": [0.0, 2.0]},
+        })
+        data_processor = SimpleNamespace(hp_embedding_store=store, hp_embeddings=store.as_dict(), disease_to_hps={})
+        query = TermSetPairWiseComparisonQuery(data_processor)
+        self.assertAlmostEqual(query.cached_cosine_similarity("HP:0000001", "HP:0000002"), 0.8, places=6)
+
+    def test_vectors_skip_unknown_ids(self):
+        vectors = self.store.vectors(["HP:0000003", "HP:9999999", "HP:0000001"])
+        np.testing.assert_array_equal(vectors, [[0.0, 0.0, 3.0], [1.0, 0.0, 0.0]])
+
+    def test_dict_view_keeps_legacy_api(self):
+        view = self.store.as_dict()
+        self.assertIn("HP:0000002", view)
+        self.assertNotIn("HP:9999999", view)
+        self.assertEqual(view["HP:0000002"]["label"], "Two")
+        np.testing.assert_array_equal(view["HP:0000002"]["embeddings"], [0.0, 2.0, 0.0])
+        self.assertEqual(view.get("HP:9999999", {}).get("embeddings"), None)
+        self.assertEqual(list(view.keys()), list(self.embeddings_dict.keys()))
+
+    def test_save_and_memory_mapped_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.store.save(tmp, "hpo")
+            loaded = HPEmbeddingStore.load(tmp, "hpo")
+            self.assertIsNotNone(loaded)
+            self.assertEqual(loaded.ids, self.store.ids)
+            self.assertEqual(loaded.labels, self.store.labels)
+            np.testing.assert_array_equal(loaded.matrix, self.store.matrix)
+            np.testing.assert_array_equal(loaded.norms, self.store.norms)
+            self.assertFalse(loaded.matrix.flags.writeable)
+
+    def test_load_missing_store_returns_none(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertIsNone(HPEmbeddingStore.load(tmp, "missing"))
+
+    def test_create_store_from_collection(self):
+        collection = FakeCollection([
+            ("HP:0000001", "All", [1.0, 0.0]),
+            ("HP:0000002", "Two", [0.0, 1.0]),
+            ("HP:0000001", "All (updated)", [0.5, 0.5]),
+        ])
+        store = DataProcessor.create_hpo_embedding_store(collection)
+        self.assertEqual(store.ids, ["HP:0000001", "HP:0000002"])
+        self.assertEqual(store.labels, ["All (updated)", "Two"])
+        np.testing.assert_allclose(store.vector("HP:0000001"), [0.5, 0.5], rtol=1e-6)
+
+    def test_paged_loader_matches_single_page(self):
+        rng = np.random.default_rng(0)
+        entries = [(f"HP:{i:07d}", f"term {i}", rng.random(8).tolist()) for i in range(25)]
+        collection = FakeCollection(entries)
+        single = DataProcessor.create_hpo_embedding_store(collection, page_size=100, num_workers=0)
+        paged = DataProcessor.create_hpo_embedding_store(collection, page_size=4, num_workers=2)
+        self.assertEqual(paged.ids, single.ids)
+        self.assertEqual(paged.labels, single.labels)
+        np.testing.assert_array_equal(paged.matrix, single.matrix)
+        self.assertEqual(paged.matrix.dtype, np.float32)
+
+
+class TestEmbeddingSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(3)
+        self.entries = [(f"HP:{i:07d}", f"term {i}", rng.random(4).tolist()) for i in range(200)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _data_processor(self, collection, precision=EmbeddingPrecision.FLOAT32):
+        db_manager = SimpleNamespace(ont_hp=collection, path=self.tmp.name)
+        return DataProcessor(db_manager=db_manager, embedding_precision=precision)
+
+    def test_fingerprint_covers_model_and_sampled_content(self):
+        fingerprint = ChromaDBManager.collection_fingerprint(FakeCollection(self.entries))
+        self.assertEqual(fingerprint["count"], 200)
+        self.assertEqual(fingerprint["model"], "fake-model")
+        self.assertEqual(fingerprint, ChromaDBManager.collection_fingerprint(FakeCollection(self.entries)))
+
+        changed = list(self.entries)
+        changed[-1] = (changed[-1][0], changed[-1][1], [0.0, 0.0, 0.0, 1.0])
+        self.assertNotEqual(fingerprint, ChromaDBManager.collection_fingerprint(FakeCollection(changed)))
+        other_model = ChromaDBManager.collection_fingerprint(FakeCollection(self.entries, model="other"))
+        self.assertNotEqual(fingerprint, other_model)
+
+    def test_second_run_loads_snapshot_without_full_read(self):
+        first = self._data_processor(FakeCollection(self.entries)).load_or_create_hpo_embedding_store()
+        collection = FakeCollection(self.entries)
+        second = self._data_processor(collection).load_or_create_hpo_embedding_store()
+        self.assertTrue(all(call[0] == ["embeddings"] for call in collection.get_calls))
+        self.assertEqual(second.ids, first.ids)
+        self.assertIsNotNone(second.path)
+        np.testing.assert_array_equal(second.matrix, first.matrix)
+
+    def test_changed_collection_rebuilds_snapshot(self):
+        self._data_processor(FakeCollection(self.entries)).load_or_create_hpo_embedding_store()
+        collection = FakeCollection(self.entries + [("HP:9999999", "new", [1.0, 0.0, 0.0, 0.0])])
+        store = self._data_processor(collection).load_or_create_hpo_embedding_store()
+        self.assertIn("HP:9999999", store)
+        self.assertTrue(any("metadatas" in (call[0] or []) for call in collection.get_calls))
+
+    def test_list_and_purge_snapshots(self):
+        self._data_processor(FakeCollection(self.entries), EmbeddingPrecision.INT8).load_or_create_hpo_embedding_store()
+        directory = self._data_processor(FakeCollection(self.entries)).embedding_store_dir
+        stores = list_stores(directory)
+        self.assertEqual(sorted(s["precision"] for s in stores), ["float32", "int8"])
+        self.assertTrue(all(s["name"] == FakeCollection.name and s["count"] == 200 for s in stores))
+        self.assertEqual(purge_stores(directory, name="other_collection"), [])
+        deleted = purge_stores(directory)
+        self.assertTrue(deleted)
+        self.assertEqual(list_stores(directory), [])
+
+
+class TestReducedPrecision(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.matrix = rng.normal(size=(20, 16)).astype(np.float32)
+        self.store = HPEmbeddingStore(
+            ids=[f"HP:{i:07d}" for i in range(20)],
+            labels=[f"term {i}" for i in range(20)],
+            matrix=self.matrix,
+        )
+
+    def test_quantize_round_trip(self):
+        for precision, tolerance in [("float32", 0), ("float16", 1e-2), ("int8", 2e-2)]:
+            data, scales = quantize_matrix(self.matrix, EmbeddingPrecision(precision))
+            self.assertEqual(data.dtype, np.dtype(precision))
+            restored = dequantize_matrix(data, scales)
+            self.assertEqual(restored.dtype, np.float32)
+            np.testing.assert_allclose(restored, self.matrix, atol=tolerance * np.abs(self.matrix).max())
+
+    def test_int8_store_save_and_load(self):
+        int8_store = self.store.with_precision(EmbeddingPrecision.INT8)
+        self.assertEqual(int8_store.matrix.dtype, np.int8)
+        self.assertLess(int8_store.nbytes, self.store.nbytes)
+        with tempfile.TemporaryDirectory() as tmp:
+            int8_store.save(tmp, "hpo")
+            self.assertIsNone(HPEmbeddingStore.load(tmp, "hpo"))
+            loaded = HPEmbeddingStore.load(tmp, "hpo", precision=EmbeddingPrecision.INT8)
+            np.testing.assert_array_equal(loaded.matrix, int8_store.matrix)
+            np.testing.assert_array_equal(loaded.vector("HP:0000003"), int8_store.vector("HP:0000003"))
+
+    def test_precision_accuracy_report(self):
+        disease_to_hps = {
+            f"OMIM:{i}": {"phenotypes": [f"HP:{j:07d}" for j in range(i, i + 4)]} for i in range(16)
+        }
+        phenotype_sets = [[f"HP:{j:07d}" for j in range(i, i + 3)] for i in range(16)]
+        report = precision_accuracy_report(self.store, disease_to_hps, phenotype_sets, k=5)
+        self.assertEqual([row.precision for row in report], ["float32", "float16", "int8"])
+        float32_row = report[0]
+        self.assertEqual(float32_row.top1_agreement, 1.0)
+        self.assertEqual(float32_row.recall_at_k, 1.0)
+        self.assertLess(float32_row.max_score_error, 1e-5)
+        self.assertLess(report[2].hpo_store_mb, report[0].hpo_store_mb)
+
+
+if __name__ == '__main__':
+    unittest.main()
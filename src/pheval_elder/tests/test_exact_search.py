@@ -0,0 +1,127 @@
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import chromadb
+import numpy as np
+
+from pheval_elder.prepare.core.collections.disease_embedding_builder import DiseaseEmbeddingBuilder
+from pheval_elder.prepare.core.data_processing.data_processor import DataProcessor
+from pheval_elder.prepare.core.multiprocessing.avg_multiprocessing import calculate_average_embedding
+from pheval_elder.prepare.core.query.exact_search import (
+    ExactDiseaseSearch,
+    average_query_embeddings,
+    exact_search_analysis,
+)
+from pheval_elder.prepare.core.query.query_service import QueryService
+from pheval_elder.prepare.core.query.ranked_results import DiseaseTable
+from pheval_elder.prepare.core.store.chromadb_manager import ChromaDBManager
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore
+from pheval_elder.prepare.core.utils.similarity_measures import SimilarityMeasures
+
+
+class TestExactDiseaseSearch(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(11)
+        self.store = HPEmbeddingStore.from_embeddings_dict({
+            f"HP:{i:07d}": {"label": f"term {i}", "embeddings": rng.normal(size=8).tolist()} for i in range(40)
+        })
+        self.disease_to_hps = {
+            f"OMIM:{d}": {
+                "disease_name": f"disease {d}",
+                "phenotypes": [f"HP:{i:07d}" for i in rng.choice(40, size=4, replace=False)],
+            }
+            for d in range(60)
+        }
+        self.disease_embeddings = DiseaseEmbeddingBuilder(self.store).average(self.disease_to_hps)
+        self.phenotype_sets = [
+            [f"HP:{i:07d}" for i in rng.choice(40, size=3, replace=False)] for _ in range(7)
+        ] + [["HP:9999999"]]
+
+    def test_matches_chroma_distances(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            collection = chromadb.PersistentClient(path=tmp).create_collection(
+                "exact_search_test", metadata={"hnsw:space": "cosine"}
+            )
+            collection.add(
+                ids=list(self.disease_embeddings.disease_ids),
+                embeddings=self.disease_embeddings.matrix.tolist(),
+                metadatas=[{"disease_name": name} for name in self.disease_embeddings.disease_names],
+            )
+            search = ExactDiseaseSearch.from_collection(collection, page_size=25)
+            hp_embeddings = self.store.as_dict()
+            for phenotype_set in self.phenotype_sets[:3]:
+                query = calculate_average_embedding(phenotype_set, hp_embeddings)
+                expected = collection.query(query_embeddings=[query.tolist()], n_results=5)
+                indices, distances = search.search(query[None, :], 5)
+                self.assertEqual(list(search.disease_ids[indices[0]]), expected["ids"][0])
+                np.testing.assert_allclose(distances[0], expected["distances"][0], atol=1e-5)
+
+    def test_top_k_matches_full_sort(self):
+        for similarity in SimilarityMeasures:
+            search = ExactDiseaseSearch.from_disease_embeddings(self.disease_embeddings, similarity)
+            _, queries = average_query_embeddings(self.store, self.phenotype_sets)
+            indices, distances = search.search(queries, 10, chunk_size=3)
+            full = search.distances(queries)
+            np.testing.assert_allclose(distances, np.sort(full, axis=1)[:, :10], atol=1e-6)
+            np.testing.assert_allclose(np.take_along_axis(full, indices, axis=1), distances, atol=1e-6)
+
+    def test_analysis_keeps_positions(self):
+        search = ExactDiseaseSearch.from_disease_embeddings(self.disease_embeddings)
+        table = DiseaseTable.from_disease_to_hps(dict(reversed(self.disease_to_hps.items())))
+        results = exact_search_analysis(search, self.store, self.phenotype_sets, nr_of_results=100, table=table)
+        self.assertEqual(len(results), len(self.phenotype_sets))
+        self.assertEqual(len(results[-1]), 0)
+        self.assertEqual(len(results[0]), len(self.disease_embeddings))
+        scores = results[0].scores.tolist()
+        self.assertEqual(scores, sorted(scores))
+        indices, _ = search.search(average_query_embeddings(self.store, self.phenotype_sets[:1])[1], 1)
+        best = results[0].to_pheval_results(table)[0]
+        self.assertEqual(best.disease_identifier, search.disease_ids[indices[0, 0]])
+        self.assertEqual(best.disease_name, search.disease_names[indices[0, 0]])
+
+    def test_rank_all_diseases_in_one_pass(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            collection = chromadb.PersistentClient(path=tmp).create_collection(
+                "rank_all_test", metadata={"hnsw:space": "cosine"}
+            )
+            collection.add(
+                ids=list(self.disease_embeddings.disease_ids),
+                embeddings=self.disease_embeddings.matrix.tolist(),
+                metadatas=[{"disease_name": name} for name in self.disease_embeddings.disease_names],
+            )
+            data_processor = SimpleNamespace(
+                hp_embeddings=self.store.as_dict(),
+                disease_to_hps_with_frequencies={},
+                calculate_average_embedding=DataProcessor.calculate_average_embedding,
+            )
+            query_service = QueryService(
+                data_processor=data_processor,
+                db_manager=SimpleNamespace(similarity=SimilarityMeasures.COSINE),
+                lazy_embeddings=False,
+            )
+            ranking = query_service.rank_all_diseases(self.phenotype_sets[0], collection)
+            self.assertEqual(len(ranking), len(self.disease_embeddings))
+            distances = [distance for _, _, distance in ranking]
+            self.assertEqual(distances, sorted(distances))
+            top = collection.query(
+                query_embeddings=[calculate_average_embedding(self.phenotype_sets[0], self.store.as_dict()).tolist()],
+                n_results=3,
+            )
+            self.assertEqual([disease_id for disease_id, _, _ in ranking[:3]], top["ids"][0])
+
+            search = query_service.exact_search(collection)
+            query_service.rank_all_diseases(self.phenotype_sets[1], collection)
+            self.assertIs(query_service.exact_search(collection), search)
+
+            # a rebuild with the same row count is picked up through the build hash
+            ChromaDBManager.merge_collection_metadata(collection, elder_build_hash="rebuilt")
+            rebuilt = query_service.exact_search(collection)
+            self.assertIsNot(rebuilt, search)
+            self.assertIs(query_service.exact_search(collection), rebuilt)
+            ChromaDBManager.merge_collection_metadata(collection, elder_build_hash="rebuilt again")
+            self.assertIsNot(query_service.exact_search(collection), rebuilt)
+
+
+if __name__ == '__main__':
+    unittest.main()
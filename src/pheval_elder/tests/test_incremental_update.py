@@ -0,0 +1,165 @@
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+import chromadb
+import numpy as np
+
+from pheval_elder.prepare.core.collections.disease_avg_embedding_service import DiseaseAvgEmbeddingService
+from pheval_elder.prepare.core.collections.disease_embedding_builder import DiseaseEmbeddingBuilder
+from pheval_elder.prepare.core.collections.incremental import (
+    BUILD_HASH_KEY,
+    HPOA_VERSION_KEY,
+    DiseaseCollectionManifest,
+    diff_digests,
+    mapping_digests,
+)
+from pheval_elder.prepare.core.data_processing.OMIMHPOExtractor import OMIMHPOExtractor
+from pheval_elder.prepare.core.store.embedding_store import EmbeddingPrecision, HPEmbeddingStore
+
+
+class TestMappingDiff(unittest.TestCase):
+    def test_diff_ignores_phenotype_order(self):
+        previous = mapping_digests({
+            "OMIM:1": {"disease_name": "one", "phenotypes": ["HP:1", "HP:2"]},
+            "OMIM:2": {"disease_name": "two", "phenotypes": ["HP:3"]},
+            "OMIM:3": {"disease_name": "three", "phenotypes": ["HP:4"]},
+        })
+        current = mapping_digests({
+            "OMIM:1": {"disease_name": "one", "phenotypes": ["HP:2", "HP:1"]},
+            "OMIM:2": {"disease_name": "two", "phenotypes": ["HP:3", "HP:5"]},
+            "OMIM:4": {"disease_name": "four", "phenotypes": ["HP:4"]},
+        })
+        diff = diff_digests(previous, current)
+        self.assertEqual(diff.added, ["OMIM:4"])
+        self.assertEqual(diff.changed, ["OMIM:2"])
+        self.assertEqual(diff.removed, ["OMIM:3"])
+        self.assertEqual(diff.upserts, ["OMIM:4", "OMIM:2"])
+
+    def test_frequency_changes_are_detected(self):
+        previous = mapping_digests({"OMIM:1": {"disease_name": "one", "phenotypes_and_frequencies": {"HP:1": 0.5}}})
+        current = mapping_digests({"OMIM:1": {"disease_name": "one", "phenotypes_and_frequencies": {"HP:1": 0.8}}})
+        self.assertEqual(diff_digests(previous, current).changed, ["OMIM:1"])
+        self.assertFalse(diff_digests(previous, previous))
+
+    def test_read_hpoa_version(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "phenotype.hpoa"
+            path.write_text("#description: HPO annotations\n#version: 2024-04-26\ndatabase_id\tdisease_name\n")
+            self.assertEqual(OMIMHPOExtractor.read_hpoa_version(path), "2024-04-26")
+            path.write_text("database_id\tdisease_name\n")
+            self.assertTrue(OMIMHPOExtractor.read_hpoa_version(path).startswith("sha1:"))
+
+
+class TestIncrementalDiseaseCollection(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(9)
+        self.store = HPEmbeddingStore.from_embeddings_dict({
+            f"HP:{i:07d}": {"label": f"term {i}", "embeddings": rng.normal(size=4).tolist()} for i in range(8)
+        })
+        self.store.fingerprint = {"collection": "hp", "count": 8, "model": None, "sample_hash": "abc"}
+        self.client = chromadb.PersistentClient(path=str(Path(self.tmp.name) / "db"))
+        self.collection = self.client.get_or_create_collection(
+            "test_avg_disease_embeddings", metadata={"hnsw:space": "cosine"}
+        )
+        self.disease_to_hps = {
+            "OMIM:1": {"disease_name": "one", "phenotypes": ["HP:0000001", "HP:0000002"]},
+            "OMIM:2": {"disease_name": "two", "phenotypes": ["HP:0000003"]},
+            "OMIM:3": {"disease_name": "three", "phenotypes": ["HP:0000004", "HP:0000005"]},
+        }
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def service(self, disease_to_hps, hpoa_version):
+        data_processor = SimpleNamespace(
+            hp_embeddings=self.store.as_dict(),
+            hp_embedding_store=self.store,
+            disease_to_hps=disease_to_hps,
+            disease_to_hps_with_frequencies={},
+            disease_manifest_dir=Path(self.tmp.name) / "manifests",
+            hpoa_version=hpoa_version,
+            hpoa_hash=f"hash of {hpoa_version}",
+            hp_collection_fingerprint=self.store.fingerprint,
+            hp_dimension=self.store.dimension,
+            embedding_precision=self.store.precision,
+            db_manager=SimpleNamespace(disease_embeddings_collection=lambda strategy: self.collection),
+        )
+        return DiseaseAvgEmbeddingService(data_processor=data_processor)
+
+    def stored_embeddings(self):
+        result = self.collection.get(include=["embeddings"])
+        return dict(zip(result["ids"], np.asarray(result["embeddings"])))
+
+    def test_incremental_update_applies_only_the_delta(self):
+        self.service(self.disease_to_hps, "2024-01-01").process_data(incremental=True)
+        self.assertEqual(sorted(self.stored_embeddings()), ["OMIM:1", "OMIM:2", "OMIM:3"])
+
+        upserted = []
+        new_mapping = {
+            "OMIM:1": self.disease_to_hps["OMIM:1"],
+            "OMIM:2": {"disease_name": "two", "phenotypes": ["HP:0000003", "HP:0000006"]},
+            "OMIM:4": {"disease_name": "four", "phenotypes": ["HP:0000007"]},
+        }
+        service = self.service(new_mapping, "2024-02-01")
+        upsert_batch = service.upsert_batch
+        service.upsert_batch = lambda entries, embeddings: (upserted.extend(e[0] for e in entries),
+                                                            upsert_batch(entries, embeddings))
+        service.process_data(incremental=True)
+
+        self.assertEqual(sorted(upserted), ["OMIM:2", "OMIM:4"])
+        stored = self.stored_embeddings()
+        self.assertEqual(sorted(stored), ["OMIM:1", "OMIM:2", "OMIM:4"])
+        expected = DiseaseEmbeddingBuilder(self.store).average(new_mapping)
+        for disease_id, embedding in zip(expected.disease_ids, expected.matrix):
+            np.testing.assert_allclose(stored[disease_id], embedding, atol=1e-5)
+
+        collection = self.client.get_collection("test_avg_disease_embeddings")
+        self.assertEqual(collection.metadata[HPOA_VERSION_KEY], "2024-02-01")
+        manifest = DiseaseCollectionManifest.load(Path(self.tmp.name) / "manifests", collection.name)
+        self.assertEqual(manifest.hpoa_version, "2024-02-01")
+        self.assertEqual(manifest.digests, mapping_digests(new_mapping))
+
+    def test_changed_hpo_embeddings_trigger_full_rebuild(self):
+        self.service(self.disease_to_hps, "2024-01-01").process_data(incremental=True)
+        self.store.fingerprint = dict(self.store.fingerprint, sample_hash="def")
+        upserted = []
+        service = self.service(self.disease_to_hps, "2024-01-01")
+        service.upsert_batch = lambda entries, embeddings: upserted.extend(e[0] for e in entries)
+        service.process_data(incremental=True)
+        self.assertEqual(sorted(upserted), ["OMIM:1", "OMIM:2", "OMIM:3"])
+
+    def test_changed_precision_triggers_full_rebuild(self):
+        self.service(self.disease_to_hps, "2024-01-01").process_data(incremental=True)
+        build_hash = self.service(self.disease_to_hps, "2024-01-01").build_hash()
+        self.store = self.store.with_precision(EmbeddingPrecision.FLOAT16)
+        upserted = []
+        service = self.service(self.disease_to_hps, "2024-01-01")
+        self.assertNotEqual(service.build_hash(), build_hash)
+        service.upsert_batch = lambda entries, embeddings: upserted.extend(e[0] for e in entries)
+        service.process_data(incremental=True)
+        self.assertEqual(sorted(upserted), ["OMIM:1", "OMIM:2", "OMIM:3"])
+
+    def test_unchanged_build_is_skipped(self):
+        service = self.service(self.disease_to_hps, "2024-01-01")
+        service.process_data()
+        build_hash = self.client.get_collection("test_avg_disease_embeddings").metadata[BUILD_HASH_KEY]
+        self.assertEqual(build_hash, service.build_hash())
+
+        upserted = []
+        service = self.service(self.disease_to_hps, "2024-01-01")
+        service.upsert_batch = lambda entries, embeddings: upserted.extend(e[0] for e in entries)
+        service.process_data()
+        self.assertEqual(upserted, [])
+
+        service = self.service(self.disease_to_hps, "2024-02-01")
+        self.assertNotEqual(service.build_hash(), build_hash)
+        service.upsert_batch = lambda entries, embeddings: upserted.extend(e[0] for e in entries)
+        service.process_data()
+        self.assertEqual(sorted(upserted), ["OMIM:1", "OMIM:2", "OMIM:3"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import chromadb
+import numpy as np
+
+from pheval_elder.post_process.index_sweep import format_index_sweep, index_sweep
+from pheval_elder.prepare.core.collections.disease_embedding_builder import DiseaseEmbeddingBuilder
+from pheval_elder.prepare.core.query.exact_search import SearchBackend, average_query_embeddings
+from pheval_elder.prepare.core.run.elder import ElderRunner
+from pheval_elder.prepare.core.store.chromadb_manager import ChromaDBManager
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore
+from pheval_elder.prepare.core.store.index_profiles import HNSWParams, IndexProfile, hnsw_params
+
+
+class TestIndexProfiles(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        chromadb.PersistentClient(path=self.tmp.name).get_or_create_collection("hp_profile_test")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def manager(self, profile):
+        return ChromaDBManager(
+            collection_name="hp_profile_test", path=self.tmp.name, nr_of_phenopackets="10",
+            nr_of_results=10, index_profile=profile,
+        )
+
+    def test_parse_and_metadata(self):
+        params = HNSWParams.parse("24:300:400")
+        self.assertEqual(params, HNSWParams(M=24, construction_ef=300, search_ef=400))
+        self.assertEqual(params.label, "24:300:400")
+        self.assertEqual(hnsw_params("balanced").metadata("cosine"), {
+            "hnsw:space": "cosine", "hnsw:search_ef": 800, "hnsw:construction_ef": 200, "hnsw:M": 16,
+        })
+        with self.assertRaises(ValueError):
+            HNSWParams.parse("16:200")
+
+    def test_collection_is_recreated_for_another_profile(self):
+        collection = self.manager("balanced").disease_embeddings_collection("avg")
+        collection.add(ids=["OMIM:1"], embeddings=[[0.1, 0.2]])
+        self.assertEqual(self.manager(IndexProfile.BALANCED).disease_embeddings_collection("avg").count(), 1)
+
+        fast = self.manager("fast").disease_embeddings_collection("avg")
+        self.assertEqual(fast.count(), 0)
+        self.assertTrue(hnsw_params(IndexProfile.FAST).matches(fast.metadata))
+
+    def test_cache_label_keeps_profiles_apart(self):
+        def label(backend, profile):
+            runner = SimpleNamespace(search_backend=backend, index_profile=profile, tcp_similarity_matrix=False)
+            return ElderRunner.cache_label(runner, "avg")
+
+        self.assertEqual(label(SearchBackend.CHROMA, IndexProfile.FAST), "avg/chroma/fast")
+        self.assertNotEqual(label(SearchBackend.CHROMA, IndexProfile.FAST),
+                            label(SearchBackend.CHROMA, IndexProfile.EXACT))
+        self.assertEqual(label(SearchBackend.EXACT, IndexProfile.FAST), "avg/exact")
+
+    def test_index_sweep(self):
+        rng = np.random.default_rng(19)
+        store = HPEmbeddingStore.from_embeddings_dict({
+            f"HP:{i:07d}": {"label": f"term {i}", "embeddings": rng.normal(size=8).tolist()} for i in range(30)
+        })
+        disease_to_hps = {
+            f"OMIM:{d}": {"disease_name": f"disease {d}",
+                          "phenotypes": [f"HP:{i:07d}" for i in rng.choice(30, size=3, replace=False)]}
+            for d in range(60)
+        }
+        diseases = DiseaseEmbeddingBuilder(store).average(disease_to_hps)
+        _, queries = average_query_embeddings(store, [
+            [f"HP:{i:07d}" for i in rng.choice(30, size=4, replace=False)] for _ in range(12)
+        ])
+        report = index_sweep(
+            diseases, queries, [("exact", hnsw_params("exact")), ("tiny", HNSWParams(4, 8, 4))], k=5,
+            query_batch_size=5,
+        )
+        self.assertEqual([row.name for row in report], ["exact", "tiny"])
+        self.assertEqual(report[0].recall_at_k, 1.0)
+        for row in report:
+            self.assertGreater(row.recall_at_k, 0)
+            self.assertGreater(row.query_ms, 0)
+        self.assertEqual(format_index_sweep(report, 5).splitlines()[0].split("\t")[-1], "recall_at_5")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+import chromadb
+import numpy as np
+
+from pheval_elder.prepare.core.data_processing.data_processor import DataProcessor
+from pheval_elder.prepare.core.data_processing.lazy_embeddings import (
+    ID_INDEX_DIR,
+    LazyHPEmbeddings,
+    build_chroma_id_index,
+    load_or_create_chroma_id_index,
+)
+from pheval_elder.prepare.core.query.query_service import QueryService
+from pheval_elder.prepare.core.store.chromadb_manager import ChromaDBManager
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore
+
+
+class TestLazyHPEmbeddings(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        # curateGPT ids differ from the HPO ids, which only live in the _json metadata
+        self.entries = [
+            ("0", "HP:0000001", "All", [1.0, 0.0]),
+            ("1", "HP:0000002", "Two", [0.0, 1.0]),
+            ("hpo_3", "HP:0000003", "Three", [1.0, 1.0]),
+        ]
+        self.client = chromadb.PersistentClient(path=str(Path(self.tmp.name) / "db"))
+        self.collection = self.client.get_or_create_collection("ont_hp", metadata={"hnsw:space": "cosine"})
+        self.collection.add(
+            ids=[e[0] for e in self.entries],
+            embeddings=[e[3] for e in self.entries],
+            metadatas=[{"_json": json.dumps({"original_id": e[1], "label": e[2]})} for e in self.entries],
+        )
+        self.store_dir = Path(self.tmp.name) / "elder_embeddings"
+        self.bulk_loads = 0
+        self.index_loads = 0
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _bulk_loader(self):
+        self.bulk_loads += 1
+        return HPEmbeddingStore.from_embeddings_dict(
+            {e[1]: {"label": e[2], "embeddings": e[3]} for e in self.entries}
+        )
+
+    def _id_index_loader(self):
+        self.index_loads += 1
+        return load_or_create_chroma_id_index(
+            self.store_dir, self.collection, ChromaDBManager.collection_fingerprint(self.collection)
+        )
+
+    def lazy(self, **kwargs):
+        return LazyHPEmbeddings(self.collection, self._bulk_loader, id_index_loader=self._id_index_loader, **kwargs)
+
+    def test_builds_id_index_from_json_metadata(self):
+        self.assertEqual(
+            build_chroma_id_index(self.collection, page_size=2),
+            {"HP:0000001": "0", "HP:0000002": "1", "HP:0000003": "hpo_3"},
+        )
+
+    def test_fetches_only_requested_ids(self):
+        lazy = self.lazy()
+        lazy.prefetch(["HP:0000001", "HP:0000003", "HP:9999999"])
+        self.assertEqual(self.bulk_loads, 0)
+        self.assertEqual(self.index_loads, 1)
+        np.testing.assert_array_equal(lazy["HP:0000003"]["embeddings"], [1.0, 1.0])
+        self.assertEqual(lazy["HP:0000001"]["label"], "All")
+        self.assertNotIn("HP:9999999", lazy)
+        self.assertEqual(set(lazy._cache), {"HP:0000001", "HP:0000003"})
+        self.assertEqual(self.index_loads, 1)
+
+    def test_id_index_is_persisted_and_rebuilt_when_stale(self):
+        fingerprint = ChromaDBManager.collection_fingerprint(self.collection)
+        load_or_create_chroma_id_index(self.store_dir, self.collection, fingerprint)
+        path = self.store_dir / ID_INDEX_DIR / "ont_hp.json"
+        self.assertTrue(path.exists())
+
+        self.collection.add(
+            ids=["4"], embeddings=[[0.5, 0.5]],
+            metadatas=[{"_json": json.dumps({"original_id": "HP:0000004", "label": "Four"})}],
+        )
+        # an unchanged fingerprint serves the persisted index
+        self.assertNotIn("HP:0000004", load_or_create_chroma_id_index(self.store_dir, self.collection, fingerprint))
+        index = load_or_create_chroma_id_index(
+            self.store_dir, self.collection, ChromaDBManager.collection_fingerprint(self.collection)
+        )
+        self.assertEqual(index["HP:0000004"], "4")
+
+    def test_id_index_comes_from_the_embedding_store(self):
+        data_processor = DataProcessor(SimpleNamespace(ont_hp=self.collection, path=self.tmp.name))
+        store = data_processor.hp_embedding_store
+        self.assertEqual(store.chroma_ids, ["0", "1", "hpo_3"])
+        self.assertEqual(HPEmbeddingStore.load(self.store_dir, "ont_hp").chroma_ids, store.chroma_ids)
+
+        index = load_or_create_chroma_id_index(self.store_dir, self.collection, data_processor.hp_collection_fingerprint)
+        self.assertEqual(index, {"HP:0000001": "0", "HP:0000002": "1", "HP:0000003": "hpo_3"})
+        # no metadata scan, so no separate index file
+        self.assertFalse((self.store_dir / ID_INDEX_DIR).exists())
+
+    def test_query_service_fetches_lazily(self):
+        data_processor = DataProcessor(SimpleNamespace(ont_hp=self.collection, path=self.tmp.name))
+        data_processor._disease_to_hps_with_frequencies = {}
+        query_service = QueryService(data_processor=data_processor, db_manager=data_processor.db_manager)
+        self.assertIsInstance(query_service.hp_embeddings, LazyHPEmbeddings)
+        np.testing.assert_allclose(query_service.hp_embeddings["HP:0000003"]["embeddings"], [1.0, 1.0])
+        self.assertFalse(query_service.hp_embeddings.bulk_loaded)
+        self.assertFalse(data_processor.lazy_embeddings)
+        self.assertIsNone(data_processor._hp_embedding_store)
+
+    def test_lru_evicts_oldest(self):
+        lazy = self.lazy(cache_size=1)
+        lazy["HP:0000001"]
+        lazy["HP:0000002"]
+        self.assertEqual(list(lazy._cache), ["HP:0000002"])
+
+    def test_switches_to_bulk_load(self):
+        lazy = self.lazy(bulk_threshold=2)
+        lazy["HP:0000001"]
+        lazy.prefetch(["HP:0000002", "HP:0000003"])
+        self.assertTrue(lazy.bulk_loaded)
+        self.assertEqual(self.bulk_loads, 1)
+        np.testing.assert_allclose(lazy["HP:0000002"]["embeddings"], [0.0, 1.0])
+
+    def test_iteration_forces_bulk_load(self):
+        lazy = self.lazy()
+        self.assertEqual(len(lazy), 3)
+        self.assertEqual(list(lazy), ["HP:0000001", "HP:0000002", "HP:0000003"])
+        self.assertEqual(self.bulk_loads, 1)
+        self.assertEqual(self.index_loads, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
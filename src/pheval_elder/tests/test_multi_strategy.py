@@ -0,0 +1,190 @@
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import chromadb
+import numpy as np
+
+from pheval_elder.prepare.core.collections.disease_embedding_builder import DiseaseEmbeddingBuilder
+from pheval_elder.prepare.core.multiprocessing.avg_multiprocessing import (
+    OptimizedAverageDiseaseEmbedAnalysis,
+    process_avg_analysis_parallel,
+)
+from pheval_elder.prepare.core.multiprocessing.best_match_multiprocessing import (
+    OptimizedTermSetPairwiseComparison,
+    process_phenotype_sets_parallel,
+)
+from pheval_elder.prepare.core.multiprocessing.multi_strategy_multiprocessing import (
+    BEST_MATCH_STRATEGIES,
+    process_multi_strategy_parallel,
+)
+from pheval_elder.prepare.core.multiprocessing.wgt_avg_multiprocessing import (
+    OptimizedWeightedAverageDiseaseEmbedAnalysis,
+)
+from pheval_elder.prepare.core.query.exact_search import SearchBackend
+from pheval_elder.prepare.core.query.ranked_results import DiseaseTable, RankedResults
+from pheval_elder.prepare.core.query.result_cache import ResultCache
+from pheval_elder.prepare.core.run.elder import ElderRunner
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore
+from pheval_elder.prepare.core.store.index_profiles import IndexProfile
+from pheval_elder.prepare.core.utils.similarity_measures import SimilarityMeasures
+
+
+class TestMultiStrategyPass(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(18)
+        store = HPEmbeddingStore.from_embeddings_dict({
+            f"HP:{i:07d}": {"label": f"term {i}", "embeddings": rng.normal(size=8).tolist()} for i in range(30)
+        })
+        disease_to_hps = {
+            f"OMIM:{d}": {"disease_name": f"disease {d}",
+                          "phenotypes": [f"HP:{i:07d}" for i in rng.choice(30, size=3, replace=False)]}
+            for d in range(40)
+        }
+        client = chromadb.PersistentClient(path=self.tmp.name)
+        builder = DiseaseEmbeddingBuilder(store)
+        collections = {}
+        # the "wgt_avg" collection gets different embeddings so mixed-up collections show up in the results
+        for strategy, diseases in (
+                ("avg", builder.average(disease_to_hps)),
+                ("wgt_avg", builder.average({d: {**data, "phenotypes": data["phenotypes"][:2]}
+                                             for d, data in disease_to_hps.items()})),
+        ):
+            collections[strategy] = client.create_collection(
+                f"multi_strategy_{strategy}", metadata={"hnsw:space": "cosine"}
+            )
+            collections[strategy].add(ids=list(diseases.disease_ids), embeddings=diseases.matrix.tolist())
+        self.collections = collections
+        self.data_processor = SimpleNamespace(
+            hp_embedding_store=store,
+            hp_embeddings=store.as_dict(),
+            disease_to_hps=disease_to_hps,
+            disease_table=DiseaseTable.from_disease_to_hps(disease_to_hps),
+            db_manager=SimpleNamespace(
+                path=self.tmp.name, host=None, port=8000,
+                disease_embeddings_collection=lambda strategy: collections[strategy],
+            ),
+        )
+        self.phenotype_sets = [
+            [f"HP:{i:07d}" for i in rng.choice(30, size=4, replace=False)] for _ in range(7)
+        ]
+        self.phenotype_sets.insert(3, ["HP:9999999"])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_one_pass_matches_single_strategy_runs(self):
+        tcp = OptimizedTermSetPairwiseComparison(self.data_processor)
+        tcp.precompute_similarities(self.phenotype_sets)
+        results = process_multi_strategy_parallel(self.phenotype_sets, {
+            "avg": OptimizedAverageDiseaseEmbedAnalysis(self.data_processor),
+            "wgt_avg": OptimizedWeightedAverageDiseaseEmbedAnalysis(self.data_processor),
+            "tpc": tcp,
+        }, 5, query_batch_size=3)
+
+        self.assertEqual(set(results), {"avg", "wgt_avg", "tpc"})
+        for strategy_results in results.values():
+            self.assertEqual(len(strategy_results), len(self.phenotype_sets))
+            self.assertEqual(len(strategy_results[3]), 0)
+
+        avg = process_avg_analysis_parallel(
+            self.phenotype_sets, OptimizedAverageDiseaseEmbedAnalysis(self.data_processor), 5
+        )
+        tcp = OptimizedTermSetPairwiseComparison(self.data_processor)
+        tcp.precompute_similarities(self.phenotype_sets)
+        tpc = process_phenotype_sets_parallel(self.phenotype_sets, tcp, 5)
+        table = self.data_processor.disease_table
+        for position, phenotype_set in enumerate(self.phenotype_sets):
+            self.assertEqual(results["avg"][position].rows.tolist(), avg[position].rows.tolist())
+            np.testing.assert_allclose(results["tpc"][position].scores, tpc[position].scores, atol=1e-6)
+            if position == 3:
+                continue
+            query = np.mean([self.data_processor.hp_embeddings[hp]["embeddings"] for hp in phenotype_set], axis=0)
+            expected = self.collections["wgt_avg"].query(query_embeddings=[query.tolist()], n_results=5)
+            self.assertEqual([table.disease_ids[row] for row in results["wgt_avg"][position].rows],
+                             expected["ids"][0])
+
+    def test_best_match_aggregations_share_one_pass(self):
+        store = self.data_processor.hp_embedding_store
+        rng = np.random.default_rng(25)
+        frequencies = {
+            disease_id: {
+                "phenotypes_and_frequencies": {hp: float(rng.uniform(0.05, 1)) for hp in data["phenotypes"][:2]}
+            }
+            for disease_id, data in self.data_processor.disease_to_hps.items()
+        }
+        self.data_processor.disease_to_hps_with_frequencies = frequencies
+        strategies = list(BEST_MATCH_STRATEGIES)
+
+        for memory_budget_bytes in (None, 1):
+            tcp = OptimizedTermSetPairwiseComparison(
+                self.data_processor, memory_budget_bytes=memory_budget_bytes,
+                aggregations=[BEST_MATCH_STRATEGIES[strategy] for strategy in strategies],
+            )
+            tcp.precompute_similarities(self.phenotype_sets)
+            results = process_multi_strategy_parallel(
+                self.phenotype_sets, {strategy: tcp for strategy in strategies}, 5
+            )
+            table = self.data_processor.disease_table
+            for position, phenotype_set in enumerate(self.phenotype_sets):
+                if position == 3:
+                    self.assertTrue(all(len(results[strategy][position]) == 0 for strategy in strategies))
+                    continue
+                query = store.unit_vectors(phenotype_set)
+                expected = {strategy: {} for strategy in strategies}
+                for disease_id, data in self.data_processor.disease_to_hps.items():
+                    block = query @ store.unit_vectors(data["phenotypes"]).T
+                    disease_frequencies = frequencies[disease_id]["phenotypes_and_frequencies"]
+                    weights = np.array([disease_frequencies.get(hp, 0.5) for hp in data["phenotypes"]])
+                    expected["tpc"][disease_id] = block.max(axis=1).mean()
+                    expected["tpc_sym"][disease_id] = (block.max(axis=1).mean() + block.max(axis=0).mean()) / 2
+                    expected["tpc_max"][disease_id] = block.max()
+                    expected["tpc_wgt"][disease_id] = (block * weights).max(axis=1).mean()
+                for strategy in strategies:
+                    ranked = results[strategy][position]
+                    ranked_ids = [table.disease_ids[row] for row in ranked.rows]
+                    np.testing.assert_allclose(ranked.scores, [expected[strategy][d] for d in ranked_ids], atol=1e-5)
+                    np.testing.assert_allclose(
+                        ranked.scores, sorted(expected[strategy].values(), reverse=True)[:5], atol=1e-5
+                    )
+
+
+class TestCachedMultiStrategyAnalysis(unittest.TestCase):
+    def setUp(self):
+        # the runner's collections and data processor are not needed with a stubbed pass
+        self.runner = ElderRunner.__new__(ElderRunner)
+        self.runner.use_result_cache = True
+        self.runner.result_cache = ResultCache()
+        self.runner.similarity_measure = SimilarityMeasures.COSINE
+        self.runner.search_backend = SearchBackend.CHROMA
+        self.runner.index_profile = IndexProfile.BALANCED
+        self.runner.tcp_similarity_matrix = False
+        self.runner.model_fingerprint = lambda: {"hp_collection": "abc"}
+        self.passes = []
+        self.runner._multi_strategy_pass = self.multi_strategy_pass
+
+    def multi_strategy_pass(self, phenotype_sets, nr_of_results, strategies):
+        self.passes.append((tuple(strategies), [list(phenotype_set) for phenotype_set in phenotype_sets]))
+        return {
+            strategy: [RankedResults(rows=[len(phenotype_set)], scores=[float(position)])
+                       for position, phenotype_set in enumerate(phenotype_sets)]
+            for strategy in strategies
+        }
+
+    def test_several_strategies_run_in_one_pass(self):
+        strategies = ["avg", "wgt_avg", "tpc"]
+        # the third set is the first one with a duplicated term, both share one cache key
+        phenotype_sets = [["HP:0000002", "HP:0000001"], ["HP:0000003"], ["HP:0000001", "HP:0000002", "HP:0000001"]]
+        results = self.runner.multi_strategy_analysis(phenotype_sets, 5, strategies)
+        self.assertEqual(self.passes, [(tuple(strategies), [["HP:0000001", "HP:0000002"], ["HP:0000003"]])])
+        for strategy in strategies:
+            self.assertEqual([ranked.rows.tolist() for ranked in results[strategy]], [[2], [1], [2]])
+
+        again = self.runner.multi_strategy_analysis(phenotype_sets + [["HP:0000004"]], 5, strategies)
+        self.assertEqual(self.passes[1:], [(tuple(strategies), [["HP:0000004"]])])
+        self.assertIs(again["tpc"][0], results["tpc"][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
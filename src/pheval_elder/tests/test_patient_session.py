@@ -0,0 +1,75 @@
+import unittest
+
+import numpy as np
+
+from pheval_elder.prepare.core.collections.disease_embedding_builder import DiseaseEmbeddingBuilder
+from pheval_elder.prepare.core.query.exact_search import ExactDiseaseSearch, exact_search_analysis
+from pheval_elder.prepare.core.query.patient_session import PatientSession
+from pheval_elder.prepare.core.query.ranked_results import DiseaseTable
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore
+
+
+class TestPatientSession(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(20)
+        self.store = HPEmbeddingStore.from_embeddings_dict({
+            f"HP:{i:07d}": {"label": f"term {i}", "embeddings": rng.normal(size=8).tolist()} for i in range(30)
+        })
+        disease_to_hps = {
+            f"OMIM:{d}": {"disease_name": f"disease {d}",
+                          "phenotypes": [f"HP:{i:07d}" for i in rng.choice(30, size=3, replace=False)]}
+            for d in range(50)
+        }
+        # a disease without embedded phenotypes is in the table but not in the search
+        disease_to_hps["OMIM:999"] = {"disease_name": "unembedded", "phenotypes": ["HP:9999999"]}
+        self.table = DiseaseTable.from_disease_to_hps(disease_to_hps)
+        self.search = ExactDiseaseSearch.from_disease_embeddings(DiseaseEmbeddingBuilder(self.store).average(disease_to_hps))
+
+    def session(self, **kwargs):
+        return PatientSession(search=self.search, store=self.store, table=self.table, nr_of_results=5, **kwargs)
+
+    def expected(self, phenotype_set):
+        return exact_search_analysis(self.search, self.store, [phenotype_set], 5, self.table)[0]
+
+    def test_updates_match_a_fresh_analysis(self):
+        session = self.session()
+        self.assertEqual(len(session.rescore().results), 0)
+        steps = [("add", "HP:0000001"), ("add", "HP:0000007"), ("add", "HP:0000001"), ("add", "HP:9999999"),
+                 ("add", "HP:0000012"), ("remove", "HP:0000001"), ("remove", "HP:0000007")]
+        terms = []
+        for action, hp_id in steps:
+            update = getattr(session, action)(hp_id)
+            if action == "add" and hp_id in self.store:
+                terms.append(hp_id)
+            elif action == "remove":
+                terms.remove(hp_id)
+            expected = self.expected(terms)
+            self.assertEqual(update.results.rows.tolist(), expected.rows.tolist())
+            np.testing.assert_allclose(update.results.scores, expected.scores, atol=1e-5)
+        self.assertEqual(session.terms, ["HP:0000001", "HP:0000012"])
+        self.assertEqual(len(session), 2)
+
+        session.remove("HP:0000001")
+        self.assertEqual(len(session.remove("HP:0000012").results), 0)
+        self.assertIsNone(session.embedding)
+        with self.assertRaises(KeyError):
+            session.remove("HP:0000012")
+
+    def test_rank_deltas(self):
+        session = self.session(rank_deltas=True)
+        self.assertIsNone(session.add("HP:0000003").rank_delta)
+        before = self.search.distances(session.embedding[None, :])[0]
+        update = session.add("HP:0000021")
+        after = self.search.distances(session.embedding[None, :])[0]
+
+        table_rows = self.table.rows(self.search.disease_ids)
+        ranks_before = np.argsort(np.argsort(before, kind="stable"), kind="stable")
+        ranks_after = np.argsort(np.argsort(after, kind="stable"), kind="stable")
+        self.assertEqual(update.rank_delta.shape, (len(self.table),))
+        np.testing.assert_array_equal(update.rank_delta[table_rows], ranks_before - ranks_after)
+        self.assertEqual(update.rank_delta[self.table.index["OMIM:999"]], 0)
+        self.assertEqual(update.results.rows.tolist(), self.expected(["HP:0000003", "HP:0000021"]).rows.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+import numpy as np
+
+from pheval_elder.prepare.core.query.ranked_results import DiseaseTable, RankedResults
+
+
+class TestRankedResults(unittest.TestCase):
+    def setUp(self):
+        self.table = DiseaseTable.from_disease_to_hps({
+            "OMIM:1": {"disease_name": "one", "phenotypes": ["HP:1"]},
+            "OMIM:2": {"disease_name": "two", "phenotypes": ["HP:2"]},
+            "OMIM:3": {"disease_name": "three", "phenotypes": ["HP:3"]},
+        })
+
+    def test_rows_are_compact(self):
+        ranked = RankedResults.from_ids(self.table, ["OMIM:3", "OMIM:9", "OMIM:1"], [0.1, 0.2, 0.3])
+        self.assertEqual(ranked.rows.dtype, np.int32)
+        self.assertEqual(ranked.scores.dtype, np.float32)
+        self.assertEqual(ranked.rows.tolist(), [2, 0])
+        self.assertEqual(self.table.rows(["OMIM:2", "OMIM:9"]).tolist(), [1, -1])
+
+    def test_names_are_resolved_at_write_time(self):
+        results = RankedResults(rows=[1, 2], scores=[0.9, 0.4]).to_pheval_results(self.table)
+        self.assertEqual([r.disease_identifier for r in results], ["OMIM:2", "OMIM:3"])
+        self.assertEqual([r.disease_name for r in results], ["two", "three"])
+        self.assertAlmostEqual(results[1].score, 0.4, places=6)
+        self.assertFalse(RankedResults.empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
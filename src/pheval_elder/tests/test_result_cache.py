@@ -0,0 +1,73 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from pheval_elder.prepare.core.query.ranked_results import RankedResults
+from pheval_elder.prepare.core.query.result_cache import (
+    ResultCache,
+    canonical_phenotype_set,
+    result_cache_key,
+)
+
+
+def _key(phenotype_set, k=10):
+    return result_cache_key(phenotype_set, "avg/chroma", {"hp_collection": "abc"}, "cosine", k)
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.calls = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def analysis(self, phenotype_sets):
+        self.calls.append(phenotype_sets)
+        return [RankedResults(rows=[int(s[0].split(":")[1]), 0], scores=[0.25, 0.5]) for s in phenotype_sets]
+
+    def test_canonical_key(self):
+        # HP:0000735 is obsolete and replaced by HP:0012760
+        self.assertEqual(canonical_phenotype_set(["HP:0000003", "HP:0000735", "HP:0000003"]),
+                         ("HP:0000003", "HP:0012760"))
+        self.assertEqual(_key(["HP:0012760", "HP:0000003"]), _key(["HP:0000003", "HP:0000735", "HP:0000003"]))
+        self.assertNotEqual(_key(["HP:0000003"]), _key(["HP:0000003"], k=20))
+
+    def test_only_missing_sets_are_analysed(self):
+        cache = ResultCache()
+        phenotype_sets = [["HP:1", "HP:2"], ["HP:3"], ["HP:2", "HP:1"]]
+        first = cache.cached_analysis(phenotype_sets, _key, self.analysis)
+        self.assertEqual(self.calls, [[["HP:1", "HP:2"], ["HP:3"]]])
+        self.assertIs(first[0], first[2])
+
+        second = cache.cached_analysis([["HP:3"], ["HP:4"]], _key, self.analysis)
+        self.assertEqual(self.calls[-1], [["HP:4"]])
+        self.assertIs(second[0], first[1])
+        self.assertEqual((cache.stats.hits, cache.stats.misses), (2, 3))
+
+    def test_scores_canonical_set(self):
+        cache = ResultCache()
+        phenotype_sets = [["HP:0000735", "HP:0000003", "HP:0000003"], ["HP:0012760", "HP:0000003"]]
+        results = cache.cached_analysis(phenotype_sets, _key, self.analysis)
+        self.assertEqual(self.calls, [[["HP:0000003", "HP:0012760"]]])
+        self.assertIs(results[0], results[1])
+
+    def test_lru_and_disk_tiers(self):
+        cache = ResultCache(directory=self.tmp.name, max_entries=1)
+        cache.cached_analysis([["HP:1"], ["HP:2"]], _key, self.analysis)
+        self.assertEqual(len(cache), 1)
+        self.assertIsNotNone(cache.get(_key(["HP:1"])))
+        self.assertEqual(cache.stats.disk_hits, 1)
+
+        reopened = ResultCache(directory=self.tmp.name)
+        results = reopened.cached_analysis([["HP:2"], ["HP:1"]], _key, self.analysis)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(reopened.stats.disk_hits, 2)
+        np.testing.assert_array_equal(results[0].rows, [2, 0])
+        np.testing.assert_array_equal(results[0].scores, np.float32([0.25, 0.5]))
+        self.assertEqual(results[0].rows.dtype, np.int32)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import multiprocessing as mp
+import tempfile
+import unittest
+
+import chromadb
+import numpy as np
+
+from pheval_elder.prepare.core.multiprocessing.shared_data import (
+    SharedDataPlane,
+    attach_shared_data,
+    shared,
+    shared_collection,
+    shared_store,
+)
+from pheval_elder.prepare.core.store.embedding_store import EmbeddingPrecision, HPEmbeddingStore
+
+
+def _row_sums(rows):
+    matrix = shared("matrix")
+    return [(shared("offset") + float(matrix[row].sum()), matrix.flags.writeable) for row in rows]
+
+
+def _store_vector(hp_id):
+    return shared_store().vector(hp_id).tolist()
+
+
+def _nearest_ids(query):
+    return shared_collection("disease").query(query_embeddings=[query], n_results=1)["ids"][0]
+
+
+class TestSharedDataPlane(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.matrix = np.arange(12, dtype=np.float32).reshape(4, 3)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_workers_attach_read_only(self):
+        with SharedDataPlane(self.tmp.name) as plane:
+            plane.publish("matrix", self.matrix)
+            plane.publish_object("offset", 100.0)
+            with plane.pool(2, context=mp.get_context("spawn")) as pool:
+                results = pool.map(_row_sums, [[0, 1], [2, 3]])
+        flat = [r for batch in results for r in batch]
+        self.assertEqual([s for s, _ in flat], [100.0 + float(row.sum()) for row in self.matrix])
+        self.assertFalse(any(writeable for _, writeable in flat))
+
+    def test_close_removes_published_files(self):
+        plane = SharedDataPlane(self.tmp.name)
+        handle = plane.publish("matrix", self.matrix)
+        plane.close()
+        self.assertFalse(plane.directory.exists())
+        self.assertEqual(handle.shape, (4, 3))
+
+    def test_persisted_store_is_shared_by_path(self):
+        store = HPEmbeddingStore(ids=["HP:1", "HP:2", "HP:3", "HP:4"], labels=list("abcd"), matrix=self.matrix)
+        store = store.with_precision(EmbeddingPrecision.INT8)
+        store.save(self.tmp.name, "hpo")
+        with SharedDataPlane(self.tmp.name) as plane:
+            plane.publish_store(store)
+            self.assertEqual(plane.arrays["hp.matrix"].path, str(store.path))
+            attach_shared_data(*plane.initargs())
+            np.testing.assert_array_equal(shared_store().vector("HP:3"), store.vector("HP:3"))
+            with plane.pool(2, context=mp.get_context("spawn")) as pool:
+                vectors = pool.map(_store_vector, ["HP:2", "HP:4"])
+        np.testing.assert_allclose(vectors, store.vectors(["HP:2", "HP:4"]))
+
+    def test_normalized_store_keeps_norms(self):
+        store = HPEmbeddingStore.from_embeddings_dict({
+            f"HP:{i}": {"label": str(i), "embeddings": row.tolist()} for i, row in enumerate(self.matrix)
+        })
+        with SharedDataPlane(self.tmp.name) as plane:
+            plane.publish_store(store)
+            attach_shared_data(*plane.initargs())
+            self.assertTrue(shared_store().normalized)
+            np.testing.assert_allclose(shared_store().vector("HP:3"), self.matrix[3], rtol=1e-6)
+
+    def test_workers_open_their_own_collection(self):
+        collection = chromadb.PersistentClient(path=self.tmp.name).create_collection("shared_collection_test")
+        collection.add(ids=[f"OMIM:{i}" for i in range(4)], embeddings=self.matrix.tolist())
+        with SharedDataPlane(self.tmp.name) as plane:
+            plane.publish_collection("disease", self.tmp.name, collection.name)
+            with plane.pool(2, context=mp.get_context("spawn")) as pool:
+                nearest = pool.map(_nearest_ids, self.matrix.tolist())
+        self.assertEqual(nearest, [[f"OMIM:{i}"] for i in range(4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
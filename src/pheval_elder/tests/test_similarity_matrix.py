@@ -0,0 +1,75 @@
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from pheval_elder.prepare.core.multiprocessing.best_match_multiprocessing import (
+    OptimizedTermSetPairwiseComparison,
+    process_phenotype_sets_parallel,
+)
+from pheval_elder.prepare.core.query.ranked_results import DiseaseTable
+from pheval_elder.prepare.core.store.embedding_store import HPEmbeddingStore
+from pheval_elder.prepare.core.store.similarity_matrix import HPSimilarityMatrix
+
+
+class TestSimilarityMatrix(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(23)
+        self.store = HPEmbeddingStore.from_embeddings_dict({
+            f"HP:{i:07d}": {"label": f"term {i}", "embeddings": rng.normal(size=8).tolist()} for i in range(30)
+        })
+        self.store.fingerprint = {"name": "hp", "count": 30}
+        self.rng = rng
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_build_and_load(self):
+        self.assertIsNone(HPSimilarityMatrix.load(self.tmp.name, "hp"))
+        # a tile size that does not divide the term count exercises the ragged edge tiles
+        built = HPSimilarityMatrix.build(self.store, self.tmp.name, "hp", tile_size=7, workers=3)
+        loaded = HPSimilarityMatrix.load(self.tmp.name, "hp")
+
+        units = self.store.unit(slice(None))
+        for matrix in (built, loaded):
+            self.assertEqual(matrix.matrix.dtype, np.float16)
+            np.testing.assert_allclose(matrix.matrix, units @ units.T, atol=1e-3)
+            np.testing.assert_array_equal(matrix.matrix, matrix.matrix.T)
+            self.assertTrue(matrix.matches(self.store))
+        self.assertEqual(loaded.rows(["HP:0000004", "HP:9999999", "HP:0000002"]).tolist(), [4, 2])
+
+        self.store.fingerprint = {"name": "hp", "count": 31}
+        self.assertFalse(loaded.matches(self.store))
+
+    def test_best_match_lookups_match_computed_similarities(self):
+        disease_to_hps = {
+            f"OMIM:{d}": {"disease_name": f"disease {d}",
+                          "phenotypes": [f"HP:{i:07d}" for i in self.rng.choice(30, size=4, replace=False)]}
+            for d in range(20)
+        }
+        disease_to_hps["OMIM:99"] = {"disease_name": "unembedded", "phenotypes": ["HP:9999999"]}
+        data_processor = SimpleNamespace(
+            hp_embedding_store=self.store, hp_embeddings=self.store.as_dict(), disease_to_hps=disease_to_hps,
+            disease_table=DiseaseTable.from_disease_to_hps(disease_to_hps),
+        )
+        phenotype_sets = [[f"HP:{i:07d}" for i in self.rng.choice(30, size=3, replace=False)] for _ in range(6)]
+        phenotype_sets[1].append("HP:9999999")
+        matrix = HPSimilarityMatrix.build(self.store, self.tmp.name, "hp")
+
+        tcp = OptimizedTermSetPairwiseComparison(data_processor)
+        tcp.precompute_similarities(phenotype_sets)
+        results = process_phenotype_sets_parallel(phenotype_sets, tcp, 5)
+        lookup = OptimizedTermSetPairwiseComparison(data_processor, similarity_matrix=matrix)
+        lookup.precompute_similarities(phenotype_sets)
+        self.assertIs(lookup.all_similarities, matrix.matrix)
+        lookup_results = process_phenotype_sets_parallel(phenotype_sets, lookup, 5)
+
+        for ranked, lookup_ranked in zip(results, lookup_results):
+            np.testing.assert_allclose(lookup_ranked.scores, ranked.scores, atol=1e-3)
+            self.assertEqual(len(lookup_ranked), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()